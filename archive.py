@@ -0,0 +1,189 @@
+# this module archives closed days of the books and candles tables to parquet files partitioned
+# by exchange, market and day (hive layout, e.g. books/exchange=x/market=dcr_btc/day=2024-01-01)
+# and optionally prunes them from sqlite. the archives table holds the day up to which each
+# table has been exported, rows before it are read from parquet and later ones from sqlite.
+import datetime
+import logging
+import os
+import shutil
+import uuid
+import pandas as pd
+import dbmgr
+import rollups
+
+# pyarrow is optional and slow to import, checkArrow imports it on first use
+pa = None
+ds = None
+
+logger = logging.getLogger(__name__)
+
+# archived tables with their time column and columns, the exchange and market names and the day
+# are added as partition columns
+archiveTables = {'books': {'timeCol': 'TimeStamp',
+                           'cols': ['marketID', 'TimeStamp', 'side', 'rate', 'qty']},
+                 'candles': {'timeCol': 'timeOpen',
+                             'cols': ['marketID', 'period', 'timeOpen', 'timeClose', 'baseVolume',
+                                      'quoteVolume', 'high', 'low', 'open', 'close']}}
+partitionCols = ['exchange', 'market', 'day']
+
+
+def partitioning():
+    # partition values are read back as text, days compare as YYYY-MM-DD strings
+    return ds.partitioning(pa.schema([(col, pa.string()) for col in partitionCols]), flavor='hive')
+
+
+def checkArrow():
+    global pa, ds
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.dataset
+        except ImportError:
+            raise Exception('pyarrow is required for the parquet archive')
+        pa, ds = pyarrow, pyarrow.dataset
+
+
+def archivedUntil(path, tableName):
+    # the first day not yet archived, None if nothing has been
+    data = dbmgr.freeQuery(path, 'select archivedUntil from archives where tableName = ?', (tableName,))
+    return data['archivedUntil'].iloc[0] if len(data) else None
+
+
+def toFrame(chunk, timeCols):
+    # stored timestamps are text, with or without a fraction
+    for col in timeCols:
+        chunk[col] = pd.to_datetime(chunk[col], format='ISO8601')
+    return chunk
+
+
+def inline(func, *args):
+    return func(*args)
+
+
+# this function exports the days of tableName from the last archived day up to (excluding)
+# before to parquet under root and records the new archived day. days already present in the
+# archive are replaced so an interrupted export can simply run again. the export only reads,
+# write runs the database write that records the day, see archiveAll. returns the rows written
+def exportTable(path, root, tableName, before, chunkSize=None, write=inline):
+    checkArrow()
+    spec = archiveTables[tableName]
+    timeCol = spec['timeCol']
+    before = pd.Timestamp(before).strftime('%Y-%m-%d')
+    since = archivedUntil(path, tableName)
+    if since is not None and since >= before:
+        return 0
+    cols = ', '.join(f't.{col}' for col in spec['cols'])
+    queryStr = f"""
+        select e.name as exchange, m.name as market, substr(t.{timeCol}, 1, 10) as day, {cols}
+        FROM {tableName} t
+        join markets m on t.marketID = m.ID
+        join exchanges e on m.exchangeID = e.ID
+        where t.{timeCol} < ?{f' and t.{timeCol} >= ?' if since is not None else ''}
+        """
+    params = [before] if since is None else [before, since]
+    base = os.path.join(root, tableName)
+    timeCols = [col for col in spec['cols'] if col in (timeCol, 'timeClose')]
+    run = uuid.uuid4().hex
+    rows = 0
+    cleared = set()
+    for number, chunk in enumerate(dbmgr.iterQuery(path, queryStr, params, chunkSize)):
+        table = pa.Table.from_pandas(toFrame(chunk, timeCols), preserve_index=False)
+        # drop what a previous attempt wrote for these days before the first write to them
+        for day in set(chunk['day']).difference(cleared):
+            clearDay(base, day)
+            cleared.add(day)
+        ds.write_dataset(table, base, format='parquet', partitioning=partitioning(),
+                         basename_template=f'{run}-{number}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        rows += len(chunk)
+    write(recordArchived, path, tableName, before)
+    logger.info(f'{rows} {tableName} rows archived up to {before}')
+    return rows
+
+
+def recordArchived(path, tableName, before):
+    with dbmgr.getSession(path).write() as conn:
+        conn.execute('INSERT INTO archives ( tableName, archivedUntil ) VALUES ( ?, ? ) '
+                     'ON CONFLICT ( tableName ) DO UPDATE SET archivedUntil = excluded.archivedUntil',
+                     (tableName, before))
+        dbmgr.tableWritten(conn, 'archives')
+
+
+def clearDay(base, day):
+    # removes the partitions of a day for every exchange and market
+    if not os.path.isdir(base):
+        return
+    for exchange in os.listdir(base):
+        for market in os.listdir(os.path.join(base, exchange)):
+            folder = os.path.join(base, exchange, market, f'day={day}')
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+
+
+# this function deletes archived rows from sqlite. candles are only pruned before the weeks and
+# months rollups.updateRollups still reads when candles arrive for the archived day
+def pruneTable(path, tableName):
+    until = archivedUntil(path, tableName)
+    if until is None:
+        return 0
+    if tableName == 'candles':
+        until = rollups.periodStart(pd.Series([pd.Timestamp(until)]), '1mo')
+        until = rollups.periodStart(until, '1w').iloc[0].strftime('%Y-%m-%d')
+    timeCol = archiveTables[tableName]['timeCol']
+    with dbmgr.getSession(path).write() as conn:
+        rows = conn.execute(f'DELETE FROM {tableName} WHERE {timeCol} < ?', (until,)).rowcount
+        dbmgr.tableWritten(conn, tableName)
+    logger.info(f'{rows} {tableName} rows pruned before {until}')
+    return rows
+
+
+# this function archives every table up to retainDays before today, optionally pruning them.
+# write(func, *args) runs the database writes, e.g. through a dbmgr.GroupWriter so the writer
+# isn't held for the export
+def archiveAll(path, root, retainDays=30, prune=False, chunkSize=None, write=inline):
+    before = datetime.date.today() - datetime.timedelta(days=retainDays)
+    rows = {}
+    for tableName in archiveTables:
+        rows[tableName] = exportTable(path, root, tableName, before, chunkSize, write)
+        if prune:
+            write(pruneTable, path, tableName)
+    return rows
+
+
+# this function reads tableName between start and end (inclusive, either can be None) for the
+# given market IDs, from parquet for the archived days and from sqlite for the rest. columns
+# selects the table columns to return, only those are read from the parquet files and the
+# time and market filters are pushed down to the partitions and row groups
+def readTable(path, root, tableName, start=None, end=None, marketIDs=None, columns=None):
+    spec = archiveTables[tableName]
+    timeCol = spec['timeCol']
+    columns = list(spec['cols'] if columns is None else columns)
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    until = archivedUntil(path, tableName)
+    frames = []
+    base = os.path.join(root, tableName)
+    if until is not None and (start is None or start < pd.Timestamp(until)) and os.path.isdir(base):
+        checkArrow()
+        dataset = ds.dataset(base, format='parquet', partitioning=partitioning())
+        # the day partitions prune whole directories, the time filter the row groups
+        condition = ds.field('day') < until
+        if start is not None:
+            condition &= (ds.field('day') >= start.strftime('%Y-%m-%d')) & (ds.field(timeCol) >= start)
+        if end is not None:
+            condition &= (ds.field('day') <= end.strftime('%Y-%m-%d')) & (ds.field(timeCol) <= end)
+        if marketIDs is not None:
+            condition &= ds.field('marketID').isin([int(marketID) for marketID in marketIDs])
+        frames.append(dataset.to_table(columns=columns, filter=condition).to_pandas())
+    if end is None or until is None or end >= pd.Timestamp(until):
+        hotStart = start if until is None or (start is not None and start > pd.Timestamp(until)) else until
+        filters = {timeCol: (hotStart, end)}
+        if marketIDs is not None:
+            filters['marketID'] = [int(marketID) for marketID in marketIDs]
+        hot = dbmgr.readTable(path, tableName, columns, filters=filters)
+        frames.append(toFrame(hot, [col for col in columns if col in (timeCol, 'timeClose')]))
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    output = pd.concat(frames, ignore_index=True)
+    return output.sort_values(by=[timeCol], kind='stable', ignore_index=True)
@@ -0,0 +1,82 @@
+# compares scans of a synthetic books table in sqlite against the same rows exported to the
+# parquet archive: a full aggregation over two columns and a one market, one day window read
+# through archive.readTable, plus the size of each backend on disk.
+# run from the repository root: python -m benchmarks.archive_bench
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import pyarrow.dataset as ds
+import archive
+import dbmgr
+
+
+def fillBooks(path, rows, markets, levels, interval):
+    # one snapshot of levels per side every interval minutes per market, generated in sqlite
+    dbmgr.initalizeDB(path)
+    conn = dbmgr.dbConnect(path)[0]
+    conn.execute('INSERT INTO exchanges ( name ) VALUES ( ? )', ('bench',))
+    conn.executemany('INSERT INTO markets ( exchangeID, name, base, quote ) VALUES ( 1, ?, ?, ? )',
+                     [(f'asset{i}_btc', f'asset{i}', 'btc') for i in range(markets)])
+    conn.execute("""
+        INSERT INTO books ( marketID, TimeStamp, side, rate, qty )
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+        SELECT m.ID, datetime('2024-01-01', '+' || (n.i / ? * ?) || ' minutes'), (n.i / ?) % 2,
+        1000000 + n.i % ?, 100000000 + n.i % 997
+        FROM markets m, n ORDER BY m.ID, n.i
+        """, (rows // markets, 2 * levels, interval, levels, levels))
+    conn.commit()
+    conn.close()
+
+
+def median(func, repeat):
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+def folderBytes(folder):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(folder) for name in names)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--markets', type=int, default=20)
+    parser.add_argument('--levels', type=int, default=50, help='levels per side per snapshot')
+    parser.add_argument('--interval', type=int, default=5, help='minutes between snapshots')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        root = os.path.join(folder, 'archive')
+        fillBooks(path, args.rows, args.markets, args.levels, args.interval)
+        last = dbmgr.freeQuery(path, 'select max(TimeStamp) as t from books')['t'].iloc[0]
+        start = time.perf_counter()
+        archive.exportTable(path, root, 'books', '2100-01-01')
+        export = time.perf_counter() - start
+        sqliteBytes = os.path.getsize(path)
+        parquetBytes = folderBytes(root)
+        # the same window from each backend, the hot read bypasses the archive
+        window = {'start': '2024-01-02 00:00:00', 'end': '2024-01-02 23:59:59', 'marketIDs': [3]}
+        timings = {
+            'aggregate': (
+                lambda: dbmgr.freeQuery(path, 'select marketID, sum(qty) as qty from books group by marketID'),
+                lambda: ds.dataset(os.path.join(root, 'books'), format='parquet', partitioning=archive.partitioning())
+                .to_table(columns=['marketID', 'qty']).group_by('marketID').aggregate([('qty', 'sum')])),
+            'window': (
+                lambda: dbmgr.readTable(path, 'books', ['TimeStamp', 'rate', 'qty'],
+                                        filters={'TimeStamp': (window['start'], window['end']), 'marketID': [3]}),
+                lambda: archive.readTable(path, root, 'books', window['start'], window['end'], [3],
+                                          ['TimeStamp', 'rate', 'qty'])),
+            }
+        print(f'{args.rows} rows, {args.markets} markets, last snapshot {last}, export {export:.1f}s')
+        print(f'{"backend":<8} {"MB":>8} {"aggregate ms":>13} {"window ms":>10}')
+        results = {name: [median(func, args.repeat) for func in funcs] for name, funcs in timings.items()}
+        for index, (backend, size) in enumerate([('sqlite', sqliteBytes), ('parquet', parquetBytes)]):
+            print(f'{backend:<8} {size / 2**20:>8.1f} {results["aggregate"][index]:>13.1f} {results["window"][index]:>10.1f}')
+        dbmgr.closeSessions()
@@ -0,0 +1,94 @@
+# writes the same evolving order books to the books table and to the delta encoded bookstore,
+# then reports the on disk size of each layout and the latency of reading the book of a
+# market as of a random timestamp.
+# run from the repository root: python -m benchmarks.bookstore_bench
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import bookstore
+import collector
+import dbmgr
+
+
+def evolveBooks(rng, levels, changeRate):
+    # yields order books where changeRate of the levels change, appear or disappear each step
+    rates = np.sort(rng.choice(np.arange(900000, 1100000, 100), levels, replace=False))
+    qtys = rng.integers(1, 50, levels) * 100000000
+    while True:
+        sides = np.where(rates < 1000000, 'buy', 'sell')
+        yield pd.DataFrame({'rate': rates, 'qty': qtys, 'side': sides})
+        changed = rng.random(len(rates)) < changeRate
+        qtys = np.where(changed, rng.integers(1, 50, len(rates)) * 100000000, qtys)
+        # replace a few levels with new rates
+        moved = rng.random(len(rates)) < changeRate / 2
+        rates = np.where(moved, rng.integers(9000, 11000, len(rates)) * 100, rates)
+        rates, index = np.unique(rates, return_index=True)
+        qtys = qtys[index]
+
+
+def tableBytes(path, tableNames):
+    with dbmgr.getSession(path).read() as conn:
+        sizes = conn.execute(f'SELECT sum(pgsize) FROM dbstat WHERE name IN ({", ".join("?" * len(tableNames))})',
+                             tableNames).fetchone()[0]
+    return sizes or 0
+
+
+def readLevels(path, marketID, timeStamp):
+    # latest books table snapshot at or before timeStamp
+    return dbmgr.freeQuery(path, 'SELECT rate, qty, side FROM books WHERE marketID = ? AND TimeStamp = '
+                                 '(SELECT max(TimeStamp) FROM books WHERE marketID = ? AND TimeStamp <= ?) '
+                                 'ORDER BY rate', (marketID, marketID, str(timeStamp)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', type=int, default=5)
+    parser.add_argument('--snapshots', type=int, default=1000)
+    parser.add_argument('--levels', type=int, default=200)
+    parser.add_argument('--change', type=float, default=0.05, help='fraction of levels changing per snapshot')
+    parser.add_argument('--keyframe', type=int, default=60)
+    parser.add_argument('--reads', type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(1)
+    start = datetime.datetime(2024, 1, 1)
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {layout: os.path.join(folder, f'{layout}.db') for layout in ['levels', 'delta']}
+        for path in paths.values():
+            dbmgr.initalizeDB(path)
+        writeTimes = {'levels': 0.0, 'delta': 0.0}
+        for marketID in range(1, args.markets + 1):
+            books = evolveBooks(rng, args.levels, args.change)
+            market = {'marketID': marketID, 'exchangeName': 'bench', 'name': f'market{marketID}'}
+            for snapshot in range(args.snapshots):
+                book = next(books)
+                timeStamp = start + datetime.timedelta(minutes=snapshot, microseconds=1000 * marketID)
+                for layout, path in paths.items():
+                    begin = time.perf_counter()
+                    collector.storeBook(path, market, book.copy(), timeStamp, layout, args.keyframe)
+                    writeTimes[layout] += time.perf_counter() - begin
+        sizes = {'levels': tableBytes(paths['levels'], ['books']),
+                 'delta': tableBytes(paths['delta'], ['bookLevels', 'bookSnapshots'])}
+        readTimes = {'levels': [], 'delta': []}
+        for i in range(args.reads):
+            marketID = int(rng.integers(1, args.markets + 1))
+            timeStamp = start + datetime.timedelta(seconds=int(rng.integers(60, args.snapshots * 60)))
+            begin = time.perf_counter()
+            expected = readLevels(paths['levels'], marketID, timeStamp)
+            readTimes['levels'].append((time.perf_counter() - begin) * 1000)
+            begin = time.perf_counter()
+            actual = bookstore.readBook(paths['delta'], marketID, timeStamp)
+            readTimes['delta'].append((time.perf_counter() - begin) * 1000)
+            assert list(actual['qty']) == list(expected['qty'])
+        print(f'{args.markets} markets x {args.snapshots} snapshots x {args.levels} levels, '
+              f'{args.change:.0%} change per snapshot, keyframe every {args.keyframe}')
+        print(f'{"layout":<8} {"MB on disk":>11} {"write s":>9} {"read p50 ms":>12} {"read p95 ms":>12}')
+        for layout in ['levels', 'delta']:
+            print(f'{layout:<8} {sizes[layout] / 2**20:>11.2f} {writeTimes[layout]:>9.2f} '
+                  f'{statistics.median(readTimes[layout]):>12.3f} '
+                  f'{statistics.quantiles(readTimes[layout], n=20)[-1]:>12.3f}')
+        dbmgr.closeSessions()
@@ -0,0 +1,61 @@
+# compares the cycle time of the sequential poll loop in main.py against the async collector
+# as the number of markets grows, both run against a local mock dex server.
+# run from the repository root: python -m benchmarks.collector_bench
+import argparse
+import logging
+import os
+import tempfile
+import time
+import dbmgr
+import collector
+import main
+from tests.mockdex import MockDex
+
+
+def sequentialCycle(path, exchange, sleepTimer):
+    # the main.py loop: exchanges, then markets, then books and candles one at a time
+    main.dbPath = path
+    main.exchangeList = [exchange]
+    main.sleepTimer = sleepTimer
+    exchanges = main.updateExchanges()
+    for index, row in exchanges.iterrows():
+        markets = main.updateMarket(row)
+        main.updateBooks(markets)
+        main.updateCandles(markets)
+
+
+def asyncCycle(path, exchange, maxConcurrent, requestRate):
+    collector.runCycle(path, [exchange], maxConcurrent=maxConcurrent, requestRate=requestRate)
+
+
+def timeCycle(func, *args):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        dbmgr.initalizeDB(path)
+        start = time.perf_counter()
+        func(path, *args)
+        elapsed = time.perf_counter() - start
+        dbmgr.closeSessions()
+        return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', default='1,4,16,64', help='comma separated market counts')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock server latency in seconds')
+    parser.add_argument('--orders', type=int, default=200, help='orders per book')
+    parser.add_argument('--sleep', type=float, default=0.5, help='sequential sleepTimer')
+    parser.add_argument('--max-concurrent', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=10, help='async requests per second per host')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # the config.conf settings the benchmark doesn't override
+    main.loadConfig()
+
+    print(f'latency={args.latency}s sleepTimer={args.sleep}s maxConcurrent={args.max_concurrent} rate={args.rate}/s')
+    print(f'{"markets":>8} {"sequential s":>14} {"async s":>10} {"speedup":>8}')
+    for nMarkets in [int(x) for x in args.markets.split(',')]:
+        with MockDex(markets=nMarkets, orders=args.orders, latency=args.latency) as dex:
+            sequential = timeCycle(sequentialCycle, dex.exchange, args.sleep)
+            concurrent = timeCycle(asyncCycle, dex.exchange, args.max_concurrent, args.rate)
+        print(f'{nMarkets:>8} {sequential:>14.2f} {concurrent:>10.2f} {sequential / concurrent:>7.1f}x')
@@ -0,0 +1,62 @@
+# measures the per call latency of dbmgr.insertRecords and dbmgr.readTable with a fresh
+# connection per call (the previous behaviour, emulated by closing the sessions after every
+# call) against the persistent session.
+# run from the repository root: python -m benchmarks.dbmgr_bench
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import dbmgr
+
+
+def makeBook(rows, marketID=1):
+    # one order book snapshot shaped like collector.storeBook frames
+    rng = np.random.default_rng(marketID)
+    return pd.DataFrame({'marketID': marketID,
+                         'TimeStamp': datetime.datetime.now(),
+                         'side': np.where(np.arange(rows) % 2 == 0, 'buy', 'sell'),
+                         'rate': rng.integers(1, 10**8, rows),
+                         'qty': rng.integers(1, 10**9, rows)})
+
+
+def timeCalls(path, calls, func, reconnect):
+    # returns the latency of every call in milliseconds
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        func(path, i)
+        if reconnect:
+            dbmgr.closeSessions()
+        latencies.append((time.perf_counter() - start) * 1000)
+    dbmgr.closeSessions()
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--rows', type=int, default=50, help='rows per insert')
+    args = parser.parse_args()
+    colDict = {col: col for col in ['marketID', 'TimeStamp', 'side', 'rate', 'qty']}
+    book = makeBook(args.rows)
+
+    def insert(path, i):
+        dbmgr.insertRecords(path, 'books', book.assign(marketID=i), colDict)
+
+    def read(path, i):
+        dbmgr.readTable(path, 'exchanges')
+
+    print(f'{"operation":<12} {"mode":<12} {"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9}')
+    for name, func in [('insert', insert), ('readTable', read)]:
+        for mode, reconnect in [('per call', True), ('session', False)]:
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'bench.db')
+                dbmgr.initalizeDB(path)
+                latencies = timeCalls(path, args.calls, func, reconnect)
+            p95 = statistics.quantiles(latencies, n=20)[-1]
+            print(f'{name:<12} {mode:<12} {statistics.mean(latencies):>9.3f} '
+                  f'{statistics.median(latencies):>9.3f} {p95:>9.3f}')
@@ -0,0 +1,54 @@
+# measures books insert throughput of the previous to_sql temp table round trip against the
+# executemany bulk insert path for growing row counts.
+# run from the repository root: python -m benchmarks.insert_bench
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import pandas as pd
+import dbmgr
+from benchmarks.dbmgr_bench import makeBook
+
+colDict = {col: col for col in ['marketID', 'TimeStamp', 'side', 'rate', 'qty']}
+
+
+def legacyInsert(path, tableName, inputData, colDict, replace=False):
+    # the insertRecords implementation before the bulk insert path
+    conn = sqlite3.connect(path)
+    filteredData = pd.DataFrame()
+    for inputCol in colDict:
+        filteredData[colDict[inputCol]] = inputData[inputCol]
+    filteredData.to_sql('tempTable', conn, if_exists='replace', index=False)
+    cmdStr = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+    conn.execute(f'{cmdStr} INTO {tableName} ( {", ".join(colDict.values())} ) SELECT * FROM tempTable as tempTable')
+    conn.execute('DROP TABLE tempTable')
+    conn.commit()
+    conn.close()
+
+
+def bulkInsert(path, tableName, inputData, colDict, replace=False):
+    dbmgr.insertRecords(path, tableName, inputData, colDict, replace)
+
+
+def timeInsert(func, data):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        dbmgr.initalizeDB(path)
+        start = time.perf_counter()
+        func(path, 'books', data, colDict)
+        elapsed = time.perf_counter() - start
+        dbmgr.closeSessions()
+        return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='1000,100000,1000000', help='comma separated row counts')
+    args = parser.parse_args()
+    print(f'{"rows":>9} {"to_sql s":>10} {"rows/s":>11} {"executemany s":>14} {"rows/s":>11}')
+    for rows in [int(x) for x in args.rows.split(',')]:
+        data = makeBook(rows)
+        legacy = timeInsert(legacyInsert, data)
+        bulk = timeInsert(bulkInsert, data)
+        print(f'{rows:>9} {legacy:>10.3f} {rows / legacy:>11,.0f} {bulk:>14.3f} {rows / bulk:>11,.0f}')
@@ -0,0 +1,56 @@
+# compares parse time and peak python memory of decoding an order book body with each available
+# json decoder followed by parseOrderBook against parsing it as a stream of chunks.
+# run from the repository root: python -m benchmarks.json_bench
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import dexapi
+from tests import mockdex
+
+
+def decodeAndParse(decoder):
+    def parse(body):
+        return dexapi.parseOrderBook(dexapi.decoders[decoder](body))
+    return parse
+
+
+def streamParse(chunkSize):
+    def parse(body):
+        chunks = (body[i:i + chunkSize] for i in range(0, len(body), chunkSize))
+        return dexapi.parseOrderStream(chunks)
+    return parse
+
+
+def measure(func, body):
+    # the body exists before tracing starts, it is the response both approaches receive
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(body)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 2**20
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', default='10000,100000,500000', help='comma separated book sizes')
+    parser.add_argument('--payload', help='recorded /api/orderbook payload to use instead')
+    parser.add_argument('--chunk', type=int, default=65536, help='stream chunk size in bytes')
+    args = parser.parse_args()
+    bodies = []
+    if args.payload:
+        with open(args.payload, 'rb') as file:
+            bodies.append((args.payload, file.read()))
+    else:
+        for orders in [int(x) for x in args.orders.split(',')]:
+            bodies.append((f'{orders} orders', json.dumps(mockdex.makeOrderBook(random.Random(1), orders)).encode()))
+    methods = [(f'{name} + parse', decodeAndParse(name)) for name in dexapi.decoders]
+    methods.append((f'stream {args.chunk // 1024}KiB', streamParse(args.chunk)))
+    print(f'{"payload":<16} {"MiB":>7} {"method":<18} {"ms":>9} {"peak MiB":>9}')
+    for name, body in bodies:
+        for method, func in methods:
+            elapsed, peak = measure(func, body)
+            print(f'{name:<16} {len(body) / 2**20:>7.1f} {method:<18} {elapsed:>9.1f} {peak:>9.1f}')
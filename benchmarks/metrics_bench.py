@@ -0,0 +1,52 @@
+# measures the cost of the metrics instrumentation: the instrumented parse functions and
+# insertRecords are timed uninstrumented, with metrics disabled and with metrics enabled.
+# run from the repository root: python -m benchmarks.metrics_bench
+import argparse
+import os
+import random
+import tempfile
+import time
+import dbmgr
+import dexapi
+import metrics
+import collector
+from tests import mockdex
+
+
+def best(func, repeat):
+    # best of repeat runs in microseconds
+    times = []
+    for number in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=50, help='orders per book')
+    parser.add_argument('--candles', type=int, default=30, help='candles per series')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(1)
+    book = mockdex.makeOrderBook(rng, args.orders)
+    candles = mockdex.makeCandles(rng, args.candles)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        dbmgr.initalizeDB(path)
+        frame = dexapi.parseCandles(candles).assign(marketID=1, period='24h')
+        cases = [('parseOrderBook', dexapi.parseOrderBook, lambda func: func(book)),
+                 ('parseCandles', dexapi.parseCandles, lambda func: func(candles)),
+                 ('insertRecords', dbmgr.insertRecords,
+                  lambda func: func(path, 'candles', frame, collector.candleCols, replace=True))]
+        print(f'{"call":<16} {"raw us":>9} {"disabled us":>12} {"enabled us":>11} {"disabled +":>11}')
+        for name, func, call in cases:
+            # insertRecords is instrumented inline, its raw time is the disabled time
+            raw = best(lambda: call(getattr(func, '__wrapped__', func)), args.repeat)
+            metrics.enabled = False
+            disabled = best(lambda: call(func), args.repeat)
+            metrics.enabled = True
+            enabled = best(lambda: call(func), args.repeat)
+            metrics.enabled = False
+            print(f'{name:<16} {raw:>9.1f} {disabled:>12.1f} {enabled:>11.1f} {disabled - raw:>10.2f}')
@@ -0,0 +1,75 @@
+# times the dexapi parse functions against the previous per row pandas implementations on
+# order book and config payloads. recorded payloads can be passed with --orderbook/--config,
+# otherwise synthetic ones of the requested sizes are generated.
+# run from the repository root: python -m benchmarks.parse_bench
+import argparse
+import json
+import random
+import statistics
+import time
+import pandas as pd
+import dexapi
+from tests import mockdex
+
+
+def legacyOrderBook(data):
+    books = pd.DataFrame.from_dict(data['orders'])[['rate', 'qty', 'side']].copy().sort_values(by=['rate'])
+    books['side'] = books['side'].apply(lambda x: 'buy' if x == 1 else 'sell')
+    return books.groupby('rate').agg({'qty': 'sum', 'side': 'first'}).reset_index()
+
+
+def legacyMarkets(data):
+    assets = pd.json_normalize(data['assets']).set_index('id')
+    markets = pd.DataFrame.from_dict(data['markets'])
+    markets['baseConversionFactor'] = markets['base'].apply(lambda x: assets.loc[x]['unitinfo.conventional.conversionFactor'])
+    markets['quoteConversionFactor'] = markets['quote'].apply(lambda x: assets.loc[x]['unitinfo.conventional.conversionFactor'])
+    markets['base'] = markets['base'].apply(lambda x: assets.loc[x].symbol)
+    markets['quote'] = markets['quote'].apply(lambda x: assets.loc[x].symbol)
+    return markets
+
+
+def timeParse(func, data, repeat):
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+def report(name, legacy, current, data, repeat):
+    before = timeParse(legacy, data, repeat)
+    after = timeParse(current, data, repeat)
+    print(f'{name:<28} {before:>11.2f} {after:>11.2f} {before / after:>8.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', default='10000,50000,100000', help='comma separated synthetic book sizes')
+    parser.add_argument('--markets', default='10,100,1000', help='comma separated synthetic market counts')
+    parser.add_argument('--orderbook', help='recorded /api/orderbook payload')
+    parser.add_argument('--config', help='recorded /api/config payload')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    books, configs = [], []
+    if args.orderbook:
+        with open(args.orderbook) as file:
+            data = json.load(file)
+        books.append((f'{args.orderbook} ({len(data["orders"])})', data))
+    else:
+        for orders in [int(x) for x in args.orders.split(',')]:
+            books.append((f'{orders} orders', mockdex.makeOrderBook(random.Random(1), orders)))
+    if args.config:
+        with open(args.config) as file:
+            data = json.load(file)
+        configs.append((f'{args.config} ({len(data["markets"])})', data))
+    else:
+        for markets in [int(x) for x in args.markets.split(',')]:
+            configs.append((f'{markets} markets', mockdex.makeConfig(markets)))
+
+    print(f'{"payload":<28} {"legacy ms":>11} {"vector ms":>11} {"speedup":>9}')
+    for name, data in books:
+        pd.testing.assert_frame_equal(dexapi.parseOrderBook(data), legacyOrderBook(data), check_dtype=False)
+        report(name, legacyOrderBook, dexapi.parseOrderBook, data, args.repeat)
+    for name, data in configs:
+        report(name, legacyMarkets, dexapi.parseMarkets, data, args.repeat)
@@ -0,0 +1,146 @@
+# times the main.py pipeline stage by stage against a local mock dex: fetch, parse and insert
+# times come from the metrics histograms of a collection run, followed by the dashboard
+# aggregations of dashData. markets are synthetic unless --fixtures points at a folder
+# recorded with benchmarks.record. every run is appended to --results with the commit it ran
+# on and compared against the last run with the same parameters.
+# run from the repository root: python -m benchmarks.pipeline_bench
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import dashData
+import dbmgr
+import main
+import metrics
+from tests.mockdex import MockDex
+
+# the histograms summed into each collection stage, they overlap with the wall time of the
+# concurrent run rather than adding up to it
+stageMetrics = {'fetch': 'dexdb_http_request_seconds',
+                'parse': 'dexdb_parse_seconds',
+                'insert': 'dexdb_insert_seconds',
+                'rollups': 'dexdb_rollup_seconds'}
+
+
+def commit():
+    # the commit the benchmark ran on, marked when the tree has uncommitted changes
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return head + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stageTotals():
+    totals = {}
+    for stage, name in stageMetrics.items():
+        histograms = [value for (metric, labels), value in metrics.histograms.items() if metric == name]
+        totals[stage] = sum(histogram[2] for histogram in histograms)
+        totals[f'{stage} calls'] = sum(histogram[1] for histogram in histograms)
+    return totals
+
+
+def runPipeline(path, exchange, mode, candlePeriods):
+    # the collection run of main.py with the settings of this benchmark
+    main.dbPath = path
+    main.exchangeList = [exchange]
+    main.collectorMode = mode
+    main.daemonEnabled = False
+    main.candlePeriods = candlePeriods
+    main.sleepTimer = 0
+    main.requestRate = 0
+    metrics.reset()
+    metrics.enabled = True
+    start = time.perf_counter()
+    main.collect()
+    stages = {'collect': time.perf_counter() - start}
+    metrics.enabled = False
+    stages.update(stageTotals())
+    # the dashboard reads of the collected data
+    for name, func in [('dash candles', lambda: dashData.getCandleData(path)),
+                       ('dash depth', lambda: dashData.getBookDepth(path)),
+                       ('dash liquidity', lambda: dashData.getLiquidityData(path)),
+                       ('dash volumes', lambda: dashData.getVolumeData(path))]:
+        start = time.perf_counter()
+        func()
+        stages[name] = time.perf_counter() - start
+    return stages
+
+
+def previous(results, params):
+    # the last stored run with the same parameters
+    if not os.path.exists(results):
+        return None
+    last = None
+    with open(results) as file:
+        for line in file:
+            record = json.loads(line)
+            if record['params'] == params:
+                last = record
+    return last
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', type=int, default=200)
+    parser.add_argument('--orders', type=int, default=1000, help='orders per book')
+    parser.add_argument('--candles', type=int, default=365, help='candles per series')
+    parser.add_argument('--periods', default='24h', help='comma separated candle periods')
+    parser.add_argument('--latency', type=float, default=0.0, help='mock server latency in seconds')
+    parser.add_argument('--mode', default='async', choices=['async', 'sequential', 'process'])
+    parser.add_argument('--fixtures', help='recorded fixture folder to serve instead of synthetic markets')
+    parser.add_argument('--results', default=os.path.join('benchmarks', 'results', 'pipeline.jsonl'))
+    parser.add_argument('--no-save', action='store_true', help="don't append this run to the results")
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # the config.conf settings the benchmark doesn't override
+    main.loadConfig()
+
+    periods = args.periods.split(',')
+    if args.fixtures:
+        params = {'fixtures': os.path.basename(os.path.normpath(args.fixtures)), 'periods': periods,
+                  'latency': args.latency, 'mode': args.mode}
+        dex = MockDex.load(args.fixtures, latency=args.latency)
+    else:
+        params = {'markets': args.markets, 'orders': args.orders, 'candles': args.candles, 'periods': periods,
+                  'latency': args.latency, 'mode': args.mode}
+        dex = MockDex(markets=args.markets, orders=args.orders, candles=args.candles, latency=args.latency, lazy=True)
+    with dex, tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        # the storage profile of config.conf, as main.initialize sets it
+        dbmgr.setStorageProfile(path, main.storageProfile, main.storageOverrides)
+        dbmgr.initalizeDB(path)
+        stages = runPipeline(path, dex.exchange, args.mode, periods)
+    last = previous(args.results, params)
+    print(' '.join(f'{key}={value}' for key, value in params.items()))
+    print(f'{"stage":<14} {"seconds":>9} {"calls":>7} {"previous":>9} {"ratio":>6}')
+    regressions = []
+    for stage, seconds in stages.items():
+        if stage.endswith(' calls'):
+            continue
+        calls = stages.get(f'{stage} calls', '')
+        before = last['stages'].get(stage) if last else None
+        ratio = seconds / before if before else None
+        if ratio is not None and ratio > args.threshold:
+            regressions.append(stage)
+        print(f'{stage:<14} {seconds:>9.3f} {calls:>7} {before if before is not None else "":>9.9} '
+              f'{f"{ratio:.2f}" if ratio is not None else "":>6}')
+    if last:
+        print(f'compared with {last["commit"]} from {last["time"]}')
+    if regressions:
+        print(f'regressions above {args.threshold}x: {", ".join(regressions)}')
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.results), exist_ok=True)
+        record = {'commit': commit(), 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'machine': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+                  'params': params, 'stages': stages}
+        with open(args.results, 'a') as file:
+            file.write(json.dumps(record) + '\n')
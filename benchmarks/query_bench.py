@@ -0,0 +1,77 @@
+# builds a books table with the original unkeyed layout, times per market/time window reads,
+# migrates it with initalizeDB and times the same reads against the keyed table.
+# run from the repository root: python -m benchmarks.query_bench
+import argparse
+import datetime
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import numpy as np
+import dbmgr
+
+
+def fillLegacyBooks(path, markets, snapshots, levels):
+    # one snapshot per market per minute, rows are written in collection order
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE books ( marketID integer not null, TimeStamp datetime not null, '
+                 'side integer not null, rate bigint not null, qty bigint not null )')
+    rng = np.random.default_rng(1)
+    start = datetime.datetime(2024, 1, 1)
+    for snapshot in range(snapshots):
+        stamp = str(start + datetime.timedelta(minutes=snapshot, microseconds=123))
+        rows = []
+        for marketID in range(1, markets + 1):
+            rates = rng.integers(1, 10**8, levels).tolist()
+            qtys = rng.integers(1, 10**9, levels).tolist()
+            rows += [(marketID, stamp, 'buy' if i % 2 else 'sell', rates[i], qtys[i]) for i in range(levels)]
+        conn.executemany('INSERT INTO books VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    return start
+
+
+def timeQueries(path, queries, repeat):
+    conn = sqlite3.connect(path)
+    latencies = []
+    for i in range(repeat):
+        for queryStr, params in queries:
+            begin = time.perf_counter()
+            conn.execute(queryStr, params).fetchall()
+            latencies.append((time.perf_counter() - begin) * 1000)
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {queries[0][0]}', queries[0][1]).fetchall()[-1][-1]
+    conn.close()
+    return latencies, plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', type=int, default=20)
+    parser.add_argument('--snapshots', type=int, default=1000)
+    parser.add_argument('--levels', type=int, default=50)
+    parser.add_argument('--window', type=int, default=60, help='window length in minutes')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        start = fillLegacyBooks(path, args.markets, args.snapshots, args.levels)
+        # one window per market spread over the collected range
+        queries = []
+        for marketID in range(1, args.markets + 1):
+            windowStart = start + datetime.timedelta(minutes=(marketID * 37) % max(1, args.snapshots - args.window))
+            windowEnd = windowStart + datetime.timedelta(minutes=args.window)
+            queries.append(('SELECT TimeStamp, side, rate, qty FROM books WHERE marketID = ? '
+                            'AND TimeStamp >= ? AND TimeStamp < ?', (marketID, str(windowStart), str(windowEnd))))
+        print(f'{args.markets * args.snapshots * args.levels:,} rows, {args.window} minute windows')
+        print(f'{"layout":<10} {"p50 ms":>9} {"p95 ms":>9}  plan')
+        latencies, plan = timeQueries(path, queries, args.repeat)
+        print(f'{"unkeyed":<10} {statistics.median(latencies):>9.3f} '
+              f'{statistics.quantiles(latencies, n=20)[-1]:>9.3f}  {plan}')
+        begin = time.perf_counter()
+        dbmgr.initalizeDB(path)
+        migration = time.perf_counter() - begin
+        latencies, plan = timeQueries(path, queries, args.repeat)
+        print(f'{"keyed":<10} {statistics.median(latencies):>9.3f} '
+              f'{statistics.quantiles(latencies, n=20)[-1]:>9.3f}  {plan}')
+        print(f'migration took {migration:.2f}s')
@@ -0,0 +1,92 @@
+# times the dashboard reads of dashData.py without the query cache, served from memory, served
+# from the persisted feather files as a new process would, and after a write to a table they
+# read has invalidated them.
+# run from the repository root: python -m benchmarks.querycache_bench
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import dashData
+import dbmgr
+import querycache
+
+
+def fillDatabase(path, markets, days, snapshots, levels):
+    # markets with a daily candle per day, snapshots order books of levels per side
+    dbmgr.initalizeDB(path)
+    dbmgr.insertRecords(path, 'exchanges', pd.DataFrame({'name': ['bench']}), {'name': 'name'})
+    frame = pd.DataFrame({'exchangeID': 1, 'name': [f'asset{number}_btc' for number in range(markets)],
+                          'base': [f'asset{number}' for number in range(markets)], 'quote': 'btc'})
+    dbmgr.insertRecords(path, 'markets', frame, {col: col for col in frame.columns})
+    configs = pd.DataFrame({'marketID': range(1, markets + 1), 'baseConversionFactor': 100000000,
+                            'quoteConversionFactor': 100000000})
+    dbmgr.insertRecords(path, 'marketConfig', configs, {col: col for col in configs.columns})
+    rng = np.random.default_rng(1)
+    opens = pd.date_range('2024-01-01', periods=days, freq='D')
+    candles = pd.DataFrame({'marketID': np.repeat(np.arange(1, markets + 1), days), 'period': '24h',
+                            'timeOpen': np.tile(opens, markets), 'timeClose': np.tile(opens + pd.Timedelta(days=1), markets)})
+    for col in ['baseVolume', 'quoteVolume', 'high', 'low', 'open', 'close']:
+        candles[col] = rng.integers(1, 10 ** 9, len(candles))
+    dbmgr.insertRecords(path, 'candles', candles, {col: col for col in candles.columns})
+    stamps = pd.date_range('2024-01-01', periods=snapshots, freq='min')
+    rows = len(stamps) * markets * 2 * levels
+    books = pd.DataFrame({'marketID': np.repeat(np.arange(1, markets + 1), len(stamps) * 2 * levels),
+                          'TimeStamp': np.tile(np.repeat(stamps, 2 * levels), markets),
+                          'side': np.tile(np.repeat([0, 1], levels), len(stamps) * markets),
+                          'rate': np.tile(np.arange(2 * levels), len(stamps) * markets),
+                          'qty': rng.integers(1, 10 ** 9, rows)})
+    dbmgr.insertRecords(path, 'books', books, {col: col for col in books.columns})
+    return len(candles), rows
+
+
+def touchMarkets(path):
+    with dbmgr.getSession(path).write() as conn:
+        dbmgr.tableWritten(conn, 'markets')
+
+
+def best(func, repeat):
+    times = []
+    for number in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', type=int, default=50)
+    parser.add_argument('--days', type=int, default=1000, help='daily candles per market')
+    parser.add_argument('--snapshots', type=int, default=60, help='order book snapshots per market')
+    parser.add_argument('--levels', type=int, default=50, help='levels per side')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    reads = [('candles', lambda path: dashData.getCandleData(path)),
+             ('books', lambda path: dashData.getBookData(path)),
+             ('liquidity', lambda path: dashData.getLiquidityData(path))]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        candleRows, bookRows = fillDatabase(path, args.markets, args.days, args.snapshots, args.levels)
+        print(f'{candleRows:,} candles, {bookRows:,} book levels')
+        print(f'{"read":<10} {"uncached ms":>12} {"memory ms":>10} {"file ms":>9} {"written ms":>11} {"MB":>7}')
+        for name, read in reads:
+            querycache.enabled = False
+            uncached = best(lambda: read(path), args.repeat)
+            querycache.enabled = True
+            querycache.persistPath = os.path.join(folder, 'cache')
+            querycache.clear()
+            read(path)
+            size = querycache.resultsBytes / 2 ** 20
+            memory = best(lambda: read(path), args.repeat)
+            # a new process has an empty memory but finds the files
+            file = statistics.median([best(lambda: (querycache.results.clear(), read(path)), 1)
+                                      for number in range(args.repeat)])
+            # a write to a table the read joins invalidates the result, it is read and persisted again
+            written = best(lambda: (touchMarkets(path), read(path)), args.repeat)
+            print(f'{name:<10} {uncached:>12.1f} {memory:>10.2f} {file:>9.1f} {written:>11.1f} {size:>7.1f}')
+        dbmgr.closeSessions()
@@ -0,0 +1,102 @@
+# records the /api/config, /api/orderbook and /api/candles payloads of an exchange into a
+# fixture folder that tests.mockdex.MockDex.load serves, so benchmarks can replay real markets.
+# --feed also records the websocket order book notes for that many seconds, replayed by the
+# mock to feed subscribers.
+# run from the repository root: python -m benchmarks.record --exchange dex.decred.org
+import argparse
+import json
+import os
+import time
+import bookfeed
+import dexapi
+
+
+def save(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file)
+
+
+def record(exchange, folder, markets=None, periods=('24h', '1h', '5m')):
+    # markets limits the recording to the first markets of the config, returns their names
+    base = dexapi.baseUrl(exchange)
+    config = dexapi.getResponse(base + '/api/config')
+    # only the recorded markets are listed in the replayed config
+    if markets is not None:
+        config['markets'] = config['markets'][:markets]
+    symbols = {asset['id']: asset['symbol'] for asset in config['assets']}
+    os.makedirs(os.path.join(folder, 'orderbook'), exist_ok=True)
+    os.makedirs(os.path.join(folder, 'candles'), exist_ok=True)
+    names = []
+    for market in config['markets']:
+        baseAsset, quoteAsset = symbols[market['base']], symbols[market['quote']]
+        # served paths use the symbols, the config names are rewritten to match them
+        market['name'] = f'{baseAsset}_{quoteAsset}'
+        save(os.path.join(folder, 'orderbook', f'{market["name"]}.json'),
+             dexapi.getResponse(f'{base}/api/orderbook/{baseAsset}/{quoteAsset}'))
+        for period in periods:
+            save(os.path.join(folder, 'candles', f'{market["name"]}_{period}.json'),
+                 dexapi.getResponse(f'{base}/api/candles/{baseAsset}/{quoteAsset}/{period}'))
+        names.append(market['name'])
+    save(os.path.join(folder, 'config.json'), config)
+    return names
+
+
+def recordFeed(exchange, folder, duration=60):
+    # subscribes the recorded markets and saves their notes as [delay seconds, route, payload]
+    # to feed/<base>_<quote>.json. the subscription results replace the recorded order books so
+    # the notes follow them without a gap
+    with open(os.path.join(folder, 'config.json')) as file:
+        config = json.load(file)
+    symbols = {asset['id']: asset['symbol'] for asset in config['assets']}
+    socket = bookfeed.websocket.create_connection(bookfeed.feedUrl(exchange), timeout=10)
+    requests = {}
+    for requestID, market in enumerate(config['markets'], 1):
+        socket.send(json.dumps({'type': bookfeed.REQUEST, 'route': 'orderbook', 'id': requestID,
+                                'payload': {'base': market['base'], 'quote': market['quote']}}))
+        requests[requestID] = f'{symbols[market["base"]]}_{symbols[market["quote"]]}'
+    marketNames = {}
+    feeds = {name: [] for name in requests.values()}
+    last = {}
+    end = time.monotonic() + duration
+    socket.settimeout(1)
+    try:
+        while time.monotonic() < end:
+            try:
+                message = json.loads(socket.recv())
+            except bookfeed.websocket.WebSocketTimeoutException:
+                continue
+            now = time.monotonic()
+            if message['type'] == bookfeed.RESPONSE and message['id'] in requests:
+                name = requests[message['id']]
+                book = message['payload']['result']
+                marketNames[book['marketid']] = name
+                last[name] = now
+                book['orders'] = [{'id': order['oid'], 'side': order['side'], 'qty': order['qty'],
+                                   'rate': order['rate'], 'time': order.get('time', 0)} for order in book['orders'] or []]
+                save(os.path.join(folder, 'orderbook', f'{name}.json'), book)
+            elif message['type'] == bookfeed.NOTIFICATION and message['route'] in bookfeed.sequencedRoutes:
+                name = marketNames.get(message['payload'].get('marketid'))
+                if name is not None:
+                    feeds[name].append([now - last[name], message['route'], message['payload']])
+                    last[name] = now
+    finally:
+        socket.close()
+    os.makedirs(os.path.join(folder, 'feed'), exist_ok=True)
+    for name, notes in feeds.items():
+        save(os.path.join(folder, 'feed', f'{name}.json'), notes)
+    return sum(len(notes) for notes in feeds.values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exchange', default='dex.decred.org')
+    parser.add_argument('--out', help='fixture folder, benchmarks/fixtures/<exchange> by default')
+    parser.add_argument('--markets', type=int, help='record only the first markets of the config')
+    parser.add_argument('--periods', default='24h,1h,5m', help='comma separated candle periods')
+    parser.add_argument('--feed', type=float, help='seconds of order book notes to record')
+    args = parser.parse_args()
+    folder = args.out or os.path.join('benchmarks', 'fixtures', args.exchange.split('://')[-1].replace(':', '_'))
+    names = record(args.exchange, folder, args.markets, args.periods.split(','))
+    print(f'{len(names)} markets recorded to {folder}')
+    if args.feed:
+        print(f'{recordFeed(args.exchange, folder, args.feed)} order book notes recorded')
@@ -0,0 +1,81 @@
+# times the daily volume per market the dashboard shows, computed the previous way (every
+# candle joined and grouped in memory) and read from the rollup tables, for growing candle
+# histories. also reports the cost of the incremental rollup update when a day of candles is
+# stored.
+# run from the repository root: python -m benchmarks.rollup_bench
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import pandas as pd
+import collector
+import dashData
+import dbmgr
+import dexapi
+import rollups
+from tests import mockdex
+
+
+def fillCandles(path, markets, days):
+    # days of 24h candles for every market, written the way storeCandles writes them
+    exchanges = collector.storeExchanges(path, ['bench'])
+    stored = collector.storeMarkets(path, exchanges.iloc[0], dexapi.parseMarkets(mockdex.makeConfig(markets)))
+    startStamps = pd.date_range('2024-01-01', periods=days, freq='D') - pd.Timedelta(days=days)
+    frames = []
+    for marketID in stored['marketID']:
+        frames.append(pd.DataFrame({'marketID': marketID, 'period': '24h', 'startStamps': startStamps,
+                                    'endStamps': startStamps + pd.Timedelta(days=1),
+                                    'matchVolumes': 100000000, 'quoteVolumes': 200000000,
+                                    'highRates': 2, 'lowRates': 1, 'startRates': 1, 'endRates': 2}))
+    dbmgr.insertRecords(path, 'candles', pd.concat(frames), collector.candleCols)
+    return stored
+
+
+def previousDaily(path):
+    data = dashData.getCandleData(path)
+    data = data[['timeOpen', 'market', 'baseVol']]
+    return data.set_index('timeOpen').groupby([pd.Grouper(freq='1D'), 'market']).sum()
+
+
+def median(func, repeat):
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', type=int, default=50)
+    parser.add_argument('--days', default='100,1000,5000', help='comma separated history lengths')
+    parser.add_argument('--window', type=int, default=90, help='days the dashboard shows')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(f'{"candles":>9} {"previous ms":>12} {"rollup ms":>10} {"weekly ms":>10} {"window ms":>10} {"rebuild s":>10} {"update ms":>10}')
+    for days in [int(x) for x in args.days.split(',')]:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'bench.db')
+            dbmgr.initalizeDB(path)
+            markets = fillCandles(path, args.markets, days)
+            start = time.perf_counter()
+            rollups.rebuildRollups(path)
+            rebuild = time.perf_counter() - start
+            previous = median(lambda: previousDaily(path), args.repeat)
+            rollup = median(lambda: rollups.getVolumes(path, '1d'), args.repeat)
+            weekly = median(lambda: rollups.getVolumes(path, '1w'), args.repeat)
+            since = pd.Timestamp('2024-01-01') - pd.Timedelta(days=args.window)
+            window = median(lambda: rollups.getVolumes(path, '1d', start=since), args.repeat)
+            # a new day of candles for one market
+            newDay = pd.DataFrame({'startStamps': [pd.Timestamp('2024-01-01')], 'endStamps': [pd.Timestamp('2024-01-02')],
+                                   'matchVolumes': 1, 'quoteVolumes': 1, 'highRates': 1, 'lowRates': 1,
+                                   'startRates': 1, 'endRates': 1})
+            # the high water marks are loaded once per process, keep that out of the update
+            collector.getHighWaterMark(path, markets['marketID'].iloc[0], '24h')
+            start = time.perf_counter()
+            collector.storeCandles(path, markets.iloc[0], newDay)
+            update = (time.perf_counter() - start) * 1000
+            print(f'{days * args.markets:>9} {previous:>12.1f} {rollup:>10.1f} {weekly:>10.1f} {window:>10.1f} {rebuild:>10.2f} {update:>10.1f}')
+            dbmgr.closeSessions()
@@ -0,0 +1,55 @@
+# compares the cycle time of the single process async collector against the process sharded
+# collector as the number of exchanges grows, every exchange is its own mock dex server and
+# --slow adds one exchange whose requests take that many seconds.
+# run from the repository root: python -m benchmarks.shard_bench
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import time
+import collector
+import dbmgr
+import shards
+from tests.mockdex import MockDex
+
+
+def timeCycle(func, exchanges, **options):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        dbmgr.initalizeDB(path)
+        start = time.perf_counter()
+        func(path, exchanges, **options)
+        elapsed = time.perf_counter() - start
+        dbmgr.closeSessions()
+        return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exchanges', default='1,2,4,8,16', help='comma separated exchange counts')
+    parser.add_argument('--markets', type=int, default=8, help='markets per exchange')
+    parser.add_argument('--orders', type=int, default=500, help='orders per book')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock server latency in seconds')
+    parser.add_argument('--slow', type=float, default=0.0, help='latency of one extra slow exchange')
+    parser.add_argument('--processes', type=int, default=16, help='maximum worker processes')
+    parser.add_argument('--max-concurrent', type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f'markets={args.markets} orders={args.orders} latency={args.latency}s slow={args.slow}s cpus={os.cpu_count()}')
+    print(f'{"exchanges":>9} {"processes":>9} {"async s":>9} {"sharded s":>10} {"speedup":>8}')
+    for nExchanges in [int(x) for x in args.exchanges.split(',')]:
+        with contextlib.ExitStack() as stack:
+            servers = [stack.enter_context(MockDex(markets=args.markets, orders=args.orders, latency=args.latency,
+                                                   seed=number))
+                       for number in range(nExchanges)]
+            if args.slow:
+                servers.append(stack.enter_context(MockDex(markets=args.markets, orders=args.orders,
+                                                           latency=args.slow)))
+            exchanges = [server.exchange for server in servers]
+            options = {'maxConcurrent': args.max_concurrent, 'requestRate': 0}
+            concurrent = timeCycle(collector.runCycle, exchanges, **options)
+            processes = min(args.processes, len(exchanges))
+            sharded = timeCycle(shards.runSharded, exchanges, processes=processes, **options)
+        print(f'{nExchanges:>9} {processes:>9} {concurrent:>9.2f} {sharded:>10.2f} {concurrent / sharded:>7.1f}x')
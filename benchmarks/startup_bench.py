@@ -0,0 +1,60 @@
+# measures the cold start of the modules and command line entry points: every module is imported
+# in a fresh interpreter with python -X importtime, the cumulative import time of the module and
+# its heaviest dependencies are reported with the wall time of the cli commands that return
+# before doing any work.
+# run from the repository root: python -m benchmarks.startup_bench
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def importTimes(module):
+    # cumulative microseconds per imported package of a fresh import of module
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def wallTime(command, repeat):
+    # best wall time of a command in milliseconds
+    times = []
+    for number in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', default='metrics,dbmgr,dexapi,cm,collector,daemon,archive,main,dashData,cli')
+    parser.add_argument('--packages', default='pandas,numpy,pyarrow.dataset,coinmetrics.api_client,requests,websocket',
+                        help='dependencies reported per module when they are imported')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    packages = args.packages.split(',')
+    print(f'{"module":<12} {"import ms":>10} ' + ' '.join(f'{package.split(".")[0]:>12}' for package in packages))
+    for module in args.modules.split(','):
+        # the best of repeat imports, the first one also warms the file system cache
+        runs = [importTimes(module) for number in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        print(f'{module:<12} {best[module] / 1000:>10.1f} ' +
+              ' '.join(f'{best[package] / 1000:>12.1f}' if package in best else f'{"-":>12}' for package in packages))
+    print()
+    print(f'{"command":<40} {"wall ms":>9}')
+    python = [sys.executable]
+    for command in [python + ['-c', 'pass'],
+                    python + ['cli.py', '--help'],
+                    python + ['cli.py', 'collect', '--help'],
+                    python + ['cli.py', 'dashboard', '--help'],
+                    python + ['-c', 'import main'],
+                    python + ['-c', 'import dashData']]:
+        print(f'{" ".join(os.path.basename(part) for part in command):<40} {wallTime(command, args.repeat):>9.1f}')
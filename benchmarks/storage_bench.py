@@ -0,0 +1,65 @@
+# runs a writer thread inserting order book snapshots while reader threads query the books
+# table, once per storage profile. reports write throughput, commit latency and how long
+# readers were held up by the writer.
+# run from the repository root: python -m benchmarks.storage_bench
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+import dbmgr
+from benchmarks.dbmgr_bench import makeBook
+
+colDict = {col: col for col in ['marketID', 'TimeStamp', 'side', 'rate', 'qty']}
+
+
+def writer(path, snapshots, rows, latencies):
+    for i in range(snapshots):
+        book = makeBook(rows, marketID=i % 10)
+        start = time.perf_counter()
+        dbmgr.insertRecords(path, 'books', book, colDict)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def reader(path, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        dbmgr.freeQuery(path, 'select marketID, count(*) as n, max(rate) as r from books group by marketID')
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def run(profile, snapshots, rows, readers):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        dbmgr.setStorageProfile(path, profile)
+        dbmgr.initalizeDB(path)
+        writeLatencies, readLatencies = [], []
+        stop = threading.Event()
+        threads = [threading.Thread(target=reader, args=(path, stop, readLatencies)) for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        writer(path, snapshots, rows, writeLatencies)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+        dbmgr.closeSessions()
+    return elapsed, writeLatencies, readLatencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', default='default,wal,bulk')
+    parser.add_argument('--snapshots', type=int, default=300)
+    parser.add_argument('--rows', type=int, default=200, help='rows per snapshot')
+    parser.add_argument('--readers', type=int, default=2)
+    args = parser.parse_args()
+    print(f'{"profile":<8} {"rows/s":>10} {"commit p50 ms":>14} {"commit p95 ms":>14} '
+          f'{"reads":>6} {"read p50 ms":>12} {"read max ms":>12}')
+    for profile in args.profiles.split(','):
+        elapsed, writes, reads = run(profile, args.snapshots, args.rows, args.readers)
+        print(f'{profile:<8} {args.snapshots * args.rows / elapsed:>10,.0f} '
+              f'{statistics.median(writes):>14.2f} {statistics.quantiles(writes, n=20)[-1]:>14.2f} '
+              f'{len(reads):>6} {statistics.median(reads):>12.2f} {max(reads):>12.2f}')
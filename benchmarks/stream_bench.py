@@ -0,0 +1,82 @@
+# reports peak RSS and time of aggregating a synthetic books table with the full read of
+# dashData.getBookData against the chunked dashData.getBookDepth. each method runs in its own
+# process so peak RSS is measured in isolation. the full read only runs up to --full-max rows.
+# run from the repository root: python -m benchmarks.stream_bench --rows 50000000
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import dashData
+import dbmgr
+
+
+def fillBooks(path, rows, markets, levels):
+    # rows levels over markets markets, one snapshot per minute with levels per side, generated
+    # inside sqlite in key order
+    dbmgr.initalizeDB(path)
+    conn = dbmgr.dbConnect(path)[0]
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executemany('INSERT INTO exchanges ( name ) VALUES ( ? )', [('bench',)])
+    conn.executemany('INSERT INTO markets ( exchangeID, name, base, quote ) VALUES ( 1, ?, ?, ? )',
+                     [(f'asset{i}_btc', f'asset{i}', 'btc') for i in range(markets)])
+    perMarket = rows // markets
+    snapshotRows = 2 * levels
+    conn.execute("""
+        INSERT INTO books ( marketID, TimeStamp, side, rate, qty )
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+        SELECT m.ID, datetime('2024-01-01', '+' || (n.i / ?) || ' minutes'), (n.i / ?) % 2,
+        1000000 + n.i % ?, 100000000 + n.i % 997
+        FROM markets m, n ORDER BY m.ID, n.i
+        """, (perMarket, snapshotRows, levels, levels))
+    conn.commit()
+    conn.close()
+
+
+def runMethod(method, path, chunkSize):
+    start = time.perf_counter()
+    if method == 'full':
+        data = dashData.getBookData(path)
+        data['period'] = data['TimeStamp'].dt.floor('1h')
+        groups = data.groupby(['period', 'market', 'side'])
+        output = groups['qty'].sum() / groups['TimeStamp'].nunique()
+    else:
+        output = dashData.getBookDepth(path, '1h', chunkSize=chunkSize)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on linux
+    print(f'{elapsed:.2f} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} {len(output)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='1000000,5000000', help='comma separated books table sizes')
+    parser.add_argument('--markets', type=int, default=20)
+    parser.add_argument('--levels', type=int, default=50, help='levels per side per snapshot')
+    parser.add_argument('--chunk', type=int, default=100000)
+    parser.add_argument('--full-max', type=int, default=5000000, help='largest table to read in full')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        runMethod(args.run, args.path, args.chunk)
+        sys.exit()
+    print(f'{"rows":>10} {"method":<8} {"s":>8} {"peak RSS MiB":>13} {"groups":>8}')
+    for rows in [int(x) for x in args.rows.split(',')]:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'bench.db')
+            fillBooks(path, rows, args.markets, args.levels)
+            for method in ['full', 'chunked']:
+                if method == 'full' and rows > args.full_max:
+                    print(f'{rows:>10} {method:<8} {"skipped":>8}')
+                    continue
+                result = subprocess.run([sys.executable, '-m', 'benchmarks.stream_bench', '--run', method,
+                                         '--path', path, '--chunk', str(args.chunk)],
+                                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(f'{rows:>10} {method:<8} {"failed":>8} {result.stderr.strip().splitlines()[-1]}')
+                    continue
+                elapsed, peak, groups = result.stdout.split()[-3:]
+                print(f'{rows:>10} {method:<8} {elapsed:>8} {peak:>13} {groups:>8}')
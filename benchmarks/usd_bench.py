@@ -0,0 +1,71 @@
+# times dashData.convertValueUSD against the previous row wise implementation on a synthetic
+# daily candle set, prices come from a local source so no network is involved. the previous
+# implementation merged its result back on the timestamp alone, which fans out to the sum of
+# the squared rows per timestamp. that merge is not run, only its output size is reported.
+# run from the repository root: python -m benchmarks.usd_bench
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import dashData
+
+
+def priceSource(assets, metric, dateStart, dateEnd):
+    dates = pd.date_range(dateStart, dateEnd, freq='D').strftime('%Y-%m-%d')
+    rng = np.random.default_rng(1)
+    return pd.DataFrame({'asset': np.repeat(assets, len(dates)),
+                         'date': np.tile(dates, len(assets)),
+                         'value': rng.uniform(1, 1000, len(assets) * len(dates))})
+
+
+def makeCandles(rows, markets, assets):
+    # daily candles for markets markets over rows / markets days
+    days = rows // markets
+    rng = np.random.default_rng(1)
+    timeOpen = pd.date_range('2000-01-01', periods=days, freq='D', tz='UTC')
+    base = np.array([f'asset{i % assets}' + ('.eth' if i % 7 == 0 else '') for i in range(markets)])
+    quote = np.array([f'asset{(i + 1) % assets}' for i in range(markets)])
+    return pd.DataFrame({'timeOpen': np.repeat(timeOpen, markets),
+                         'market': np.tile([f'market{i}' for i in range(markets)], days),
+                         'baseAsset': np.tile(base, days),
+                         'quoteAsset': np.tile(quote, days),
+                         'baseVol': rng.uniform(0, 100, days * markets),
+                         'quoteVol': rng.uniform(0, 10, days * markets)})
+
+
+def legacyConvert(data, dateCol, assetCol, valueCol, PriceUSD):
+    # the previous convertValueUSD body, prices are passed in
+    temp = data[[dateCol, assetCol, valueCol]].sort_values(by=[dateCol])
+    temp = pd.merge_asof(temp, PriceUSD, left_on=dateCol, right_on='date')
+    colUSD = (valueCol + 'USD')
+    temp[colUSD] = temp.apply(lambda row: row[valueCol] * row[row[assetCol].split(".")[0]], axis=1)
+    # the merge back on dateCol would return this many rows
+    return int((data.groupby(dateCol).size() ** 2).sum())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='10000,100000,1000000', help='comma separated candle counts')
+    parser.add_argument('--markets', type=int, default=100)
+    parser.add_argument('--assets', type=int, default=20)
+    parser.add_argument('--legacy-max', type=int, default=1000000, help='largest set to run the previous version on')
+    args = parser.parse_args()
+    print(f'{"rows":>9} {"legacy s":>9} {"legacy rows out":>16} {"vector s":>9} {"2 cols s":>9} {"rows out":>9}')
+    for rows in [int(x) for x in args.rows.split(',')]:
+        data = makeCandles(rows, args.markets, args.assets)
+        legacy, legacyRows = '-', '-'
+        if rows <= args.legacy_max:
+            assets = list(data['baseAsset'].str.split('.').str[0].unique())
+            PriceUSD = dashData.cm.getMetric(assets, 'PriceUSD', data['timeOpen'].min(), data['timeOpen'].max(),
+                                             source=priceSource)
+            start = time.perf_counter()
+            legacyRows = legacyConvert(data, 'timeOpen', 'baseAsset', 'baseVol', PriceUSD)
+            legacy = f'{time.perf_counter() - start:.2f}'
+        start = time.perf_counter()
+        output = dashData.convertValueUSD(data, 'timeOpen', 'baseAsset', 'baseVol', source=priceSource)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        output = dashData.convertValueUSD(data, 'timeOpen', {'baseVol': 'baseAsset', 'quoteVol': 'quoteAsset'},
+                                          source=priceSource)
+        double = time.perf_counter() - start
+        print(f'{rows:>9} {legacy:>9} {legacyRows:>16} {single:>9.2f} {double:>9.2f} {len(output):>9}')
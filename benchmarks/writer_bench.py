@@ -0,0 +1,120 @@
+# measures the background group writer: the sequential poll loop of main.py writing inline
+# against writing through a dbmgr.GroupWriter, and the async collector committing every job
+# alone (groupSize 1) against committing them in groups. rows/s counts the book and candle rows
+# stored per second of cycle time, the fetch loop latency is the time between the order book
+# requests of consecutive markets in the sequential loop. the writer section submits small
+# inserts only, to show the commit cost the grouping saves.
+# run from the repository root: python -m benchmarks.writer_bench
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+import dbmgr
+import dexapi
+import collector
+import main
+from tests.mockdex import MockDex
+
+
+def storedRows(path):
+    return int(dbmgr.freeQuery(path, 'select (select count(*) from books) + (select count(*) from candles) as n')['n'].iloc[0])
+
+
+def sequentialCycle(path, exchange, settings):
+    # the main.py sequential loop, settings None writes inline. returns the intervals between
+    # the order book requests
+    main.dbPath = path
+    main.exchangeList = [exchange]
+    main.sleepTimer = 0
+    starts = []
+    getOrderBook = dexapi.getOrderBook
+
+    def timedOrderBook(*args):
+        starts.append(time.perf_counter())
+        return getOrderBook(*args)
+
+    dexapi.getOrderBook = timedOrderBook
+    main.writer = None if settings is None else dbmgr.GroupWriter(path, **settings)
+    try:
+        exchanges = main.updateExchanges()
+        for index, row in exchanges.iterrows():
+            markets = main.updateMarket(row)
+            main.updateBooks(markets)
+            main.updateCandles(markets)
+    finally:
+        dexapi.getOrderBook = getOrderBook
+        if main.writer is not None:
+            main.writer.close()
+            main.writer = None
+    return [later - earlier for earlier, later in zip(starts, starts[1:])]
+
+
+def asyncCycle(path, exchange, settings):
+    collector.runCycle(path, [exchange], maxConcurrent=4, requestRate=1000, **settings)
+    return []
+
+
+def insertJob(path, number):
+    dbmgr.getSession(path).writer.execute('insert into exchanges (name) values (?)', (f'exchange{number}',))
+
+
+def writerOnly(path, jobs, settings):
+    writer = dbmgr.GroupWriter(path, **settings)
+    for number in range(jobs):
+        writer.submit(insertJob, path, number)
+    writer.close()
+    return writer.groups
+
+
+def timeCycle(func, profile, *args):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.db')
+        dbmgr.initalizeDB(path)
+        dbmgr.setStorageProfile(path, profile)
+        start = time.perf_counter()
+        intervals = func(path, *args)
+        elapsed = time.perf_counter() - start
+        rows = storedRows(path)
+        dbmgr.closeSessions()
+        return elapsed, rows, intervals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markets', default='16,64', help='comma separated market counts')
+    parser.add_argument('--orders', type=int, default=200, help='orders per book')
+    parser.add_argument('--latency', type=float, default=0.005, help='mock server latency in seconds')
+    parser.add_argument('--profile', default='default', choices=list(dbmgr.storageProfiles))
+    parser.add_argument('--group-size', type=int, default=dbmgr.writerGroupSize)
+    parser.add_argument('--group-delay', type=float, default=dbmgr.writerGroupDelay)
+    parser.add_argument('--queue-size', type=int, default=dbmgr.writerQueueSize)
+    parser.add_argument('--jobs', type=int, default=2000, help='inserts of the writer section')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # the config.conf settings the benchmark doesn't override
+    main.loadConfig()
+    main.candlePeriods = ['24h']
+    grouped = {'queueSize': args.queue_size, 'groupSize': args.group_size, 'groupDelay': args.group_delay}
+    single = {'queueSize': args.queue_size, 'groupSize': 1, 'groupDelay': 0}
+    runs = [('sequential inline', sequentialCycle, None),
+            ('sequential writer', sequentialCycle, grouped),
+            ('async groupSize 1', asyncCycle, single),
+            (f'async groupSize {args.group_size}', asyncCycle, grouped)]
+
+    print(f'profile={args.profile} latency={args.latency}s orders={args.orders} '
+          f'groupSize={args.group_size} groupDelay={args.group_delay}s queueSize={args.queue_size}')
+    print(f'{"writer":<29} {"jobs/s":>9} {"commits":>8}')
+    for name, settings in [('groupSize 1', single), (f'groupSize {args.group_size}', grouped)]:
+        elapsed, rows, groups = timeCycle(writerOnly, args.profile, args.jobs, settings)
+        print(f'{name:<29} {args.jobs / elapsed:>9.0f} {groups:>8}')
+    print()
+    print(f'{"markets":>8} {"run":<20} {"cycle s":>8} {"rows/s":>9} {"loop ms p50":>12} {"loop ms max":>12}')
+    for nMarkets in [int(x) for x in args.markets.split(',')]:
+        with MockDex(markets=nMarkets, orders=args.orders, latency=args.latency) as dex:
+            for name, func, settings in runs:
+                elapsed, rows, intervals = timeCycle(func, args.profile, dex.exchange, settings)
+                loop = (f'{statistics.median(intervals) * 1000:>12.1f} {max(intervals) * 1000:>12.1f}'
+                        if intervals else f'{"-":>12} {"-":>12}')
+                print(f'{nMarkets:>8} {name:<20} {elapsed:>8.2f} {rows / elapsed:>9.0f} {loop}')
@@ -0,0 +1,289 @@
+# this module keeps the order books of an exchange in memory from its websocket feed instead of
+# polling /api/orderbook. every market is subscribed once, the book_order, unbook_order and
+# update_remaining notes are applied as they arrive and a gap in the note sequence resyncs the
+# market from a rest snapshot. the books are persisted at a fixed cadence, only those that
+# changed since they were last stored are written through collector.storeBook.
+import datetime
+import itertools
+import json
+import logging
+import threading
+import time
+import numpy as np
+import collector
+import dexapi
+import metrics
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+logger = logging.getLogger(__name__)
+
+# dcrdex message types
+REQUEST = 1
+RESPONSE = 2
+NOTIFICATION = 3
+# notes that change the booked orders, epoch orders only advance the sequence
+bookRoutes = ('book_order', 'unbook_order', 'update_remaining')
+sequencedRoutes = bookRoutes + ('epoch_order',)
+
+
+def feedUrl(exchange):
+    # the websocket endpoint next to the api, https becomes wss and http ws
+    return 'ws' + dexapi.baseUrl(exchange)[len('http'):] + '/ws'
+
+
+class OrderBook:
+    # the booked orders of a market as (side, rate, qty) by order id and the sequence number of
+    # the last applied note. changed is set by every note that changes the orders
+    def __init__(self):
+        self.orders = {}
+        self.seq = None
+        self.changed = False
+
+    def load(self, snapshot):
+        # replaces the orders with a subscription result (orders keyed by oid) or a rest
+        # snapshot (keyed by id)
+        self.orders = {order.get('oid', order.get('id')): (order['side'], order['rate'], order['qty'])
+                       for order in snapshot.get('orders') or []}
+        self.seq = snapshot.get('seq')
+        self.changed = True
+
+    def apply(self, route, note):
+        # applies a note, returns False when notes were missed and the book needs a resync.
+        # notes already contained in the loaded snapshot are skipped
+        seq = note.get('seq')
+        if self.seq is None:
+            return False
+        if seq is not None:
+            if seq <= self.seq:
+                return True
+            if seq != self.seq + 1:
+                return False
+            self.seq = seq
+        if route == 'book_order':
+            self.orders[note['oid']] = (note['side'], note['rate'], note['qty'])
+        elif route == 'unbook_order':
+            self.orders.pop(note['oid'], None)
+        elif route == 'update_remaining':
+            order = self.orders.get(note['oid'])
+            if order is None:
+                return True
+            self.orders[note['oid']] = (order[0], order[1], note['remaining'])
+        else:
+            return True
+        self.changed = True
+        return True
+
+    def levels(self):
+        # the aggregated levels in the frame layout of dexapi.parseOrderBook
+        values = np.array(list(self.orders.values()), dtype=np.int64).reshape(-1, 3)
+        return dexapi.aggregateOrders(values[:, 1], values[:, 2], values[:, 0])
+
+
+class BookFeed:
+    # the websocket feed of one exchange. markets is a frame of stored markets as returned by
+    # collector.storeMarkets, update replaces it. the feed runs on its own thread and reconnects
+    # with a delay growing from reconnectDelay to maxReconnectDelay, every connection reloads the
+    # books from the subscription results. a connection without any message for timeout seconds
+    # is considered dead
+    def __init__(self, exchange, markets=None, timeout=60, reconnectDelay=1, maxReconnectDelay=60):
+        if websocket is None:
+            raise Exception('websocket-client is not installed')
+        self.exchange = exchange
+        self.url = feedUrl(exchange)
+        self.timeout = timeout
+        self.reconnectDelay = reconnectDelay
+        self.maxReconnectDelay = maxReconnectDelay
+        self.lock = threading.Lock()
+        # markets and books by market name, dcrdex market ids are the market names
+        self.markets = {}
+        self.books = {}
+        # the market name of every pending subscription request
+        self.requests = {}
+        self.ids = itertools.count(1)
+        self.assetIDs = {}
+        self.socket = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.connected = threading.Event()
+        self.resyncs = 0
+        self.reconnects = 0
+        if markets is not None:
+            self.update(markets)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f'feed {self.exchange}', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def update(self, markets):
+        # subscribes new markets and unsubscribes those no longer listed
+        markets = {market['name']: market for idx, market in markets.iterrows()}
+        with self.lock:
+            added = [name for name in markets if name not in self.markets]
+            removed = [name for name in self.markets if name not in markets]
+            self.markets = markets
+            for name in removed:
+                self.books.pop(name, None)
+            # read with the markets, connect subscribes the markets it finds once it is set
+            connected = self.connected.is_set()
+        if connected:
+            try:
+                for name in added:
+                    self.subscribe(name)
+                for name in removed:
+                    self.send('unsub_orderbook', {'marketid': name})
+            except Exception as err:
+                # the markets are subscribed again on reconnect
+                logger.error(f'{err=}, {type(err)=} on {self.exchange} feed')
+
+    def send(self, route, payload):
+        requestID = next(self.ids)
+        self.socket.send(json.dumps({'type': REQUEST, 'route': route, 'id': requestID, 'payload': payload}))
+        return requestID
+
+    def assetID(self, symbol):
+        # subscriptions use asset ids, the parsed markets only carry the symbols. the ids are read
+        # from the config once and again only for an asset the feed doesn't know yet
+        if symbol not in self.assetIDs:
+            config = dexapi.getResponse(dexapi.baseUrl(self.exchange) + '/api/config')
+            self.assetIDs = {asset['symbol']: asset['id'] for asset in config['assets']}
+        return self.assetIDs[symbol]
+
+    def subscribe(self, name):
+        market = self.markets[name]
+        payload = {'base': self.assetID(market['base']), 'quote': self.assetID(market['quote'])}
+        with self.lock:
+            self.requests[self.send('orderbook', payload)] = name
+
+    def connect(self):
+        self.socket = websocket.create_connection(self.url, timeout=self.timeout)
+        # short reads so stop is noticed, the timeout is enforced by receive
+        self.socket.settimeout(min(1, self.timeout))
+        with self.lock:
+            self.requests.clear()
+            self.books.clear()
+            names = list(self.markets)
+            # an update after this subscribes its own markets, one before it is in names
+            self.connected.set()
+        for name in names:
+            self.subscribe(name)
+        logger.info(f'feed connected to {self.url} for {len(names)} markets')
+
+    def resync(self, name):
+        # reloads a book from the rest snapshot, notes up to its sequence number are skipped
+        market = self.markets[name]
+        snapshot = dexapi.getResponse(f'{dexapi.baseUrl(self.exchange)}/api/orderbook/{market["base"]}/{market["quote"]}')
+        with self.lock:
+            if name in self.books:
+                self.books[name].load(snapshot)
+        self.resyncs += 1
+        metrics.count('dexdb_feed_resyncs_total', host=self.exchange)
+        logger.info(f'{self.exchange} {name} resynced at seq {snapshot.get("seq")}')
+
+    def handle(self, message):
+        if message.get('type') == RESPONSE:
+            with self.lock:
+                name = self.requests.pop(message.get('id'), None)
+            payload = message.get('payload') or {}
+            if name is None:
+                return
+            if payload.get('error') or payload.get('result') is None:
+                logger.error(f'subscription failed for {self.exchange} {name}: {payload.get("error")}')
+                return
+            book = OrderBook()
+            book.load(payload['result'])
+            with self.lock:
+                if name in self.markets:
+                    self.books[name] = book
+        elif message.get('type') == NOTIFICATION and message.get('route') in sequencedRoutes:
+            note = message.get('payload') or {}
+            name = note.get('marketid')
+            metrics.count('dexdb_feed_notes_total', host=self.exchange, route=message['route'])
+            with self.lock:
+                book = self.books.get(name)
+                if book is None:
+                    return
+                applied = book.apply(message['route'], note)
+            if not applied:
+                logger.warning(f'gap after seq {book.seq} in the {self.exchange} {name} feed')
+                self.resync(name)
+
+    def receive(self):
+        last = time.monotonic()
+        while not self.stopping.is_set():
+            try:
+                text = self.socket.recv()
+            except websocket.WebSocketTimeoutException:
+                if time.monotonic() - last > self.timeout:
+                    raise Exception(f'no message for {self.timeout} seconds')
+                continue
+            if not text:
+                raise Exception('connection closed by the server')
+            last = time.monotonic()
+            self.handle(json.loads(text))
+
+    def run(self):
+        delay = self.reconnectDelay
+        while not self.stopping.is_set():
+            try:
+                self.connect()
+                delay = self.reconnectDelay
+                self.receive()
+            except Exception as err:
+                if not self.stopping.is_set():
+                    logger.error(f'{err=}, {type(err)=} on {self.exchange} feed')
+            finally:
+                self.connected.clear()
+                if self.socket is not None:
+                    self.socket.close()
+                    self.socket = None
+            if self.stopping.wait(delay):
+                break
+            delay = min(delay * 2, self.maxReconnectDelay)
+            self.reconnects += 1
+            metrics.count('dexdb_feed_reconnects_total', host=self.exchange)
+
+    def changedBooks(self):
+        # the markets and levels of the books changed since the last call
+        with self.lock:
+            changed = [(self.markets[name], book.levels()) for name, book in self.books.items() if book.changed]
+            for book in self.books.values():
+                book.changed = False
+        return changed
+
+
+def persist(path, feed, bookStorage='levels', keyframeInterval=60):
+    # stores the changed books of a feed, returns how many were stored
+    timeStamp = datetime.datetime.now()
+    changed = feed.changedBooks()
+    for market, books in changed:
+        collector.storeBook(path, market, books, timeStamp, bookStorage, keyframeInterval)
+    return len(changed)
+
+
+def runFeed(dbPath, exchange, duration=None, persistInterval=60, bookStorage='levels', keyframeInterval=60,
+            **options):
+    # stores the markets of an exchange and follows their books for duration seconds (until
+    # interrupted without one), persisting them every persistInterval seconds and once more at
+    # the end. options are passed to the BookFeed, returns the stopped feed
+    exchanges = collector.storeExchanges(dbPath, [exchange])
+    markets = dexapi.getMarkets(exchange)
+    markets = collector.storeMarkets(dbPath, exchanges.loc[exchanges['name'] == exchange].iloc[0], markets)
+    feed = BookFeed(exchange, markets, **options).start()
+    end = None if duration is None else time.monotonic() + duration
+    try:
+        while end is None or time.monotonic() < end:
+            time.sleep(persistInterval if end is None else max(0, min(persistInterval, end - time.monotonic())))
+            persist(dbPath, feed, bookStorage, keyframeInterval)
+    finally:
+        feed.stop()
+        persist(dbPath, feed, bookStorage, keyframeInterval)
+    return feed
@@ -0,0 +1,90 @@
+# this module computes liquidity statistics of every order book snapshot as it is stored: best
+# bid and ask, mid, spread and the depth within 1, 2, 5 and 10% of the mid in base and quote
+# units with the imbalance of each band. one row per snapshot goes to bookStats, so liquidity
+# charts read a row per snapshot instead of scanning every level of the books table.
+import logging
+import numpy as np
+import pandas as pd
+import dbmgr
+
+logger = logging.getLogger(__name__)
+
+# compute the statistics in storeBook
+enabled = True
+# depth bands in percent of the mid
+bands = (1, 2, 5, 10)
+# dcrdex rates are quote atoms per rateEncoding base atoms
+rateEncoding = 100000000
+
+statCols = ['bestBid', 'bestAsk', 'mid', 'spread'] + \
+           [f'{col}{band}' for band in bands for col in ('bidBase', 'askBase', 'bidQuote', 'askQuote', 'imbalance')]
+bookStatCols = {col: col for col in ['marketID', 'TimeStamp'] + statCols}
+
+
+def snapshotStats(books, baseConversionFactor, quoteConversionFactor):
+    # the statistics of one snapshot as a dict, books is an order book frame (rate, qty, side) as
+    # returned by dexapi.getOrderBook. prices and amounts are in conventional units, a one sided
+    # book has no mid and no depth bands
+    price = books['rate'].to_numpy(dtype=float) / rateEncoding * baseConversionFactor / quoteConversionFactor
+    base = books['qty'].to_numpy(dtype=float) / baseConversionFactor
+    quote = base * price
+    buy = (books['side'] == 'buy').to_numpy()
+    bestBid = price[buy].max() if buy.any() else np.nan
+    bestAsk = price[~buy].min() if (~buy).any() else np.nan
+    mid = (bestBid + bestAsk) / 2
+    stats = {'bestBid': bestBid, 'bestAsk': bestAsk, 'mid': mid, 'spread': bestAsk - bestBid}
+    for band in bands:
+        bid = buy & (price >= mid * (1 - band / 100))
+        ask = ~buy & (price <= mid * (1 + band / 100))
+        if np.isnan(mid):
+            depths = [np.nan] * 4
+        else:
+            depths = [base[bid].sum(), base[ask].sum(), quote[bid].sum(), quote[ask].sum()]
+        for col, depth in zip(('bidBase', 'askBase', 'bidQuote', 'askQuote'), depths):
+            stats[f'{col}{band}'] = depth
+        # +1 when the band only holds bids, -1 when it only holds asks
+        total = depths[0] + depths[1]
+        stats[f'imbalance{band}'] = (depths[0] - depths[1]) / total if total > 0 else np.nan
+    return stats
+
+
+# this function stores the statistics of a snapshot, market needs its marketID and conversion
+# factors as in the frames returned by collector.storeMarkets
+def storeStats(path, market, books, timeStamp):
+    stats = snapshotStats(books, market['baseConversionFactor'], market['quoteConversionFactor'])
+    row = pd.DataFrame([dict(stats, marketID=market['marketID'], TimeStamp=timeStamp)])
+    dbmgr.insertRecords(path, 'bookStats', row, bookStatCols, replace=True)
+
+
+# this function fills bookStats for the snapshots of the books table that have no statistics
+# yet, e.g. those collected before it existed. the levels are read in chunks and the rows are
+# written once the read is done. returns the number of snapshots added
+def backfill(path, chunkSize=None):
+    queryStr = """
+        select b.marketID, b.TimeStamp, b.side, b.rate, b.qty, mc.baseConversionFactor, mc.quoteConversionFactor
+        FROM books b
+        join marketConfig mc on mc.marketID = b.marketID
+        where not exists (select 1 from bookStats s where s.marketID = b.marketID and s.TimeStamp = b.TimeStamp)
+        order by b.marketID, b.TimeStamp
+        """
+    rows = []
+    rest = None
+    for chunk in dbmgr.iterQuery(path, queryStr, chunkSize=chunkSize):
+        if rest is not None:
+            chunk = pd.concat([rest, chunk], ignore_index=True)
+        # the last snapshot can continue in the next chunk
+        last = (chunk['marketID'] == chunk['marketID'].iloc[-1]) & (chunk['TimeStamp'] == chunk['TimeStamp'].iloc[-1])
+        rest = chunk.loc[last]
+        rows += chunkStats(chunk.loc[~last])
+    if rest is not None:
+        rows += chunkStats(rest)
+    if rows:
+        dbmgr.insertRecords(path, 'bookStats', pd.DataFrame(rows), bookStatCols, replace=True)
+        logger.info(f'book statistics added for {len(rows)} snapshots')
+    return len(rows)
+
+
+def chunkStats(chunk):
+    return [dict(snapshotStats(books, books['baseConversionFactor'].iloc[0], books['quoteConversionFactor'].iloc[0]),
+                 marketID=marketID, TimeStamp=timeStamp)
+            for (marketID, timeStamp), books in chunk.groupby(['marketID', 'TimeStamp'], sort=False)]
@@ -0,0 +1,113 @@
+# this module stores order book snapshots as periodic keyframes holding the full book and
+# deltas holding only the levels that changed since the previous snapshot, a removed level is
+# written as a delta with a qty of 0. everything is integer encoded: timestamps are epoch
+# milliseconds, side is 1 for buy and 0 for sell, rates and quantities are in atoms.
+import logging
+import threading
+import pandas as pd
+import dbmgr
+
+logger = logging.getLogger(__name__)
+
+BUY = 1
+SELL = 0
+
+# last written book and number of deltas since its keyframe per (path, marketID)
+states = {}
+statesLock = threading.Lock()
+
+
+# naive timestamps are encoded as they are, i.e. the same wall clock the books table stores
+def toEpochMs(timeStamp):
+    return int(pd.Timestamp(timeStamp).value // 1000000)
+
+
+def fromEpochMs(stamp):
+    return pd.to_datetime(stamp, unit='ms')
+
+
+# this function turns a getOrderBook frame into a dictionary of qty keyed by (side, rate). books
+# only hold a few hundred levels, for those plain dictionaries diff much faster than pandas
+def encodeBook(books):
+    side = books['side']
+    if side.dtype == object:
+        side = side == 'buy'
+    levels = list(zip(side.to_numpy(dtype='int64').tolist(), books['rate'].tolist()))
+    book = dict(zip(levels, books['qty'].tolist()))
+    if len(book) < len(levels):
+        # levels repeat, sum their quantities
+        book = {}
+        for level, qty in zip(levels, books['qty'].tolist()):
+            book[level] = book.get(level, 0) + qty
+    return book
+
+
+# this function returns the levels of book that differ from prev, removed levels have a qty of 0
+def diffBooks(prev, book):
+    changed = {level: qty for level, qty in book.items() if prev.get(level) != qty}
+    changed.update({level: 0 for level in prev if level not in book})
+    return changed
+
+
+# this function writes a snapshot for a market, every keyframeInterval snapshots (and on the
+# first snapshot after start up) the full book is written, otherwise only the changed levels.
+# returns the number of level rows written
+def writeSnapshot(path, marketID, timeStamp, books, keyframeInterval=60):
+    marketID = int(marketID)
+    stamp = toEpochMs(timeStamp)
+    book = encodeBook(books)
+    key = (path, marketID)
+    with statesLock:
+        state = states.get(key)
+    keyframe = state is None or state['deltas'] + 1 >= keyframeInterval
+    levels = book if keyframe else diffBooks(state['book'], book)
+    records = [(marketID, stamp, side, rate, qty) for (side, rate), qty in levels.items()]
+    with dbmgr.getSession(path).write() as conn:
+        conn.execute('INSERT OR REPLACE INTO bookSnapshots ( marketID, timeStamp, keyframe ) VALUES ( ?, ?, ? )',
+                     (marketID, stamp, int(keyframe)))
+        conn.executemany('INSERT OR REPLACE INTO bookLevels ( marketID, timeStamp, side, rate, qty ) '
+                         'VALUES ( ?, ?, ?, ?, ? )', records)
+        dbmgr.tableWritten(conn, 'bookSnapshots', 'bookLevels')
+    with statesLock:
+        states[key] = {'book': book, 'deltas': 0 if keyframe else state['deltas'] + 1}
+    # the snapshot isn't stored if an enclosing write is rolled back, the next one is a keyframe
+    dbmgr.onRollback(path, lambda: dropState(key))
+    logger.debug(f'{"keyframe" if keyframe else "delta"} of {len(levels)} levels for market {marketID}')
+    return len(levels)
+
+
+def dropState(key):
+    with statesLock:
+        states.pop(key, None)
+
+
+# this function reconstructs the book of a market as of timeStamp, i.e. the latest snapshot at
+# or before it, from the closest keyframe and the deltas that follow. the output has the
+# getOrderBook layout and is empty if nothing had been stored by then
+def readBook(path, marketID, timeStamp):
+    marketID = int(marketID)
+    stamp = toEpochMs(timeStamp)
+    with dbmgr.getSession(path).read() as conn:
+        keyframe = conn.execute('SELECT max(timeStamp) FROM bookSnapshots '
+                                'WHERE marketID = ? AND keyframe = 1 AND timeStamp <= ?',
+                                (marketID, stamp)).fetchone()[0]
+        levels = []
+        if keyframe is not None:
+            levels = conn.execute('SELECT side, rate, qty FROM bookLevels '
+                                  'WHERE marketID = ? AND timeStamp >= ? AND timeStamp <= ? '
+                                  'ORDER BY timeStamp', (marketID, keyframe, stamp)).fetchall()
+    levels = pd.DataFrame(levels, columns=['side', 'rate', 'qty'], dtype='int64')
+    # rows come in snapshot order, so the last row of a level holds its state at timeStamp
+    book = levels.drop_duplicates(['side', 'rate'], keep='last')
+    book = book.loc[book['qty'] > 0].sort_values(by=['rate'])
+    book = book.assign(side=book['side'].map({BUY: 'buy', SELL: 'sell'}))
+    return book[['rate', 'qty', 'side']].reset_index(drop=True)
+
+
+# this function lists the snapshot timestamps stored for a market between start and end
+def snapshotTimes(path, marketID, start, end):
+    with dbmgr.getSession(path).read() as conn:
+        stamps = conn.execute('SELECT timeStamp FROM bookSnapshots WHERE marketID = ? '
+                              'AND timeStamp >= ? AND timeStamp <= ? ORDER BY timeStamp',
+                              (int(marketID), toEpochMs(start), toEpochMs(end))).fetchall()
+    return fromEpochMs([stamp[0] for stamp in stamps])
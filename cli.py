@@ -0,0 +1,74 @@
+# command line entry points. collect runs a collection as main.py does, dashboard prints the
+# dashboard tables of dashData.py. the collection and analysis modules are only imported once
+# the arguments are parsed, so --help and argument errors return without loading pandas.
+# run from the repository root: python cli.py collect or python cli.py dashboard liquidity
+import argparse
+import os
+import sys
+
+
+def collect(args):
+    import main
+    main.loadConfig(args.config)
+    if args.exchanges:
+        main.exchangeList = args.exchanges.split(',')
+    if args.mode:
+        main.collectorMode = args.mode
+    if args.daemon is not None:
+        main.daemonEnabled = args.daemon
+    main.run()
+
+
+def dashboard(args):
+    import pandas as pd
+    import dashData
+    # the query cache settings are read from the config when there is one
+    if args.db is None or os.path.exists(args.config):
+        dashData.loadConfig(args.config)
+    path = args.db or dashData.dbPath
+    since = pd.Timestamp.now() - pd.Timedelta(days=args.days)
+    if args.report == 'volumes':
+        output = dashData.getVolumeData(path, args.granularity, args.level, start=since)
+    elif args.report == 'liquidity':
+        output = dashData.getLiquidityData(path, start=since)
+    elif args.report == 'depth':
+        output = dashData.getBookDepth(path, args.freq, start=since)
+    else:
+        output = dashData.getCandleData(path, args.period)
+        output = output.loc[output['timeOpen'] >= since.tz_localize('UTC')] if output is not None else None
+    if output is None:
+        raise SystemExit(f'{args.report} could not be read from {path}')
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.max_columns', None)
+    print(output)
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='cli.py')
+    parser.add_argument('--config', default='config.conf', help='config file, read when the command runs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    collectParser = commands.add_parser('collect', help='collect exchange data into the database')
+    collectParser.add_argument('--exchanges', help='comma separated exchanges instead of the configured ones')
+    collectParser.add_argument('--mode', choices=['async', 'sequential', 'process'])
+    collectParser.add_argument('--daemon', action=argparse.BooleanOptionalAction,
+                               help='run continuously, or once with --no-daemon')
+    collectParser.set_defaults(func=collect)
+    dashParser = commands.add_parser('dashboard', help='print a dashboard table')
+    dashParser.add_argument('report', nargs='?', default='volumes', choices=['volumes', 'liquidity', 'depth', 'candles'])
+    dashParser.add_argument('--db', help='database instead of the configured one')
+    dashParser.add_argument('--days', type=float, default=90, help='days back from now')
+    dashParser.add_argument('--granularity', default='1d', choices=['1d', '1w', '1mo'], help='volumes granularity')
+    dashParser.add_argument('--level', default='market', choices=['market', 'exchange'], help='volumes level')
+    dashParser.add_argument('--freq', default='1h', help='depth averaging period')
+    dashParser.add_argument('--period', default='24h', help='candle period')
+    dashParser.set_defaults(func=dashboard)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
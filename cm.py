@@ -1,33 +1,132 @@
-from coinmetrics.api_client import CoinMetricsClient
+import datetime
+import time
+import numpy as np
 import pandas as pd
+import dbmgr
 import logging
 
 logger = logging.getLogger(__name__)
 
+# the coinmetrics client is created on first use and shared by every request
+client = None
+# days before today after which a day without a value is final and cached as missing, more
+# recent days may still be published by the provider
+settleDays = 2
+# seconds before a recent day the provider had no value for is requested again
+refreshInterval = 3600
+# last request time of recent days without a value per (asset, metric, date)
+recentMisses = {}
+metricCols = {'asset': 'asset', 'metric': 'metric', 'date': 'date', 'value': 'value'}
 
-def getMetric(assets,metric,date_start,date_end):
+
+def getClient():
+    # the client library is only imported when prices are requested from coinmetrics, it takes
+    # longer to import than the rest of the collector
+    global client
+    if client is None:
+        from coinmetrics.api_client import CoinMetricsClient
+        client = CoinMetricsClient()
+    return client
+
+
+# sources load a daily metric for a list of assets between two YYYY-MM-DD dates (inclusive) and
+# return a long frame with asset, date (YYYY-MM-DD) and value columns. getMetric uses
+# defaultSource unless another one is passed, e.g. a local fixture in tests
+def coinMetricsSource(assets, metric, dateStart, dateEnd):
+    logger.info(f'Getting coinmetrics data for {assets} from {dateStart} to {dateEnd}')
+    data = getClient().get_asset_metrics(
+        assets=assets,
+        metrics=metric,
+        frequency="1d",
+        start_time=dateStart,
+        end_time=dateEnd
+        ).to_dataframe()
+    if len(data) == 0:
+        return pd.DataFrame(columns=['asset', 'date', 'value'])
+    return pd.DataFrame({'asset': data['asset'],
+                         'date': data['time'].dt.tz_convert(None).dt.strftime('%Y-%m-%d'),
+                         'value': pd.to_numeric(data[metric])})
+
+
+defaultSource = coinMetricsSource
+
+
+def missingRanges(cached, assets, dates, metric):
+    # this function groups the dates missing from the cache into contiguous ranges and returns
+    # the assets missing each range, assets with the same gaps are requested together
+    recent = (datetime.datetime.utcnow().date() - datetime.timedelta(days=settleDays)).strftime('%Y-%m-%d')
+    now = time.time()
+    ranges = {}
+    for asset in assets:
+        runs = []
+        for index, date in enumerate(dates):
+            if (asset, date) in cached:
+                continue
+            if date > recent and now - recentMisses.get((asset, metric, date), 0) < refreshInterval:
+                continue
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        for first, last in runs:
+            ranges.setdefault((dates[first], dates[last]), []).append(asset)
+    return ranges
+
+
+def readCached(path, assets, metric, dateStart, dateEnd):
+    queryStr = (f'select asset, date, value from metrics where metric = ? and date >= ? and date <= ? '
+                f'and asset in ({", ".join("?" * len(assets))})')
+    return dbmgr.freeQuery(path, queryStr, (metric, dateStart, dateEnd, *assets))
+
+
+# this function loads the missing ranges from the source into the metrics table. settled days
+# the source has no value for are stored as null so they aren't requested again
+def fillCache(path, ranges, metric, source):
+    recent = (datetime.datetime.utcnow().date() - datetime.timedelta(days=settleDays)).strftime('%Y-%m-%d')
+    for (dateStart, dateEnd), assets in ranges.items():
+        data = source(assets, metric, dateStart, dateEnd)
+        dates = pd.date_range(dateStart, dateEnd, freq='D').strftime('%Y-%m-%d')
+        expected = pd.MultiIndex.from_product([assets, dates], names=['asset', 'date'])
+        data = data.drop_duplicates(['asset', 'date']).set_index(['asset', 'date'])['value'].reindex(expected)
+        data = data.reset_index()
+        misses = data['value'].isna() & (data['date'] > recent)
+        for asset, date in zip(data.loc[misses, 'asset'], data.loc[misses, 'date']):
+            recentMisses[(asset, metric, date)] = time.time()
+        data = data.loc[~misses].assign(metric=metric)
+        if len(data):
+            dbmgr.insertRecords(path, 'metrics', data, metricCols, replace=True)
+
+
+def getMetric(assets,metric,date_start,date_end,path=None,source=None):
     try:
         # this function grabs the metric for asset within the specified date range,
         # removes the timezone, sets the date as an index and changes the column name to
-        # the name of the metric
-        logger.info(f'Getting coinmetrics data for {assets}')
-        client = CoinMetricsClient()
-        frequency = "1d"
-        data = client.get_asset_metrics(
-            assets=assets,
-            metrics=metric,
-            frequency=frequency,
-            start_time=date_start.strftime("%Y-%m-%d"),
-            end_time=date_end.strftime("%Y-%m-%d")
-            ).to_dataframe()
-        # convert time, rename and sort by date
-        data["time"] = data['time'].dt.tz_convert(None)
-        data = data.rename(columns={"time": "date"})
-        data = data.sort_values(by=['date'])
-        # pivot to create the asset columns
-        output = data.pivot(index='date', columns="asset", values=metric)
+        # the name of the metric. with a database path the values are cached in its metrics
+        # table and only the dates missing from it are requested from the source
+        if source is None:
+            source = defaultSource
+        if isinstance(assets, str):
+            assets = [assets]
+        dateStart = pd.Timestamp(date_start).strftime('%Y-%m-%d')
+        dateEnd = pd.Timestamp(date_end).strftime('%Y-%m-%d')
+        if path is None:
+            data = source(assets, metric, dateStart, dateEnd)
+        else:
+            # today is the last day the source can have
+            today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+            dates = list(pd.date_range(dateStart, min(dateEnd, today), freq='D').strftime('%Y-%m-%d'))
+            data = readCached(path, assets, metric, dateStart, dateEnd)
+            ranges = missingRanges(set(zip(data['asset'], data['date'])), assets, dates, metric)
+            if ranges:
+                logger.info(f'requesting {len(ranges)} missing {metric} ranges')
+                fillCache(path, ranges, metric, source)
+                data = readCached(path, assets, metric, dateStart, dateEnd)
+        data = data.dropna(subset=['value'])
+        # pivot to create the asset columns, sorted by date
+        output = data.pivot(index='date', columns="asset", values='value').sort_index().astype(float)
         # format timestamps
-        output.index = pd.to_datetime(output.index, utc=True, format='%Y-%m-%dT%H:%M:%S')
+        output.index = pd.to_datetime(output.index, utc=True, format='%Y-%m-%d')
+        output.index.name = 'date'
         # flatten multiindex
         output = pd.DataFrame(output.to_records())
         # purge
@@ -37,3 +136,18 @@ def getMetric(assets,metric,date_start,date_end):
     except Exception as error:
         logger.error(f'{error} ')
         return None
+
+
+# this function returns the latest daily price at or before each row's date for the asset of
+# the row. prices is the cm.getMetric pivot, it is melted to long rows so a single merge_asof
+# by asset covers every asset at once
+def lookupPrices(dates, assets, prices):
+    prices = prices.melt(id_vars='date', var_name='asset', value_name='price').dropna(subset=['price'])
+    prices = prices.sort_values(by=['date'], kind='stable')
+    rows = pd.DataFrame({'date': dates, 'asset': assets, 'position': np.arange(len(dates))})
+    rows = rows.sort_values(by=['date'], kind='stable')
+    rows = pd.merge_asof(rows, prices, on='date', by='asset')
+    # back to the input order
+    price = np.empty(len(rows))
+    price[rows['position'].to_numpy()] = rows['price'].to_numpy(dtype=float)
+    return price
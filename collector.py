@@ -0,0 +1,387 @@
+# this module runs a collection cycle concurrently using asyncio. the blocking dexapi calls
+# are executed in worker threads and throttled per exchange host, while every database
+# write goes through a single background writer (dbmgr.GroupWriter) so sqlite only ever sees
+# one writer and the writes of many markets share a commit.
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+import pandas as pd
+import bookstats
+import bookstore
+import dbmgr
+import dexapi
+import metrics
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# column dictionaries for the api frames, keys are the frame columns and values the table columns
+marketCols = {'exchangeID': 'exchangeID',
+              'name': 'name',
+              'base': 'base',
+              'quote': 'quote'}
+marketConfigCols = {'marketID': 'marketID',
+                    'epochlen': 'epochlen',
+                    'lotsize': 'lotsize',
+                    'parcelSize': 'parcelSize',
+                    'ratestep': 'ratestep',
+                    'baseConversionFactor': 'baseConversionFactor',
+                    'quoteConversionFactor': 'quoteConversionFactor',
+                    'LastUpdated': 'LastUpdated'}
+bookCols = {'marketID': 'marketID',
+            'TimeStamp': 'TimeStamp',
+            'side': 'side',
+            'rate': 'rate',
+            'qty': 'qty'}
+candleCols = {'marketID': 'marketID',
+              'period': 'period',
+              'startStamps': 'timeOpen',
+              'endStamps': 'timeClose',
+              'matchVolumes': 'baseVolume',
+              'quoteVolumes': 'quoteVolume',
+              'highRates': 'high',
+              'lowRates': 'low',
+              'startRates': 'open',
+              'endRates': 'close'}
+
+
+# these functions store the api frames, they are shared by the sequential and the concurrent
+# collection paths
+
+# exchange IDs by name per database path, read once and extended as exchanges are added
+exchangeIDs = {}
+
+
+def storeExchanges(path, exchangeList):
+    # inserts the exchanges that aren't stored yet and returns every known exchange with its ID,
+    # once they are cached nothing is read or written
+    known = exchangeIDs.get(path)
+    if known is None:
+        stored = dbmgr.readTable(path, 'exchanges', ['ID', 'name'])
+        known = exchangeIDs[path] = dict(zip(stored['name'], stored['ID'].astype(int)))
+    missing = [name for name in dict.fromkeys(exchangeList) if name not in known]
+    if missing:
+        # the cache is read again if the enclosing write is rolled back
+        dbmgr.onRollback(path, lambda: exchangeIDs.pop(path, None))
+        added = dbmgr.insertReturning(path, 'exchanges', pd.DataFrame({'name': missing}), {'name': 'name'},
+                                      ['ID', 'name'])
+        known.update(zip(added['name'], added['ID'].astype(int)))
+        if len(added) < len(missing):
+            # added by another process since the cache was read
+            stored = dbmgr.readTable(path, 'exchanges', ['ID', 'name'], filters={'name': missing})
+            known.update(zip(stored['name'], stored['ID'].astype(int)))
+    return pd.DataFrame({'ID': list(known.values()), 'name': list(known)})
+
+
+# markets with their IDs as last stored per (path, exchange name), reused while the exchange
+# reports its config as unchanged and diffed against a changed one, and the validators of the
+# config they were parsed from (see dexapi.getConditional)
+storedMarkets = {}
+configValidators = {}
+# columns of a market's config, a market is only written to marketConfig when one changes
+configCols = ['epochlen', 'lotsize', 'parcelSize', 'ratestep', 'baseConversionFactor', 'quoteConversionFactor']
+marketKey = ['name', 'base', 'quote']
+
+
+def cachedMarkets(path, exchangeName):
+    return storedMarkets.get((path, exchangeName))
+
+
+def cachedValidators(path, exchangeName):
+    # the config is only reported unchanged while its markets are stored in this process
+    if cachedMarkets(path, exchangeName) is None:
+        return {}
+    return configValidators.get((path, exchangeName), {})
+
+
+def readMarkets(path, exchangeID):
+    # the stored markets of an exchange with their config, read once per process
+    queryStr = f"""
+        select m.ID as marketID, m.name, m.base, m.quote, {', '.join(f'mc.{col}' for col in configCols)},
+        mc.LastUpdated
+        FROM markets m
+        left join marketConfig mc on mc.marketID = m.ID
+        where m.exchangeID = ?
+        """
+    stored = dbmgr.freeQuery(path, queryStr, (int(exchangeID),))
+    stored['LastUpdated'] = pd.to_datetime(stored['LastUpdated'], format='ISO8601')
+    return stored
+
+
+def storeMarkets(path, exchange, markets, validators=None):
+    # stores the markets and their configuration for an exchange, returns the markets with their
+    # IDs. an unchanged config (dexapi.NOT_MODIFIED) is not written again, the stored markets are
+    # returned instead. otherwise only new markets are inserted and only markets whose config
+    # changed are written to marketConfig. validators are those of the config the markets were
+    # parsed from, kept with the stored markets for the next conditional request
+    if markets is dexapi.NOT_MODIFIED:
+        markets = cachedMarkets(path, exchange['name'])
+        if markets is None:
+            raise Exception(f'no stored markets for {exchange["name"]}')
+        return markets.copy()
+    if markets is None:
+        raise Exception(f'markets is None for {exchange["name"]}')
+    # add the exchange ID and name
+    markets['exchangeID'] = exchange['ID']
+    markets['exchangeName'] = exchange['name']
+    stored = cachedMarkets(path, exchange['name'])
+    if stored is None:
+        stored = readMarkets(path, exchange['ID'])
+    stored = stored[marketKey + ['marketID', 'LastUpdated'] + configCols].astype({'marketID': float})
+    markets = pd.merge(markets.drop(columns=['marketID', 'LastUpdated'], errors='ignore'), stored,
+                       on=marketKey, how='left', suffixes=('', 'Stored'))
+    # new markets get their IDs from the insert
+    new = markets['marketID'].isna()
+    if new.any():
+        added = dbmgr.insertReturning(path, 'markets', markets.loc[new], marketCols, ['ID', 'name', 'base', 'quote'])
+        if len(added) < new.sum():
+            # stored since the markets were read, e.g. by another process
+            added = dbmgr.readTable(path, 'markets', ['ID', 'name', 'base', 'quote'],
+                                    filters={'exchangeID': int(exchange['ID'])})
+        ids = added.rename(columns={'ID': 'addedID'})
+        markets = pd.merge(markets, ids, on=marketKey, how='left')
+        markets['marketID'] = markets['marketID'].fillna(markets.pop('addedID'))
+    markets['marketID'] = markets['marketID'].astype(int)
+    # markets whose config is new or differs from the stored one
+    changed = new.copy()
+    for col in configCols:
+        changed |= markets[col].ne(markets.pop(f'{col}Stored'))
+    markets['LastUpdated'] = markets['LastUpdated'].where(~changed, datetime.datetime.now())
+    if changed.any():
+        # insert data into marketconfig, replace if necessary.
+        dbmgr.insertRecords(path, 'marketConfig', markets.loc[changed], marketConfigCols, replace=True)
+        logger.info(f'{int(changed.sum())} market configs stored for {exchange["name"]}')
+    key = (path, exchange['name'])
+    storedMarkets[key] = markets.copy()
+    configValidators[key] = validators or {}
+    dbmgr.onRollback(path, lambda: (storedMarkets.pop(key, None), configValidators.pop(key, None)))
+    return markets
+
+
+def storeBook(path, market, books, timeStamp=None, bookStorage='levels', keyframeInterval=60):
+    # stores an order book snapshot for a market. bookStorage selects the layout: levels writes
+    # every level to the books table, delta writes keyframes and deltas through bookstore and
+    # both does both. the liquidity statistics of the snapshot are stored in either layout
+    if books is None:
+        raise Exception(f'books is None for {market["exchangeName"]} {market["name"]}')
+    if timeStamp is None:
+        timeStamp = datetime.datetime.now()
+    if bookstats.enabled:
+        bookstats.storeStats(path, market, books, timeStamp)
+    if bookStorage in ('levels', 'both'):
+        # add the market ID and the timestamp
+        books['marketID'] = market['marketID']
+        books['TimeStamp'] = timeStamp
+        # insert data into order book table, ignore if duplicate
+        dbmgr.insertRecords(path, 'books', books, bookCols)
+    if bookStorage in ('delta', 'both'):
+        bookstore.writeSnapshot(path, market['marketID'], timeStamp, books, keyframeInterval)
+    logger.info(f'books complete for {market["exchangeName"]} {market["name"]}')
+
+
+# latest stored candle open time per database path and (marketID, period), loaded from the
+# database the first time a path is used and kept up to date by storeCandles. the marks of a
+# path are dropped, and loaded again, when a write that loaded or moved them is rolled back
+highWaterMarks = {}
+
+
+def getHighWaterMark(path, marketID, period):
+    marks = highWaterMarks.get(path)
+    if marks is None:
+        data = dbmgr.freeQuery(path, 'select marketID, period, max(timeOpen) as timeOpen '
+                                     'from candles group by marketID, period')
+        marks = {(int(row.marketID), row.period): pd.Timestamp(row.timeOpen) for row in data.itertuples()}
+        highWaterMarks[path] = marks
+        dbmgr.onRollback(path, lambda: highWaterMarks.pop(path, None))
+    return marks.get((int(marketID), period))
+
+
+def candleCount(path, marketID, period):
+    # number of candles to request so the response reaches back to the high water mark,
+    # None requests the full series
+    mark = getHighWaterMark(path, marketID, period)
+    if mark is None or period not in dexapi.binSizes:
+        return None
+    elapsed = pd.Timestamp.now(tz='UTC').tz_localize(None) - mark
+    return int(elapsed / pd.Timedelta(milliseconds=dexapi.binSizes[period])) + 2
+
+
+def storeCandles(path, market, candleData, period='24h', prices=None):
+    # stores the candles for a market starting at the high water mark, the last stored candle
+    # may still have been open when it was written so it is always written again. prices are
+    # the USD prices of rollups.candlePrices for the rollups
+    if candleData is None:
+        raise Exception(f'candles is None for {market["exchangeName"]} {market["name"]}')
+    mark = getHighWaterMark(path, market['marketID'], period)
+    if mark is not None:
+        candleData = candleData.loc[candleData['startStamps'] >= mark].copy()
+    if len(candleData) == 0:
+        logger.info(f'no new {period} candles for {market["exchangeName"]} {market["name"]}')
+        return
+    # add the market ID and period
+    candleData['marketID'] = market['marketID']
+    candleData['period'] = period
+    # insert data into candles table, update if the candle exists
+    dbmgr.insertRecords(path, 'candles', candleData, candleCols, replace=True)
+    highWaterMarks[path][(int(market['marketID']), period)] = candleData['startStamps'].max()
+    dbmgr.onRollback(path, lambda: highWaterMarks.pop(path, None))
+    logger.info(f'{len(candleData)} {period} candles complete for {market["exchangeName"]} {market["name"]}')
+    if period == rollups.sourcePeriod:
+        # recompute the volume rollups of the periods the new candles fall in
+        with metrics.timer('dexdb_rollup_seconds'):
+            rollups.updateRollups(path, [market['marketID']], candleData['startStamps'].min(), prices=prices)
+
+
+def bookSignature(books):
+    # hash of the levels of an order book, equal signatures mean the book didn't change
+    return int(pd.util.hash_pandas_object(books[['side', 'rate', 'qty']], index=False).sum())
+
+
+class HostLimiter:
+    # limits the number of in flight requests and the request rate for a single host,
+    # a requestRate of 0 disables the rate limit
+    def __init__(self, maxConcurrent, requestRate):
+        self.semaphore = asyncio.Semaphore(maxConcurrent)
+        self.interval = 1.0 / requestRate if requestRate > 0 else 0.0
+        self.nextSlot = 0.0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval:
+            # reserve the next free slot and wait for it, slots are handed out in order
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self.nextSlot)
+            self.nextSlot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        self.semaphore.release()
+
+
+class Collector:
+    # runs collection cycles for a list of exchanges, markets are fetched concurrently across
+    # exchanges and within an exchange subject to the per host limits
+    def __init__(self, dbPath, maxConcurrent=4, requestRate=2.0, candlePeriods=('24h',),
+                 bookStorage='levels', keyframeInterval=60, queueSize=None, groupSize=None, groupDelay=None):
+        self.dbPath = dbPath
+        self.candlePeriods = list(candlePeriods)
+        self.bookStorage = bookStorage
+        self.keyframeInterval = keyframeInterval
+        self.maxConcurrent = maxConcurrent
+        self.requestRate = requestRate
+        # writer settings, see dbmgr.GroupWriter
+        self.queueSize = queueSize
+        self.groupSize = groupSize
+        self.groupDelay = groupDelay
+        self.limiters = {}
+        self.writer = None
+
+    def limiter(self, host):
+        if host not in self.limiters:
+            self.limiters[host] = HostLimiter(self.maxConcurrent, self.requestRate)
+        return self.limiters[host]
+
+    async def fetch(self, host, func, *args):
+        # runs a blocking api call in a worker thread once the host limiter allows it
+        async with self.limiter(host):
+            return await asyncio.to_thread(func, *args)
+
+    async def submit(self, func, *args, wait=True):
+        # queues a database job for the writer and returns its result, or its future without
+        # waiting for the write when wait is False. a full queue holds the caller back until
+        # the writer catches up
+        future = self.writer.submit(func, *args, block=False)
+        if future is None:
+            future = await asyncio.to_thread(self.writer.submit, func, *args)
+        future = asyncio.wrap_future(future)
+        if wait:
+            return await future
+        # the writer has logged any error, don't warn again if nobody awaits the future
+        future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        return future
+
+    def start(self, hosts):
+        # starts the writer, enough threads for every host to use its full concurrency plus the
+        # writer
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=self.maxConcurrent * hosts + 1))
+        self.writer = dbmgr.GroupWriter(self.dbPath, self.queueSize, self.groupSize, self.groupDelay)
+
+    async def stop(self):
+        # returns once every queued write has been committed and stops the writer
+        await asyncio.to_thread(self.writer.close)
+
+    async def collectBook(self, market):
+        # fetches and queues an order book snapshot, returns its signature or None without a book
+        host = market['exchangeName']
+        books = await self.fetch(host, dexapi.getOrderBook, host, market['base'], market['quote'])
+        if books is None:
+            logger.error(f'no order book for {host} {market["name"]}')
+            return None
+        # the writer adds columns to the frame, the signature is taken before it is queued
+        signature = bookSignature(books)
+        # writes are queued, the market is done once its frames are handed to the writer
+        await self.submit(storeBook, self.dbPath, market, books, datetime.datetime.now(),
+                          self.bookStorage, self.keyframeInterval, wait=False)
+        return signature
+
+    async def collectCandles(self, market, period):
+        # fetches and queues the candles of a series, they only reach back to what is already stored
+        host = market['exchangeName']
+        count = candleCount(self.dbPath, market['marketID'], period)
+        candleData = await self.fetch(host, dexapi.getCandles, host, market['base'], market['quote'], period, count)
+        if candleData is None:
+            logger.error(f'no {period} candles for {host} {market["name"]}')
+            return None
+        # prices are requested before the job is queued, the writer never waits for the source
+        prices = None
+        if period == rollups.sourcePeriod and rollups.priceSource is not None:
+            prices = await asyncio.to_thread(rollups.candlePrices, self.dbPath, market, candleData)
+        await self.submit(storeCandles, self.dbPath, market, candleData, period, prices, wait=False)
+        return len(candleData)
+
+    async def collectMarket(self, market):
+        await asyncio.gather(self.collectBook(market),
+                             *[self.collectCandles(market, period) for period in self.candlePeriods])
+
+    async def updateMarkets(self, exchange):
+        # the config is only parsed and stored again when it changed since the last call
+        validators = cachedValidators(self.dbPath, exchange['name'])
+        fetched = await self.fetch(exchange['name'], dexapi.getMarketsConditional, exchange['name'], validators)
+        if fetched is None:
+            raise Exception(f'markets is None, exiting.')
+        markets, validators = fetched
+        # market IDs are needed before books and candles can be stored
+        if markets is dexapi.NOT_MODIFIED:
+            return storeMarkets(self.dbPath, exchange, markets)
+        return await self.submit(storeMarkets, self.dbPath, exchange, markets, validators)
+
+    async def collectExchange(self, exchange):
+        try:
+            markets = await self.updateMarkets(exchange)
+            await asyncio.gather(*[self.collectMarket(market) for idx, market in markets.iterrows()])
+            logger.info(f'complete for {exchange["name"]}')
+            return markets
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=} for {exchange["name"]}')
+            return None
+
+    async def collect(self, exchangeList):
+        # runs a full collection cycle and returns once every write has been committed
+        self.start(len(exchangeList))
+        try:
+            exchanges = await self.submit(storeExchanges, self.dbPath, exchangeList)
+            exchanges = exchanges.loc[exchanges['name'].isin(exchangeList)]
+            return await asyncio.gather(*[self.collectExchange(exchange) for idx, exchange in exchanges.iterrows()])
+        finally:
+            await self.stop()
+
+
+def runCycle(dbPath, exchangeList, **options):
+    # synchronous entry point for a single concurrent collection cycle, options are passed to
+    # the Collector
+    return asyncio.run(Collector(dbPath, **options).collect(exchangeList))
@@ -0,0 +1,315 @@
+# this module runs the collector as a long running daemon. every exchange config, order book
+# and candle series is a job with its own interval on a single scheduler, the markets, validators
+# and high water marks stay in memory between runs. order book intervals adapt to the market:
+# a book that changed is polled again at the base interval, an unchanged one backs off up to
+# the maximum. start times are spread over the interval and every run is jittered so hundreds
+# of markets don't hit an exchange at the same moment. with bookFeed the order books follow the
+# websocket feed of every exchange instead of being polled, see bookfeed.py.
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import signal
+import archive
+import bookfeed
+import collector
+import dbmgr
+import dexapi
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    # a scheduled call of func, func returns True when the job saw activity (its interval is
+    # reset), False when it was idle (its interval backs off) and None to keep the interval.
+    # with retryInterval a failing job is retried after retryInterval, growing up to interval,
+    # instead of backing off from its interval
+    def __init__(self, name, func, interval, maxInterval=None, retryInterval=None):
+        self.name = name
+        self.func = func
+        self.baseInterval = interval
+        self.interval = interval
+        self.maxInterval = interval if maxInterval is None else max(interval, maxInterval)
+        self.retryInterval = retryInterval
+        self.failures = 0
+        self.nextRun = 0.0
+        self.running = False
+        self.runs = 0
+        self.errors = 0
+
+
+class Daemon:
+    # intervals are in seconds, jitter is the fraction an interval varies by and backoffFactor
+    # the growth of the interval of idle books and failing jobs. archiveOptions are the
+    # archive.archiveAll arguments after the database path, None disables the archive job.
+    # metricsPath is the json file metrics are dumped to every metricsInterval seconds. bookFeed
+    # replaces the order book requests with a websocket feed per exchange whose changed books are
+    # stored every feedPersistInterval seconds. other options are passed to the Collector
+    def __init__(self, dbPath, exchangeList, marketInterval=3600, bookInterval=60, bookMaxInterval=600,
+                 candleMaxInterval=3600, backoffFactor=2.0, jitter=0.1, shutdownTimeout=30,
+                 archiveOptions=None, archiveInterval=86400, metricsPath=None, metricsInterval=60,
+                 bookFeed=False, feedPersistInterval=60, seed=None, **options):
+        self.dbPath = dbPath
+        self.exchangeList = list(exchangeList)
+        self.marketInterval = marketInterval
+        self.bookInterval = bookInterval
+        self.bookMaxInterval = bookMaxInterval
+        self.candleMaxInterval = candleMaxInterval
+        self.backoffFactor = backoffFactor
+        self.jitter = jitter
+        self.shutdownTimeout = shutdownTimeout
+        self.archiveOptions = archiveOptions
+        self.archiveInterval = archiveInterval
+        self.metricsPath = metricsPath
+        self.metricsInterval = metricsInterval
+        self.bookFeed = bookFeed
+        self.feedPersistInterval = feedPersistInterval
+        self.random = random.Random(seed)
+        self.collector = collector.Collector(dbPath, **options)
+        self.jobs = {}
+        self.queue = []
+        self.counter = itertools.count()
+        # markets and last order book signature per (exchange name, market name)
+        self.markets = {}
+        self.signatures = {}
+        # order book feeds per exchange name
+        self.feeds = {}
+        self.tasks = set()
+        self.wakeup = None
+        self.stopping = None
+
+    def jittered(self, interval):
+        return interval * (1 + self.random.uniform(-self.jitter, self.jitter))
+
+    def schedule(self, job, delay):
+        job.nextRun = asyncio.get_running_loop().time() + delay
+        heapq.heappush(self.queue, (job.nextRun, next(self.counter), job))
+        self.wakeup.set()
+
+    def addJob(self, job, delay=None):
+        # new jobs start at a random point of their first interval unless a delay is given
+        if job.name in self.jobs:
+            return self.jobs[job.name]
+        self.jobs[job.name] = job
+        self.schedule(job, self.random.uniform(0, job.interval) if delay is None else delay)
+        return job
+
+    def removeJob(self, name):
+        # its queue entry is skipped when it comes up
+        self.jobs.pop(name, None)
+
+    def adapt(self, job, active):
+        if active:
+            job.interval = job.baseInterval
+        elif active is not None:
+            job.interval = min(job.interval * self.backoffFactor, job.maxInterval)
+
+    def retry(self, job):
+        # failing jobs back off like idle ones unless they have a retry interval
+        if job.retryInterval is None:
+            self.adapt(job, False)
+        else:
+            delay = job.retryInterval * self.backoffFactor ** (job.failures - 1)
+            job.interval = min(delay, job.baseInterval)
+
+    async def runJob(self, job):
+        try:
+            active = await job.func()
+            if job.failures and job.retryInterval is not None:
+                # a recovered job is back on its interval
+                job.interval = job.baseInterval
+            job.failures = 0
+            self.adapt(job, active)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            job.errors += 1
+            job.failures += 1
+            self.retry(job)
+            logger.error(f'{err=}, {type(err)=} in {job.name}')
+        finally:
+            job.runs += 1
+            job.running = False
+        if self.jobs.get(job.name) is job and not self.stopping.is_set():
+            self.schedule(job, self.jittered(job.interval))
+
+    def launch(self, job):
+        job.running = True
+        task = asyncio.create_task(self.runJob(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def candleInterval(self, period):
+        # a series is polled once per candle, capped so the open candle stays recent
+        return min(dexapi.binSizes[period] / 1000, self.candleMaxInterval)
+
+    def marketJob(self, exchange):
+        async def run():
+            markets = await self.collector.updateMarkets(exchange)
+            if self.bookFeed:
+                await self.syncFeed(exchange['name'], markets)
+            self.syncMarkets(exchange['name'], markets)
+            return None
+        # nothing else of the exchange is collected until the config was read, a failure is
+        # retried soon after instead of a market interval later
+        return Job(f'markets {exchange["name"]}', run, self.marketInterval,
+                   retryInterval=min(self.bookInterval, self.marketInterval))
+
+    def bookJob(self, key):
+        async def run():
+            signature = await self.collector.collectBook(self.markets[key])
+            if signature is None:
+                raise Exception(f'no order book for {key[0]} {key[1]}')
+            active = signature != self.signatures.get(key)
+            self.signatures[key] = signature
+            return active
+        return Job(f'books {key[0]} {key[1]}', run, self.bookInterval, self.bookMaxInterval)
+
+    def candleJob(self, key, period):
+        async def run():
+            if await self.collector.collectCandles(self.markets[key], period) is None:
+                raise Exception(f'no {period} candles for {key[0]} {key[1]}')
+            return None
+        return Job(f'candles {key[0]} {key[1]} {period}', run, self.candleInterval(period))
+
+    def archiveJob(self):
+        def write(func, *args):
+            return self.collector.writer.submit(func, *args).result()
+
+        async def run():
+            # the export only reads and runs on a worker thread, the writer only records the
+            # archived days and prunes so other writes aren't held up by the export
+            await asyncio.to_thread(archive.archiveAll, self.dbPath, *self.archiveOptions, write=write)
+            return None
+        return Job('archive', run, self.archiveInterval)
+
+    async def persistFeed(self, feed):
+        # queues the books that changed since they were last stored
+        timeStamp = datetime.datetime.now()
+        changed = feed.changedBooks()
+        for market, books in changed:
+            await self.collector.submit(collector.storeBook, self.dbPath, market, books, timeStamp,
+                                        self.collector.bookStorage, self.collector.keyframeInterval, wait=False)
+        return changed
+
+    def feedJob(self, exchangeName):
+        async def run():
+            await self.persistFeed(self.feeds[exchangeName])
+            return None
+        return Job(f'feed {exchangeName}', run, self.feedPersistInterval)
+
+    def metricsJob(self):
+        async def run():
+            metrics.dump(self.metricsPath)
+            return None
+        return Job('metrics', run, self.metricsInterval)
+
+    async def syncFeed(self, exchangeName, markets):
+        # starts the feed of the exchange and subscribes its markets. subscribing can request the
+        # asset ids of the config, it runs on a worker thread so the scheduler isn't held up
+        if exchangeName not in self.feeds:
+            self.feeds[exchangeName] = bookfeed.BookFeed(exchangeName).start()
+            self.addJob(self.feedJob(exchangeName), self.feedPersistInterval)
+        await asyncio.to_thread(self.feeds[exchangeName].update, markets)
+
+    def syncMarkets(self, exchangeName, markets):
+        # adds the jobs of new markets and removes those of markets the exchange no longer lists
+        keys = set()
+        for idx, market in markets.iterrows():
+            key = (exchangeName, market['name'])
+            keys.add(key)
+            self.markets[key] = market
+            if not self.bookFeed:
+                self.addJob(self.bookJob(key))
+            for period in self.collector.candlePeriods:
+                self.addJob(self.candleJob(key, period))
+        for key in [key for key in self.markets if key[0] == exchangeName and key not in keys]:
+            logger.info(f'{key[0]} {key[1]} is no longer listed')
+            del self.markets[key]
+            self.signatures.pop(key, None)
+            self.removeJob(f'books {key[0]} {key[1]}')
+            for period in self.collector.candlePeriods:
+                self.removeJob(f'candles {key[0]} {key[1]} {period}')
+
+    def stop(self):
+        # requests a graceful shutdown, running jobs finish and queued writes are committed
+        if self.stopping is not None and not self.stopping.is_set():
+            logger.info('stopping collector daemon')
+            self.stopping.set()
+            self.wakeup.set()
+
+    def handleSignals(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # not on the main thread or not supported by the platform
+                pass
+
+    async def run(self, duration=None):
+        # runs until stop is called, a signal arrives or duration seconds have passed
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.handleSignals()
+        if duration is not None:
+            loop.call_later(duration, self.stop)
+        self.collector.start(len(self.exchangeList))
+        try:
+            exchanges = await self.collector.submit(collector.storeExchanges, self.dbPath, self.exchangeList)
+            exchanges = exchanges.loc[exchanges['name'].isin(self.exchangeList)]
+            for idx, exchange in exchanges.iterrows():
+                # the config is needed before anything else of the exchange can be collected
+                self.addJob(self.marketJob(exchange), 0)
+            if self.archiveOptions is not None:
+                self.addJob(self.archiveJob())
+            if self.metricsPath:
+                self.addJob(self.metricsJob(), self.metricsInterval)
+            logger.info(f'collector daemon started for {len(exchanges)} exchanges')
+            while not self.stopping.is_set():
+                now = loop.time()
+                while self.queue and self.queue[0][0] <= now:
+                    nextRun, number, job = heapq.heappop(self.queue)
+                    # entries of removed or rescheduled jobs are stale
+                    if self.jobs.get(job.name) is job and job.nextRun == nextRun and not job.running:
+                        self.launch(job)
+                self.wakeup.clear()
+                timeout = self.queue[0][0] - now if self.queue else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        # lets running jobs finish within the shutdown timeout and commits the queued writes
+        self.stopping.set()
+        if self.tasks:
+            done, pending = await asyncio.wait(set(self.tasks), timeout=self.shutdownTimeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f'{len(pending)} jobs cancelled at shutdown')
+                await asyncio.wait(pending)
+        # the feeds are stopped and their books stored a last time
+        for feed in self.feeds.values():
+            await asyncio.to_thread(feed.stop)
+            await self.persistFeed(feed)
+        await self.collector.stop()
+        dbmgr.maintain(self.dbPath, force=True)
+        dexapi.closeSessions()
+        if self.metricsPath:
+            metrics.dump(self.metricsPath)
+        logger.info('collector daemon stopped')
+
+
+def runDaemon(dbPath, exchangeList, duration=None, **options):
+    # synchronous entry point, options are passed to the Daemon
+    daemon = Daemon(dbPath, exchangeList, **options)
+    asyncio.run(daemon.run(duration))
+    return daemon
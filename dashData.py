@@ -1,19 +1,34 @@
+import numpy as np
 import pandas as pd
 import traceback
 import cm
+import rollups
 import dbmgr
+import querycache
 import configparser
 import logging
 
 logger = logging.getLogger(__name__)
-# read configuration
-config = configparser.ConfigParser()
-config.read('config.conf')
-# parse required configuration parameters
-dbPath = config['dataHandling']['dbPath']
+# the database read by the __main__ report, set by loadConfig
+dbPath = None
+
+
+def loadConfig(path='config.conf'):
+    # reads the database path and the query cache settings from the config file, nothing is read
+    # at import
+    global dbPath
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise Exception(f'config file {path} not found')
+    dbPath = config['dataHandling']['dbPath']
+    # cached dashboard reads, see querycache.py
+    querycache.enabled = config.getboolean('queryCache', 'enabled', fallback=True)
+    querycache.maxBytes = int(config.getfloat('queryCache', 'maxMB', fallback=256) * 1024 * 1024)
+    querycache.persistPath = config.get('queryCache', 'persistPath', fallback='') or None
+    return dbPath
 
 # this function gets all the required data from the specified database
-def getCandleData(path):
+def getCandleData(path, period='24h'):
     try:
         candlesQry = """
         select e.name as exchange, 
@@ -26,79 +41,182 @@ def getCandleData(path):
         c.low, 
         c.open, 
         c.close, 
-        m.base as baseAsset  
+        m.base as baseAsset, 
+        m.quote as quoteAsset  
         FROM candles c 
         left join markets m on c.marketID = m.ID 
         left join marketConfig mc on m.ID = mc.marketID 
         left join exchanges e on e.ID = m.exchangeID 
+        where c.period = ? 
         """
-        output = dbmgr.freeQuery(path,candlesQry)
-        output['timeOpen'] = pd.to_datetime(output['timeOpen'], utc=True, format='%Y-%m-%d %H:%M:%S')
-        output['timeClose'] = pd.to_datetime(output['timeClose'], utc=True, format='%Y-%m-%d %H:%M:%S')
+        timeFormat = {'utc': True, 'format': '%Y-%m-%d %H:%M:%S'}
+        return querycache.query(path, candlesQry, (period,), {'timeOpen': timeFormat, 'timeClose': timeFormat})
+    except Exception as error:
+        logger.error(f'{error} ')
+        return None
+
+
+# this function builds the order book levels query, optionally limited to a time window (start,
+# end) and to a list of market IDs
+def bookQuery(start=None, end=None, markets=None):
+    booksQry = """
+    select e.name as exchange,
+    m.name as market,
+    b.TimeStamp,
+    b.Side,
+    b.Rate,
+    b.Qty,
+    m.base as baseAsset,
+    m.quote as quoteAsset
+    FROM books b
+    left join markets m on b.marketID = m.ID
+    left join exchanges e on e.ID = m.exchangeID
+    """
+    filters = {}
+    if start is not None or end is not None:
+        filters['b.TimeStamp'] = (start, end)
+    if markets is not None:
+        filters['b.marketID'] = list(markets)
+    whereStr, params = dbmgr.filterClause(filters)
+    return booksQry + whereStr, params
+
+
+# this function yields the order book levels in chunks of chunkSize rows, see bookQuery for the
+# filters, so large reads hold one chunk at a time
+def getBookChunks(path, start=None, end=None, markets=None, chunkSize=None):
+    queryStr, params = bookQuery(start, end, markets)
+    for chunk in dbmgr.iterQuery(path, queryStr, params, chunkSize):
+        chunk['TimeStamp'] = pd.to_datetime(chunk['TimeStamp'], utc=True, format='ISO8601')
+        yield chunk
+
+
+def getBookData(path, start=None, end=None, markets=None):
+    try:
+        queryStr, params = bookQuery(start, end, markets)
+        output = querycache.query(path, queryStr, params, {'TimeStamp': {'utc': True, 'format': 'ISO8601'}})
+        if len(output) == 0:
+            return pd.DataFrame(columns=['exchange', 'market', 'TimeStamp', 'side', 'rate', 'qty',
+                                         'baseAsset', 'quoteAsset'])
         return output
     except Exception as error:
         logger.error(f'{error} ')
         return None
 
 
-def getBookData(path):
+# this function averages the order book depth per market and side over periods of freq, the
+# books are read in chunks and only the running totals are kept so memory stays bounded
+def getBookDepth(path, freq='1h', start=None, end=None, markets=None, chunkSize=None):
     try:
-        candlesQry = """
-        select e.name as exchange, 
-        m.name as market, 
-        b.TimeStamp, 
-        b.Side, 
-        b.Rate, 
-        b.Qty, 
-        m.base as baseAsset, 
-        m.quote as quoteAsset 
-        FROM books b
-        left join markets m on b.marketID = m.ID 
-        left join exchanges e on m.exchangeID = m.exchangeID 
-        """
-        output = dbmgr.freeQuery(path,candlesQry)
-        output['TimeStamp'] = pd.to_datetime(output['TimeStamp'], utc=True, format='%Y-%m-%d %H:%M:%S')
+        totals = None
+        snapshots = []
+        for chunk in getBookChunks(path, start, end, markets, chunkSize):
+            chunk['period'] = chunk['TimeStamp'].dt.floor(freq)
+            qty = chunk.groupby(['period', 'market', 'side'])['qty'].sum()
+            totals = qty if totals is None else totals.add(qty, fill_value=0)
+            snapshots.append(chunk[['period', 'market', 'TimeStamp']].drop_duplicates())
+        if totals is None:
+            return pd.DataFrame(columns=['period', 'market', 'side', 'qty', 'snapshots'])
+        # a snapshot can span two chunks, count the distinct ones
+        snapshots = pd.concat(snapshots).drop_duplicates()
+        counts = snapshots.groupby(['period', 'market']).size().rename('snapshots')
+        output = totals.reset_index().merge(counts.reset_index(), on=['period', 'market'])
+        output['qty'] = output['qty'] / output['snapshots']
         return output
     except Exception as error:
         logger.error(f'{error} ')
         return None
 
 
-def convertValueUSD(data,dateCol,assetCol,valueCol):
+# this function reads the liquidity statistics stored per order book snapshot (see bookstats.py),
+# optionally limited to a time window (start, end) and to a list of market IDs. it reads a row
+# per snapshot where getBookData reads every level
+def getLiquidityData(path, start=None, end=None, markets=None):
+    try:
+        statsQry = """
+        select e.name as exchange,
+        m.name as market,
+        s.*,
+        m.base as baseAsset,
+        m.quote as quoteAsset
+        FROM bookStats s
+        left join markets m on s.marketID = m.ID
+        left join exchanges e on e.ID = m.exchangeID
+        """
+        filters = {}
+        if start is not None or end is not None:
+            filters['s.TimeStamp'] = (start, end)
+        if markets is not None:
+            filters['s.marketID'] = list(markets)
+        whereStr, params = dbmgr.filterClause(filters)
+        return querycache.query(path, statsQry + whereStr + ' order by s.marketID, s.TimeStamp', params,
+                                {'TimeStamp': {'utc': True, 'format': 'ISO8601'}})
+    except Exception as error:
+        logger.error(f'{error} ')
+        return None
+
+
+# this function reads the pre-aggregated volumes, granularity is 1d, 1w or 1mo and level market
+# or exchange. see rollups.getVolumes for the filters
+def getVolumeData(path, granularity='1d', level='market', **filters):
+    try:
+        return rollups.getVolumes(path, granularity, level, **filters)
+    except Exception as error:
+        logger.error(f'{error} ')
+        return None
+
+
+def convertValueUSD(data,dateCol,assetCol,valueCol=None,path=None,source=None):
     # this function accepts a dataframe as an input,
-    # gets teh cm PriceUSD data for all assets listed in the assetCol column
-    # and converts the valueCol to USD, returning the data
+    # gets teh cm PriceUSD data for all assets listed in the asset columns
+    # and converts the value columns to USD, returning the data. assetCol is either one asset
+    # column for valueCol, a column or a list of columns, or a dict of value column to the asset
+    # column it is counted in (e.g. {'baseVol': 'baseAsset', 'quoteVol': 'quoteAsset'}). each
+    # result is added as <valueCol>USD. prices are cached in the metrics table of the database at
+    # path, the configured dbPath by default
+    if path is None:
+        path = dbPath
     try:
-        # get list of assets
-        assetList = list(data[assetCol].apply(lambda x: x.split(".")[0]).unique())
+        if isinstance(assetCol, dict):
+            assetCols = dict(assetCol)
+        else:
+            valueCols = [valueCol] if isinstance(valueCol, str) else list(valueCol)
+            assetCols = {col: assetCol for col in valueCols}
+        # asset symbols without their network suffix (e.g. usdc.eth), split once per distinct
+        # value over the union of the asset columns
+        columns = list(dict.fromkeys(assetCols.values()))
+        codes, uniques = pd.factorize(pd.concat([data[col] for col in columns], ignore_index=True))
+        symbols = pd.Index(uniques).str.split('.').str[0]
+        allAssets = np.append(symbols.to_numpy(dtype=object), None)[codes]
+        assetList = list(symbols.unique())
         # get start and end timestamps from the df
-        startDate = pd.to_datetime(data[dateCol].min(),  utc=True, format='%Y-%m-%d %H:%M:%S')
-        endDate = pd.to_datetime(data[dateCol].max(),  utc=True, format='%Y-%m-%d %H:%M:%S')
+        dates = pd.to_datetime(data[dateCol], utc=True, format='%Y-%m-%d %H:%M:%S')
+        startDate = dates.min()
+        endDate = dates.max()
         # get coinemtrics data for the specified time range and assets
-        PriceUSD = cm.getMetric(assetList,'PriceUSD',startDate,endDate)
-        # merge the price data in and into a temporary df
-        temp = data[[dateCol,assetCol,valueCol]].sort_values(by=[dateCol])
-        temp = pd.merge_asof(temp,PriceUSD,left_on=dateCol,right_on='date')
-        # calculate the value USD
-        colUSD = (valueCol+'USD') # new column name
-        temp[colUSD] = temp.apply(lambda row: row[valueCol] * row[row[assetCol].split(".")[0]],axis=1)
-        # clean up and return output
-        output = temp[[dateCol,colUSD]]
-        # merge back on original data
-        output = pd.merge(data,output,how='left',left_on=dateCol, right_on=dateCol)
+        PriceUSD = cm.getMetric(assetList,'PriceUSD',startDate,endDate,path,source)
+        if PriceUSD is None:
+            raise Exception(f'no PriceUSD data for {assetList}')
+        # one lookup per asset column
+        dates = dates.reset_index(drop=True)
+        prices = {}
+        for i, col in enumerate(columns):
+            assets = allAssets[i * len(data):(i + 1) * len(data)]
+            prices[col] = cm.lookupPrices(dates, assets, PriceUSD)
+        # calculate the value USD, rows keep their order and count
+        output = data.copy()
+        for col, priceCol in assetCols.items():
+            output[col + 'USD'] = output[col].to_numpy(dtype=float) * prices[priceCol]
         return output
     except Exception as error:
         print(traceback.format_exc())
         logger.error(f'{error} ')
         return None
 
-test = getCandleData(dbPath)
-pd.set_option('display.max_rows', None)
-pd.set_option('display.max_columns', None)
-print(test[['timeOpen','market','baseVol']].sort_values(by='timeOpen'))
-data = convertValueUSD(test,'timeOpen','baseAsset','baseVol')
-print(data[['timeOpen','market','baseVol','baseVolUSD']].sort_values(by='timeOpen'))
-test = data[['timeOpen','market','baseVolUSD',]]
-output = test.set_index('timeOpen').groupby([pd.Grouper(freq='1D'), 'market']).sum()
 
-print(output)
+if __name__ == '__main__':
+    loadConfig()
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.max_columns', None)
+    # daily volume per market over the last 90 days from the rollup tables
+    output = getVolumeData(dbPath, '1d', start=pd.Timestamp.now() - pd.Timedelta(days=90))
+    print(output[['periodStart','market','baseVolume','baseVolumeUSD']])
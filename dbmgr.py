@@ -1,219 +1,847 @@
-# this routine handles data collection, it uses sqlite3 to store the data into a file
-import sqlite3, os
-import logging
-import pandas as pd
-logger = logging.getLogger(__name__)
-
-# logic to check the paths are valid, etc.
-def pathCheck(path):
-    try:
-        # verify isf file already exists
-        if os.path.isfile(path):
-            logger.debug(f'file already exists {path}')
-            return
-        else:
-            # verify if folder does not exist
-            folderPath = os.path.dirname(path)
-            if not os.path.isdir(folderPath):
-                # make the folder
-                os.makedirs(folderPath)
-                logger.info(f' created folder {folderPath}')
-            return
-    except os.error as error:
-        logger.error(f'{error} for {path} ')
-        return None
-
-
-# this function deals with connecting to the database, will return none if the connection failed
-def dbConnect(path):
-    try:
-        # ensure the path is valid
-        pathCheck(path)
-        # connect to the database file
-        con = sqlite3.connect(path)
-        # get cursor
-        cur = con.cursor()
-        logger.debug(f'connected to {path} ')
-        return con, cur
-    except sqlite3.Error as error:
-        logger.error(f'{error} for {path} ')
-        return None, None
-
-
-# this function creates the specified table with the specified columns-
-def createTable(cur,tableName,listCols):
-    try:
-        # verify if the table already exists
-        results = cur.execute(f'SELECT name FROM sqlite_master WHERE type=\'table\' AND name=\'{tableName}\'')
-        if results.fetchone() is not None:
-            logger.debug(f'verified table {tableName} exists.')
-            return True
-        else:
-            # declare the empty column string
-            colStr = ''
-            # add all columns
-            for item in listCols:
-                colStr = colStr + item + ', '
-            # build the command string
-            commandStr = 'CREATE TABLE IF NOT EXISTS ' + tableName + ' ( ' + colStr[:-2] + ' ) '
-            # execute
-            cur.execute(commandStr)
-            logger.info(f'table {tableName} created.')
-            return True
-    except sqlite3.Error as error:
-        logger.error(f'{error}')
-        return False
-
-
-# this function connects to a database, and sets up the required table structure if it doesn't exist
-def initalizeDB(path):
-    try:
-        logger.info(f'starting database initialization {path}')
-        # connect to database
-        conn, cur = dbConnect(path)
-        # create exchanges table
-        result = createTable(cur, 'exchanges', ['ID integer primary key',
-                                                'name varchar(30) not null',
-                                                'unique (name)'])
-        if not result:
-            raise Exception("exchanges table can't be created")
-        # create markets table
-        result = createTable(cur, 'markets', ['ID integer primary key',
-                                              'exchangeID integer not null',
-                                              'name varchar(30) not null',
-                                              'base varchar(30) not null',
-                                              'quote varchar(30) not null',
-                                              'unique (exchangeID, name, base, quote)'
-                                              ])
-        if not result:
-            raise Exception("markets table can't be created")
-        # create market config table
-        result = createTable(cur, 'marketConfig', ['marketID int not null',
-                                                   'epochlen int not null',
-                                                   'lotsize bigint not null',
-                                                   'parcelSize bigint not null',
-                                                   'ratestep int not null',
-                                                   'baseConversionFactor bigint not null',
-                                                   'quoteConversionFactor bigint not null',
-                                                   'LastUpdated timestamp DATETIME not null',
-                                                   'unique (marketID)'
-                                                   ])
-        if not result:
-            raise Exception("markets table can't be created")
-        # create books table
-        result = createTable(cur, 'books', ['marketID integer not null',
-                                            'TimeStamp datetime not null',
-                                            'side integer not null',
-                                            'rate bigint not null',
-                                            'qty bigint not null'])
-        if not result:
-            raise Exception("books table can't be created")
-        result = createTable(cur, 'candles', ['marketID integer not null',
-                                              'timeOpen datetime not null',
-                                              'timeClose datetime not null',
-                                              'baseVolume bigint not null',
-                                              'quoteVolume bigint not null',
-                                              'high bigint not null',
-                                              'low bigint not null',
-                                              'open bigint not null',
-                                              'close bigint not null',
-                                              'unique (marketID, timeOpen)'])
-        if not result:
-            raise Exception("candles table can't be created")
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as err:
-        logger.error(f'{err=}, {type(err)=}')
-        conn.close()
-        raise
-
-
-def insertRecords(path,tableName,inputData, colDict, replace=False):
-    try:
-        # connect to database
-        conn, cur = dbConnect(path)
-        # create a filtered copy of input data only with the specified columns and renaming them as required
-        # colDict is a dictionary where the keys are the input data columns and the values the
-        filteredData = pd.DataFrame()
-        filteredColsStr = ''
-
-        for inputCol in colDict:
-            outputCol = colDict[inputCol]
-            filteredData[outputCol] = inputData[inputCol]
-            # this string is used for the column list
-            filteredColsStr += outputCol + ' '
-        # remove the last comma and space
-        filteredColsStr = filteredColsStr[:-1].replace(' ', ', ')
-        # create a temp table for inserting results
-        filteredData.to_sql('tempTable', conn, if_exists='replace',index=False)
-        # handle the replace case
-        if replace is False:
-            cmdStr = 'INSERT OR IGNORE'
-        else:
-            cmdStr = 'INSERT OR REPLACE'
-
-        # build string
-        queryStr = f'{cmdStr} INTO {tableName} ( {filteredColsStr} ) SELECT * FROM tempTable as tempTable'
-        # execute
-        result = conn.execute(queryStr)
-        if result is None:
-            raise Exception(f'data could not be updated for {tableName}')
-        # drop temp table
-        conn.execute('DROP TABLE tempTable')
-        # commit and close
-        conn.commit()
-        conn.close()
-    except Exception as err:
-        logger.error(f'{err=}, {type(err)=}')
-        conn.close()
-        raise
-
-
-def readTable(path,tableName,listCols=None,whereClause=None):
-    try:
-        # connect to database
-        conn, cur = dbConnect(path)
-        # create a default column list if it isn't provided
-        if listCols is None:
-            listColStr = '*'
-        else:
-            # if it is provided, parse the list into the correct format
-            listColStr = ''
-            for col in listCols:
-                listColStr += col + ' '
-            listColStr = listColStr[:-1].replace(' ', ', ')
-        # add a clause for filtering data at the query level
-        if whereClause is None:
-            whereStr = ''
-        else:
-            whereStr = f'WHERE {whereClause}'
-        # build the sql query
-        queryStr = f'Select {listColStr} from {tableName} {whereStr}'
-        # execute
-        data = pd.read_sql_query(queryStr, conn)
-        # close
-        conn.close()
-        # return data
-        return data
-    except Exception as err:
-        logger.error(f'{err=}, {type(err)=}')
-        conn.close()
-        raise
-
-
-# this function is an open/free query into the specified database
-def freeQuery(path,queryStr):
-    try:
-        # connect to database
-        conn, cur = dbConnect(path)
-        # create a default column list if it isn't provided
-        # execute
-        data = pd.read_sql_query(queryStr, conn)
-        # close
-        conn.close()
-        # return data
-        return data
-    except Exception as err:
-        logger.error(f'{err=}, {type(err)=}')
-        raise
\ No newline at end of file
+# this routine handles data collection, it uses sqlite3 to store the data into a file
+import sqlite3, os
+import atexit
+import concurrent.futures
+import contextlib
+import logging
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+import metrics
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+logger = logging.getLogger(__name__)
+
+# storage profiles, the pragmas applied to every connection when it is opened. default leaves
+# sqlite at its own settings, wal lets readers work while the collector writes and only syncs
+# at checkpoints, bulk gives up durability on power loss for speed when backfilling
+storageProfiles = {'default': {},
+                   'wal': {'journal_mode': 'WAL',
+                           'synchronous': 'NORMAL',
+                           'cache_size': -65536,
+                           'mmap_size': 268435456,
+                           'temp_store': 'MEMORY'},
+                   'bulk': {'journal_mode': 'WAL',
+                            'synchronous': 'OFF',
+                            'cache_size': -262144,
+                            'mmap_size': 1073741824,
+                            'temp_store': 'MEMORY'}}
+# pragmas that can be overridden on top of a profile
+pragmaNames = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store']
+# storage settings per database path, see setStorageProfile
+storageSettings = {}
+# GroupWriter defaults: queued jobs before submitters block, jobs per commit and the seconds a
+# commit waits for more jobs. without a delay a commit takes the jobs queued while the previous
+# one ran
+writerQueueSize = 256
+writerGroupSize = 64
+writerGroupDelay = 0
+
+
+# this function selects the storage profile for a database, overrides is a dictionary of pragma
+# values replacing the profile ones and maintenanceInterval the seconds between wal checkpoints
+def setStorageProfile(path, profile='default', overrides=None, maintenanceInterval=None):
+    if profile not in storageProfiles:
+        raise Exception(f'unknown storage profile {profile}')
+    pragmas = dict(storageProfiles[profile])
+    if overrides is not None:
+        pragmas.update(overrides)
+    storageSettings[path] = {'pragmas': pragmas, 'maintenanceInterval': maintenanceInterval}
+    # an open session keeps its connections, close it so the next one picks up the profile
+    with sessionsLock:
+        session = sessions.pop(path, None)
+    if session is not None:
+        session.close()
+    logger.info(f'storage profile {profile} {pragmas} for {path}')
+
+
+# this function applies the configured pragmas to a new connection
+def applyPragmas(conn, path):
+    settings = storageSettings.get(path)
+    if settings is None:
+        return
+    for name, value in settings['pragmas'].items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+# logic to check the paths are valid, etc.
+def pathCheck(path):
+    try:
+        # verify isf file already exists
+        if os.path.isfile(path):
+            logger.debug(f'file already exists {path}')
+            return
+        else:
+            # verify if folder does not exist
+            folderPath = os.path.dirname(path)
+            if not os.path.isdir(folderPath):
+                # make the folder
+                os.makedirs(folderPath)
+                logger.info(f' created folder {folderPath}')
+            return
+    except os.error as error:
+        logger.error(f'{error} for {path} ')
+        return None
+
+
+# this function deals with connecting to the database, will return none if the connection failed
+def dbConnect(path):
+    try:
+        # ensure the path is valid
+        pathCheck(path)
+        # connect to the database file
+        con = sqlite3.connect(path)
+        applyPragmas(con, path)
+        # get cursor
+        cur = con.cursor()
+        logger.debug(f'connected to {path} ')
+        return con, cur
+    except sqlite3.Error as error:
+        logger.error(f'{error} for {path} ')
+        return None, None
+
+
+# this function creates the specified table with the specified columns-
+def createTable(cur,tableName,listCols):
+    try:
+        # verify if the table already exists
+        results = cur.execute(f'SELECT name FROM sqlite_master WHERE type=\'table\' AND name=\'{tableName}\'')
+        if results.fetchone() is not None:
+            logger.debug(f'verified table {tableName} exists.')
+            return True
+        else:
+            # declare the empty column string
+            colStr = ''
+            # add all columns
+            for item in listCols:
+                colStr = colStr + item + ', '
+            # build the command string
+            commandStr = 'CREATE TABLE IF NOT EXISTS ' + tableName + ' ( ' + colStr[:-2] + ' ) '
+            # execute
+            cur.execute(commandStr)
+            logger.info(f'table {tableName} created.')
+            return True
+    except sqlite3.Error as error:
+        logger.error(f'{error}')
+        return False
+
+
+# schema migrations, these run in order on top of the tables created by initalizeDB and each one
+# is applied exactly once. the database user_version holds the number of migrations applied, so
+# new and existing databases end up with the same schema.
+def migrateBooksKey(conn):
+    # rebuild books clustered on a (marketID, TimeStamp, side, rate) primary key, this
+    # dedupes repeated snapshots and serves per market time window reads without a table scan
+    conn.execute('CREATE TABLE booksNew ( marketID integer not null, '
+                 'TimeStamp datetime not null, '
+                 'side integer not null, '
+                 'rate bigint not null, '
+                 'qty bigint not null, '
+                 'primary key (marketID, TimeStamp, side, rate) ) WITHOUT ROWID')
+    conn.execute('INSERT OR IGNORE INTO booksNew SELECT marketID, TimeStamp, side, rate, qty FROM books ORDER BY rowid')
+    conn.execute('DROP TABLE books')
+    conn.execute('ALTER TABLE booksNew RENAME TO books')
+
+
+def migrateCandlePeriods(conn):
+    # candles are kept as a separate series per bin size, rows collected before this migration
+    # all come from the 24h series
+    conn.execute('CREATE TABLE candlesNew ( marketID integer not null, '
+                 'period varchar(5) not null default \'24h\', '
+                 'timeOpen datetime not null, '
+                 'timeClose datetime not null, '
+                 'baseVolume bigint not null, '
+                 'quoteVolume bigint not null, '
+                 'high bigint not null, '
+                 'low bigint not null, '
+                 'open bigint not null, '
+                 'close bigint not null, '
+                 'unique (marketID, period, timeOpen) )')
+    conn.execute('INSERT INTO candlesNew (marketID, period, timeOpen, timeClose, baseVolume, quoteVolume, '
+                 'high, low, open, close) SELECT marketID, \'24h\', timeOpen, timeClose, baseVolume, '
+                 'quoteVolume, high, low, open, close FROM candles ORDER BY rowid')
+    conn.execute('DROP TABLE candles')
+    conn.execute('ALTER TABLE candlesNew RENAME TO candles')
+
+
+def migrateBookDeltas(conn):
+    # tables for the delta encoded order book store, see bookstore.py. timestamps are epoch
+    # milliseconds and side is 1 for buy and 0 for sell
+    conn.execute('CREATE TABLE bookSnapshots ( marketID integer not null, '
+                 'timeStamp integer not null, '
+                 'keyframe integer not null, '
+                 'primary key (marketID, timeStamp) ) WITHOUT ROWID')
+    conn.execute('CREATE TABLE bookLevels ( marketID integer not null, '
+                 'timeStamp integer not null, '
+                 'side integer not null, '
+                 'rate integer not null, '
+                 'qty integer not null, '
+                 'primary key (marketID, timeStamp, side, rate) ) WITHOUT ROWID')
+
+
+def migrateMetrics(conn):
+    # daily asset metrics cached from the market data provider, see cm.py. date is YYYY-MM-DD
+    # and a null value marks a day the provider has no data for
+    conn.execute('CREATE TABLE metrics ( asset varchar(30) not null, '
+                 'metric varchar(30) not null, '
+                 'date text not null, '
+                 'value real, '
+                 'primary key (asset, metric, date) ) WITHOUT ROWID')
+
+
+def migrateRollups(conn):
+    # daily (1d), weekly (1w) and monthly (1mo) volume rollups of the 24h candles, see
+    # rollups.py. periodStart is YYYY-MM-DD, volumes are in conventional units of the asset and
+    # in USD, the latter null until prices are available
+    conn.execute('CREATE TABLE marketVolumes ( marketID integer not null, '
+                 'granularity varchar(5) not null, '
+                 'periodStart text not null, '
+                 'baseVolume real not null, '
+                 'quoteVolume real not null, '
+                 'baseVolumeUSD real, '
+                 'quoteVolumeUSD real, '
+                 'candles integer not null, '
+                 'primary key (marketID, granularity, periodStart) ) WITHOUT ROWID')
+    conn.execute('CREATE TABLE exchangeVolumes ( exchangeID integer not null, '
+                 'quote varchar(30) not null, '
+                 'granularity varchar(5) not null, '
+                 'periodStart text not null, '
+                 'quoteVolume real not null, '
+                 'baseVolumeUSD real, '
+                 'quoteVolumeUSD real, '
+                 'markets integer not null, '
+                 'primary key (exchangeID, quote, granularity, periodStart) ) WITHOUT ROWID')
+    # dashboards read a window of periods across all markets
+    conn.execute('CREATE INDEX marketVolumesPeriod ON marketVolumes ( granularity, periodStart )')
+
+
+def migrateArchives(conn):
+    # the first day of each table not yet exported to the parquet archive, see archive.py
+    conn.execute('CREATE TABLE archives ( tableName varchar(30) not null primary key, '
+                 'archivedUntil text not null )')
+
+
+def migrateBookStats(conn):
+    # liquidity statistics per order book snapshot, see bookstats.py. prices and depths are in
+    # conventional units, the depth columns are suffixed with their band in percent of the mid
+    bandCols = ''.join(f'{col}{band} real, ' for band in (1, 2, 5, 10)
+                       for col in ('bidBase', 'askBase', 'bidQuote', 'askQuote', 'imbalance'))
+    conn.execute('CREATE TABLE bookStats ( marketID integer not null, '
+                 'TimeStamp timestamp not null, '
+                 'bestBid real, '
+                 'bestAsk real, '
+                 'mid real, '
+                 'spread real, '
+                 + bandCols +
+                 'primary key (marketID, TimeStamp) ) WITHOUT ROWID')
+
+
+def migrateTableVersions(conn):
+    # a write counter per table, bumped in the transaction of every write (see tableWritten) so
+    # cached query results can be validated across processes, see querycache.py. the * row is a
+    # random id of the database, a file recreated at the same path doesn't match old results
+    conn.execute('CREATE TABLE tableVersions ( tableName text primary key, '
+                 'version integer not null ) WITHOUT ROWID')
+    conn.execute("INSERT INTO tableVersions ( tableName, version ) VALUES ( '*', random() )")
+
+
+migrations = [migrateBooksKey, migrateCandlePeriods, migrateBookDeltas, migrateMetrics, migrateRollups,
+              migrateArchives, migrateBookStats, migrateTableVersions]
+
+
+# this function applies the pending migrations, each in its own transaction
+def migrateDB(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number in range(version, len(migrations)):
+        migration = migrations[number]
+        logger.info(f'applying migration {number + 1} {migration.__name__}')
+        try:
+            conn.execute('BEGIN')
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(migrations)
+
+
+# this function connects to a database, and sets up the required table structure if it doesn't exist
+def initalizeDB(path):
+    try:
+        logger.info(f'starting database initialization {path}')
+        # connect to database
+        conn, cur = dbConnect(path)
+        # create exchanges table
+        result = createTable(cur, 'exchanges', ['ID integer primary key',
+                                                'name varchar(30) not null',
+                                                'unique (name)'])
+        if not result:
+            raise Exception("exchanges table can't be created")
+        # create markets table
+        result = createTable(cur, 'markets', ['ID integer primary key',
+                                              'exchangeID integer not null',
+                                              'name varchar(30) not null',
+                                              'base varchar(30) not null',
+                                              'quote varchar(30) not null',
+                                              'unique (exchangeID, name, base, quote)'
+                                              ])
+        if not result:
+            raise Exception("markets table can't be created")
+        # create market config table
+        result = createTable(cur, 'marketConfig', ['marketID int not null',
+                                                   'epochlen int not null',
+                                                   'lotsize bigint not null',
+                                                   'parcelSize bigint not null',
+                                                   'ratestep int not null',
+                                                   'baseConversionFactor bigint not null',
+                                                   'quoteConversionFactor bigint not null',
+                                                   'LastUpdated timestamp DATETIME not null',
+                                                   'unique (marketID)'
+                                                   ])
+        if not result:
+            raise Exception("markets table can't be created")
+        # create books table
+        result = createTable(cur, 'books', ['marketID integer not null',
+                                            'TimeStamp datetime not null',
+                                            'side integer not null',
+                                            'rate bigint not null',
+                                            'qty bigint not null'])
+        if not result:
+            raise Exception("books table can't be created")
+        result = createTable(cur, 'candles', ['marketID integer not null',
+                                              'timeOpen datetime not null',
+                                              'timeClose datetime not null',
+                                              'baseVolume bigint not null',
+                                              'quoteVolume bigint not null',
+                                              'high bigint not null',
+                                              'low bigint not null',
+                                              'open bigint not null',
+                                              'close bigint not null',
+                                              'unique (marketID, timeOpen)'])
+        if not result:
+            raise Exception("candles table can't be created")
+        conn.commit()
+        # bring the schema up to date
+        migrateDB(conn)
+        conn.close()
+        return True
+    except Exception as err:
+        logger.error(f'{err=}, {type(err)=}')
+        conn.close()
+        raise
+
+
+# conflict targets for tables with a unique key, replace=True upserts on these instead of
+# deleting and re-inserting the row
+upsertKeys = {'marketConfig': ['marketID'],
+              'candles': ['marketID', 'period', 'timeOpen'],
+              'metrics': ['asset', 'metric', 'date'],
+              'marketVolumes': ['marketID', 'granularity', 'periodStart'],
+              'exchangeVolumes': ['exchangeID', 'quote', 'granularity', 'periodStart']}
+# number of rows bound per executemany call
+defaultBatchSize = 50000
+
+
+# this function builds the insert statement for a table, replace upserts on the table's
+# conflict target if it has one and falls back to INSERT OR REPLACE otherwise
+def insertStatement(tableName, listCols, replace=False):
+    colStr = ', '.join(listCols)
+    valueStr = ', '.join(['?'] * len(listCols))
+    if replace is False:
+        return f'INSERT OR IGNORE INTO {tableName} ( {colStr} ) VALUES ( {valueStr} )'
+    keys = upsertKeys.get(tableName)
+    if keys is None or not set(keys).issubset(listCols):
+        return f'INSERT OR REPLACE INTO {tableName} ( {colStr} ) VALUES ( {valueStr} )'
+    updates = [f'{col} = excluded.{col}' for col in listCols if col not in keys]
+    if not updates:
+        return f'INSERT OR IGNORE INTO {tableName} ( {colStr} ) VALUES ( {valueStr} )'
+    return (f'INSERT INTO {tableName} ( {colStr} ) VALUES ( {valueStr} ) '
+            f'ON CONFLICT ( {", ".join(keys)} ) DO UPDATE SET {", ".join(updates)}')
+
+
+# this function bumps the write counters of tables, writes that don't go through insertRecords
+# call it in their transaction so the cached query results of the tables are invalidated
+def tableWritten(conn, *tableNames):
+    conn.executemany('INSERT INTO tableVersions ( tableName, version ) VALUES ( ?, 1 ) '
+                     'ON CONFLICT ( tableName ) DO UPDATE SET version = version + 1',
+                     [(tableName,) for tableName in tableNames])
+
+
+# this function converts a column into a list of values sqlite3 can bind. timestamps are stored
+# as text in the format pandas/sqlite3 wrote them before, without a fraction for whole seconds.
+# they are formatted once per distinct value since snapshots share a single timestamp
+def toSQLValues(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        codes, uniques = pd.factorize(series)
+        text = uniques.strftime('%Y-%m-%d %H:%M:%S')
+        text = text.where(uniques.microsecond == 0, text + uniques.strftime('.%f'))
+        # missing values have code -1 and pick up the trailing None
+        return np.append(text.to_numpy(dtype=object), None)[codes].tolist()
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+# rows per chunk for streaming reads
+defaultChunkSize = 100000
+
+
+# this function builds a parameterized where clause from filters, a dictionary mapping column
+# names to a value (col = ?), a list of values (col IN (...)) or a (start, end) tuple for a
+# range where either bound can be None. returns the clause, empty without filters, and its
+# parameters. timestamps are bound in the format they are stored in
+def filterClause(filters):
+    conditions = []
+    params = []
+    for col, value in (filters or {}).items():
+        if isinstance(value, tuple):
+            if len(value) != 2:
+                raise Exception(f'range filter for {col} needs a (start, end) tuple')
+            for operator, bound in zip(['>=', '<='], value):
+                if bound is not None:
+                    conditions.append(f'{col} {operator} ?')
+                    params.append(toSQLValues(pd.Series([bound]))[0])
+        elif isinstance(value, (list, set, np.ndarray, pd.Series, pd.Index)):
+            values = toSQLValues(pd.Series(list(value), dtype=object if len(value) == 0 else None))
+            conditions.append(f'{col} IN ( {", ".join(["?"] * len(values))} )')
+            params.extend(values)
+        else:
+            conditions.append(f'{col} = ?')
+            params.append(toSQLValues(pd.Series([value]))[0])
+    if not conditions:
+        return '', []
+    return 'WHERE ' + ' AND '.join(conditions), params
+
+
+# this function turns a chunk of rows into a DataFrame, or an arrow record batch if arrow is set
+def toChunk(rows, cols, arrow=False):
+    if arrow:
+        return pa.RecordBatch.from_arrays([pa.array(list(values)) for values in zip(*rows)]
+                                          if rows else [pa.array([])] * len(cols), names=cols)
+    return pd.DataFrame.from_records(rows, columns=cols)
+
+
+class DBSession:
+    # keeps the connections to a database open for the life of the process. all writes go
+    # through a single writer connection guarded by a lock, reads use a pool of reader
+    # connections. the sql built for each table/column combination is cached so sqlite3 can
+    # reuse its prepared statements.
+    def __init__(self, path, readers=4):
+        # ensure the path is valid, this is only checked once per session
+        pathCheck(path)
+        self.path = path
+        self.maxReaders = readers
+        self.writeLock = threading.RLock()
+        # nesting depth of write() and the thread holding the writer while it is open
+        self.writeDepth = 0
+        self.writeOwner = None
+        # [depth, func] of the functions that undo process state if their write is rolled back
+        self.undos = []
+        # functions run once before the outermost write commits, by key
+        self.deferred = {}
+        self.readLock = threading.Lock()
+        self.readers = queue.LifoQueue()
+        self.readerCount = 0
+        self.statements = {}
+        self.maintenanceInterval = storageSettings.get(path, {}).get('maintenanceInterval')
+        self.lastMaintenance = time.monotonic()
+        self.writer = self.connect()
+        logger.debug(f'session opened for {path} ')
+
+    def connect(self):
+        # connections are shared between threads, access is serialized by the session
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        applyPragmas(conn, self.path)
+        return conn
+
+    def maintain(self, force=False):
+        # checkpoints the wal and lets sqlite refresh its query planner statistics. this runs at
+        # most once per maintenance interval unless forced, returns True if it ran
+        if not force:
+            if not self.maintenanceInterval or time.monotonic() - self.lastMaintenance < self.maintenanceInterval:
+                return False
+        with self.writeLock:
+            # passive checkpoints never wait for readers
+            self.writer.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            self.writer.execute('PRAGMA optimize')
+        self.lastMaintenance = time.monotonic()
+        logger.debug(f'maintenance complete for {self.path} ')
+        return True
+
+    @contextlib.contextmanager
+    def write(self):
+        # yields the writer connection, commits on success and rolls back on error. a write
+        # nested in another one on the same thread runs in a savepoint, its changes are rolled
+        # back alone on error and committed with the outermost write
+        with self.writeLock:
+            depth = self.writeDepth
+            self.writeDepth += 1
+            self.writeOwner = threading.get_ident()
+            try:
+                if depth:
+                    if not self.writer.in_transaction:
+                        # releasing a savepoint outside a transaction would commit it
+                        self.writer.execute('BEGIN')
+                    self.writer.execute(f'SAVEPOINT write{depth}')
+                yield self.writer
+                if depth:
+                    self.writer.execute(f'RELEASE write{depth}')
+                    # the undos of the savepoint now belong to the enclosing write
+                    for undo in self.undos:
+                        undo[0] = min(undo[0], depth)
+                else:
+                    self.runDeferred()
+                    self.writer.commit()
+                    self.undos.clear()
+            except Exception:
+                if depth:
+                    self.writer.execute(f'ROLLBACK TO write{depth}')
+                    self.writer.execute(f'RELEASE write{depth}')
+                else:
+                    self.writer.rollback()
+                    self.deferred.clear()
+                self.undo(depth)
+                raise
+            finally:
+                self.writeDepth -= 1
+                if not self.writeDepth:
+                    self.writeOwner = None
+
+    def onRollback(self, func):
+        # registers func to run if the write the calling thread is in is rolled back, e.g. to drop
+        # a cache entry holding its uncommitted rows. outside a write there is nothing to roll back
+        if self.writeOwner == threading.get_ident():
+            self.undos.append([self.writeDepth, func])
+
+    def beforeCommit(self, key, func):
+        # runs func before the write the calling thread is in commits, in the same transaction.
+        # funcs registered under the same key in one write run once, e.g. to total what every job
+        # of a group changed. a failing func is rolled back alone and logged. outside a write func
+        # runs right away
+        if self.writeOwner != threading.get_ident():
+            func()
+            return
+        self.deferred.setdefault(key, func)
+
+    def runDeferred(self):
+        while self.deferred:
+            func = self.deferred.pop(next(iter(self.deferred)))
+            try:
+                with self.write():
+                    func()
+            except Exception as err:
+                logger.error(f'{err=}, {type(err)=}')
+
+    def undo(self, depth):
+        # runs the undos registered inside the rolled back write at depth, newest first
+        undos = [func for level, func in self.undos if level > depth]
+        self.undos = [undo for undo in self.undos if undo[0] <= depth]
+        for func in reversed(undos):
+            try:
+                func()
+            except Exception as err:
+                logger.error(f'{err=}, {type(err)=}')
+
+    @contextlib.contextmanager
+    def read(self):
+        # yields a reader connection from the pool, a new one is opened while the pool is
+        # below its size, otherwise this waits for a connection to be returned. a thread inside
+        # write() reads from the writer so it sees its own uncommitted rows
+        if self.writeOwner == threading.get_ident():
+            yield self.writer
+            return
+        with self.readLock:
+            if self.readers.empty() and self.readerCount < self.maxReaders:
+                self.readers.put(self.connect())
+                self.readerCount += 1
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    def statement(self, key, builder):
+        # returns the cached sql for key, building it on first use
+        sql = self.statements.get(key)
+        if sql is None:
+            sql = builder()
+            self.statements[key] = sql
+        return sql
+
+    def insertRecords(self, tableName, inputData, colDict, replace=False, batchSize=None):
+        try:
+            # colDict is a dictionary where the keys are the input data columns and the values the
+            # table columns they are written to
+            inputCols = list(colDict)
+            queryStr = self.statement(('insert', tableName, tuple(colDict.values()), replace),
+                                      lambda: insertStatement(tableName, list(colDict.values()), replace))
+            if batchSize is None:
+                batchSize = defaultBatchSize
+            # rows are converted and written a batch at a time inside a single transaction
+            with metrics.timer('dexdb_insert_seconds', table=tableName), self.write() as conn:
+                for start in range(0, len(inputData), batchSize):
+                    batch = inputData[inputCols].iloc[start:start + batchSize]
+                    conn.executemany(queryStr, zip(*[toSQLValues(batch[col]) for col in inputCols]))
+                if len(inputData):
+                    tableWritten(conn, tableName)
+            metrics.count('dexdb_rows_written_total', len(inputData), table=tableName)
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=}')
+            raise
+
+    def insertReturning(self, tableName, inputData, colDict, returning):
+        # inserts the rows that don't exist yet and returns the returning columns (e.g. the new
+        # IDs) of the inserted rows, rows that already exist return nothing
+        try:
+            inputCols = list(colDict)
+            queryStr = self.statement(('returning', tableName, tuple(colDict.values()), tuple(returning)),
+                                      lambda: (f'INSERT INTO {tableName} ( {", ".join(colDict.values())} ) '
+                                               f'VALUES ( {", ".join(["?"] * len(colDict))} ) '
+                                               f'ON CONFLICT DO NOTHING RETURNING {", ".join(returning)}'))
+            rows = []
+            with metrics.timer('dexdb_insert_seconds', table=tableName), self.write() as conn:
+                for values in zip(*[toSQLValues(inputData[col]) for col in inputCols]):
+                    rows.extend(conn.execute(queryStr, values).fetchall())
+                if rows:
+                    tableWritten(conn, tableName)
+            metrics.count('dexdb_rows_written_total', len(rows), table=tableName)
+            return pd.DataFrame(rows, columns=list(returning))
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=}')
+            raise
+
+    def readTable(self, tableName, listCols=None, whereClause=None, filters=None):
+        # create a default column list if it isn't provided
+        if listCols is None:
+            listColStr = '*'
+        else:
+            listColStr = ', '.join(listCols)
+        # add a clause for filtering data at the query level, filters are parameterized (see
+        # filterClause) while whereClause is taken as raw sql
+        whereStr, params = filterClause(filters)
+        if whereClause is not None:
+            whereStr = f'{whereStr} AND ( {whereClause} )' if whereStr else f'WHERE {whereClause}'
+        # build the sql query and execute
+        return self.freeQuery(f'Select {listColStr} from {tableName} {whereStr}', params)
+
+    def iterQuery(self, queryStr, params=None, chunkSize=None, arrow=False):
+        # yields the result of a query in chunks of chunkSize rows as DataFrames, or arrow record
+        # batches if arrow is set, so only one chunk is held in memory at a time. the reader
+        # connection is kept until the generator is exhausted or closed
+        if arrow and pa is None:
+            raise Exception('pyarrow is required for arrow batches')
+        if chunkSize is None:
+            chunkSize = defaultChunkSize
+        with self.read() as conn:
+            cursor = conn.execute(queryStr, params or [])
+            try:
+                cols = [col[0] for col in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(chunkSize)
+                    if not rows:
+                        break
+                    yield toChunk(rows, cols, arrow)
+            finally:
+                cursor.close()
+
+    def iterTable(self, tableName, listCols=None, filters=None, chunkSize=None, arrow=False):
+        # streams a table, see filterClause for filters
+        listColStr = '*' if listCols is None else ', '.join(listCols)
+        whereStr, params = filterClause(filters)
+        yield from self.iterQuery(f'Select {listColStr} from {tableName} {whereStr}', params, chunkSize, arrow)
+
+    def freeQuery(self, queryStr, params=None):
+        try:
+            with self.read() as conn:
+                return pd.read_sql_query(queryStr, conn, params=params)
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=}')
+            raise
+
+    def close(self, optimize=True):
+        # closes the writer and every pooled reader, the query planner statistics are refreshed
+        # first unless optimize is False
+        with self.writeLock:
+            if optimize:
+                try:
+                    self.writer.execute('PRAGMA optimize')
+                except sqlite3.Error as error:
+                    logger.warning(f'{error} for {self.path} ')
+            self.writer.close()
+        while not self.readers.empty():
+            self.readers.get().close()
+        self.readerCount = 0
+        logger.debug(f'session closed for {self.path} ')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+# open sessions, one per database path
+sessions = {}
+sessionsLock = threading.Lock()
+
+
+# this function returns the process wide session for a database, opening it on first use
+def getSession(path):
+    with sessionsLock:
+        session = sessions.get(path)
+        if session is None:
+            session = DBSession(path)
+            sessions[path] = session
+        return session
+
+
+# this function closes all open sessions, it runs automatically at exit. processes that only
+# read pass optimize=False so closing doesn't write to the database
+@atexit.register
+def closeSessions(optimize=True):
+    with sessionsLock:
+        for session in sessions.values():
+            session.close(optimize)
+        sessions.clear()
+
+
+class GroupWriter:
+    # runs database jobs on a background thread and commits them in groups: a commit holds up to
+    # groupSize jobs, waiting at most groupDelay seconds for more once the first one arrives.
+    # every job runs in its own savepoint so a failing one doesn't take the group down. submit
+    # blocks while queueSize jobs are waiting, which holds fetchers back to the write rate
+    def __init__(self, path, queueSize=None, groupSize=None, groupDelay=None):
+        self.path = path
+        self.groupSize = max(1, writerGroupSize if groupSize is None else groupSize)
+        self.groupDelay = writerGroupDelay if groupDelay is None else groupDelay
+        self.queue = queue.Queue(writerQueueSize if queueSize is None else queueSize)
+        self.groups = 0
+        self.jobs = 0
+        self.thread = threading.Thread(target=self.run, name=f'writer {path}', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, block=True):
+        # queues func(*args), the returned future resolves once its group is committed. a full
+        # queue blocks until there is room, or returns None when block is False
+        future = concurrent.futures.Future()
+        job = (func, args, future)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            if not block:
+                return None
+            start = time.perf_counter()
+            self.queue.put(job)
+            metrics.observe('dexdb_writer_wait_seconds', time.perf_counter() - start)
+        return future
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            jobs = [] if job is None else [job]
+            stopping = job is None
+            deadline = time.monotonic() + self.groupDelay
+            while jobs and len(jobs) < self.groupSize:
+                try:
+                    job = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                jobs.append(job)
+            if jobs:
+                self.commit(jobs)
+            for number in range(len(jobs) + stopping):
+                self.queue.task_done()
+            if stopping:
+                return
+
+    def commit(self, jobs):
+        session = getSession(self.path)
+        results = []
+        try:
+            with metrics.timer('dexdb_commit_seconds'), session.write():
+                for func, args, future in jobs:
+                    try:
+                        with session.write():
+                            results.append((future, func(*args), None))
+                    except Exception as err:
+                        logger.error(f'{err=}, {type(err)=}')
+                        results.append((future, None, err))
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=}')
+            results = [(future, None, err) for func, args, future in jobs]
+        self.groups += 1
+        self.jobs += len(jobs)
+        metrics.count('dexdb_commits_total')
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        # checkpoint and optimize the database once the maintenance interval has passed
+        try:
+            session.maintain()
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=}')
+
+    def flush(self):
+        # returns once every submitted job has been committed
+        self.queue.join()
+
+    def close(self):
+        # commits the queued jobs and stops the writer thread
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+# the functions below are the module api, they use the session for the database path
+def insertRecords(path,tableName,inputData, colDict, replace=False, batchSize=None):
+    getSession(path).insertRecords(tableName, inputData, colDict, replace, batchSize)
+
+
+def insertReturning(path, tableName, inputData, colDict, returning):
+    return getSession(path).insertReturning(tableName, inputData, colDict, returning)
+
+
+def onRollback(path, func):
+    getSession(path).onRollback(func)
+
+
+def beforeCommit(path, key, func):
+    getSession(path).beforeCommit(key, func)
+
+
+def readTable(path,tableName,listCols=None,whereClause=None,filters=None):
+    return getSession(path).readTable(tableName, listCols, whereClause, filters)
+
+
+# these functions stream a query or table in chunks, see DBSession.iterQuery
+def iterQuery(path,queryStr,params=None,chunkSize=None,arrow=False):
+    return getSession(path).iterQuery(queryStr, params, chunkSize, arrow)
+
+
+def iterTable(path,tableName,listCols=None,filters=None,chunkSize=None,arrow=False):
+    return getSession(path).iterTable(tableName, listCols, filters, chunkSize, arrow)
+
+
+# this function is an open/free query into the specified database
+def freeQuery(path,queryStr,params=None):
+    return getSession(path).freeQuery(queryStr, params)
+
+
+# this function runs the periodic database maintenance if it is due
+def maintain(path, force=False):
+    return getSession(path).maintain(force)
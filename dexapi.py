@@ -1,10 +1,20 @@
+import numpy as np
 import pandas as pd
 from datetime import date
 import datetime as dt
 import requests
+import codecs
+import email.utils
+import hashlib
+import json
 import os
+import random
+import re
+import threading
 import time
+import urllib.parse
 import logging
+import metrics
 logger = logging.getLogger(__name__)
 
 
@@ -15,6 +25,8 @@ pd.set_option('display.max_columns', None)
 
 # list of exchange servers
 exchanges = ["dex.decred.org"]
+# candle bin sizes served by the exchange in milliseconds
+binSizes = {'24h': 86400000, '1h': 3600000, '5m': 300000}
 
 def checkKeys(keyList,data):
     # checks that all keys exist in the data, it will return the key not found
@@ -29,12 +41,149 @@ def checkKeys(keyList,data):
     return None
 
 
+def baseUrl(exchange):
+    # exchanges are plain host names served over https, a scheme can be given
+    # explicitly (e.g. http://127.0.0.1:8080) to point at a local server
+    if '://' in exchange:
+        return exchange.rstrip('/')
+    return "https://" + exchange
+
+
+# json decoders by name, the fastest one available is used unless setDecoder selects another
+decoders = {'json': json.loads}
+try:
+    import orjson
+    decoders['orjson'] = orjson.loads
+except ImportError:
+    pass
+try:
+    import ujson
+    decoders['ujson'] = ujson.loads
+except ImportError:
+    pass
+decoderName = next(name for name in ['orjson', 'ujson', 'json'] if name in decoders)
+decode = decoders[decoderName]
+# parse order books from the response stream instead of decoding the whole body first
+streamOrderBooks = False
+
+
+# this function selects the json decoder, auto picks the fastest available
+def setDecoder(name='auto'):
+    global decoderName, decode
+    if name == 'auto':
+        name = next(name for name in ['orjson', 'ujson', 'json'] if name in decoders)
+    if name not in decoders:
+        raise Exception(f'json decoder {name} is not available')
+    decoderName = name
+    decode = decoders[name]
+    logger.info(f'using json decoder {name}')
+
+
+# http client settings: request timeout in seconds, pooled keep-alive connections per host,
+# retries on 429/5xx and timeouts and the base and cap of the exponential backoff in seconds
+httpSettings = {'timeout': 4, 'poolSize': 8, 'retries': 3, 'backoff': 0.5, 'maxBackoff': 30}
+retryStatus = {429, 500, 502, 503, 504}
+# one session per exchange host so connections are kept alive and reused between requests
+sessions = {}
+sessionsLock = threading.Lock()
+# returned by getConditional when the resource is unchanged
+NOT_MODIFIED = object()
+
+
+# this function updates the http client settings, pooled sessions are closed so the next
+# request picks up the new pool size
+def configureHttp(**settings):
+    unknown = set(settings).difference(httpSettings)
+    if unknown:
+        raise Exception(f'unknown http settings {sorted(unknown)}')
+    httpSettings.update(settings)
+    closeSessions()
+
+
+def getSession(url):
+    host = urllib.parse.urlsplit(url).netloc
+    with sessionsLock:
+        session = sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=httpSettings['poolSize'])
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip', 'Accept': 'application/json'})
+            sessions[host] = session
+    return session
+
+
+def closeSessions():
+    with sessionsLock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
+
+
+# this function returns the seconds to wait before retry number attempt, the server's
+# Retry-After (in seconds or as a date) is honored, otherwise the delay is drawn uniformly up
+# to an exponentially growing cap so clients that failed together don't retry together
+def backoffDelay(attempt, retryAfter=None):
+    if retryAfter:
+        try:
+            delay = float(retryAfter)
+        except ValueError:
+            try:
+                delay = (email.utils.parsedate_to_datetime(retryAfter) - dt.datetime.now(dt.timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), httpSettings['maxBackoff'])
+    return random.uniform(0, min(httpSettings['maxBackoff'], httpSettings['backoff'] * 2 ** attempt))
+
+
+def endpoint(url):
+    # the api route of a url (config, orderbook or candles), used as a metrics label
+    return url.partition('/api/')[2].partition('/')[0]
+
+
+# this function sends a get request through the host session, retrying on 429/5xx responses
+# and timeouts. the last response is returned whatever its status
+def request(url, headers=None, stream=False):
+    session = getSession(url)
+    attempt = 0
+    while True:
+        try:
+            response = session.get(url, headers=headers, timeout=httpSettings['timeout'], stream=stream)
+        except requests.exceptions.Timeout:
+            if attempt >= httpSettings['retries']:
+                raise
+            delay = backoffDelay(attempt)
+            metrics.count('dexdb_http_retries_total', endpoint=endpoint(url), reason='timeout')
+            logger.warning(f'timeout for {url}, retrying in {delay:.2f}s')
+        else:
+            metrics.count('dexdb_http_responses_total', endpoint=endpoint(url), status=str(response.status_code))
+            if response.status_code not in retryStatus or attempt >= httpSettings['retries']:
+                return response
+            delay = backoffDelay(attempt, response.headers.get('Retry-After'))
+            metrics.count('dexdb_http_retries_total', endpoint=endpoint(url), reason=str(response.status_code))
+            logger.warning(f'status {response.status_code} for {url}, retrying in {delay:.2f}s')
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+def fetch(url, headers=None):
+    # the response and its body, the body is read within the timer
+    with metrics.timer('dexdb_http_request_seconds', endpoint=endpoint(url)):
+        response = request(url, headers)
+        content = response.content
+    metrics.count('dexdb_http_bytes_total', len(content), endpoint=endpoint(url))
+    return response, content
+
+
 def getResponse(url):
     try:
-        # get response
-        response = requests.get(url,timeout=4)
+        response, content = fetch(url)
         response.raise_for_status()  # Raise an exception for HTTP errors
-        data = response.json()
+        with metrics.timer('dexdb_parse_seconds', function='decode'):
+            data = decode(content)
     except Exception as error:
         logger.error(f'response error {str(error)} ')
         raise
@@ -43,28 +192,200 @@ def getResponse(url):
     else:
         raise Exception(f'no data returned')
 
+
+# this function sends the validators of a response the caller stored before ({} for none) and
+# returns (NOT_MODIFIED, validators) when the server answers 304 or sends the same body again,
+# for servers without ETag or Last-Modified. otherwise it returns the data and the validators of
+# this response, which the caller keeps once the data is stored. nothing is remembered here, so
+# the validators always belong to the data the caller has
+def getConditional(url, validators):
+    try:
+        response, content = fetch(url, validators.get('headers'))
+        if response.status_code == 304:
+            logger.debug(f'not modified {url}')
+            return NOT_MODIFIED, validators
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        digest = hashlib.sha1(content).hexdigest()
+        if validators.get('digest') == digest:
+            logger.debug(f'unchanged body {url}')
+            return NOT_MODIFIED, validators
+        with metrics.timer('dexdb_parse_seconds', function='decode'):
+            data = decode(content)
+        headers = {}
+        if 'ETag' in response.headers:
+            headers['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            headers['If-Modified-Since'] = response.headers['Last-Modified']
+    except Exception as error:
+        logger.error(f'response error {str(error)} ')
+        raise
+    if data is not None:
+        return data, {'headers': headers, 'digest': digest}
+    else:
+        raise Exception(f'no data returned')
+
+
+# this function yields the response body in chunks as it arrives
+def getResponseStream(url, chunkSize=65536):
+    try:
+        response = request(url, stream=True)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+    except Exception as error:
+        logger.error(f'response error {str(error)} ')
+        raise
+    with response:
+        for chunk in response.iter_content(chunkSize):
+            metrics.count('dexdb_http_bytes_total', len(chunk), endpoint=endpoint(url))
+            yield chunk
+
+# these functions turn api payloads into dataframes, they work on whole columns at once so
+# the cost per market or order stays small for large responses
+@metrics.timed('dexdb_parse_seconds', function='parseMarkets')
+def parseMarkets(data):
+    # verify that the response has the desired keys
+    checkKeys(['assets','markets'], data)
+    checkKeys(['quote', 'base'], data['markets'])
+    checkKeys(['conversionFactor'], data['assets'][0]['unitinfo']['conventional'])
+    # asset id lookups for symbols and conversion factors
+    symbols = {asset['id']: asset['symbol'] for asset in data['assets']}
+    factors = {asset['id']: asset['unitinfo']['conventional']['conversionFactor'] for asset in data['assets']}
+    # extract markets list
+    markets = pd.DataFrame.from_dict(data['markets'])
+    unknown = set(markets['base']).union(markets['quote']).difference(symbols)
+    if unknown:
+        raise Exception(f'asset ids {sorted(unknown)} not found')
+    # conversion factors and symbols for base and quote
+    markets['baseConversionFactor'] = markets['base'].map(factors)
+    markets['quoteConversionFactor'] = markets['quote'].map(factors)
+    markets['base'] = markets['base'].map(symbols)
+    markets['quote'] = markets['quote'].map(symbols)
+    return markets
+
+
+@metrics.timed('dexdb_parse_seconds', function='parseOrderBook')
+def parseOrderBook(data):
+    # verify that the response has the desired keys
+    checkKeys(['orders'], data)
+    checkKeys(['rate','qty','side'], data['orders'])
+    orders = data['orders']
+    # extract the order columns into arrays
+    rate = np.fromiter((order['rate'] for order in orders), dtype=np.int64, count=len(orders))
+    qty = np.fromiter((order['qty'] for order in orders), dtype=np.int64, count=len(orders))
+    side = np.fromiter((order['side'] for order in orders), dtype=np.int64, count=len(orders))
+    return aggregateOrders(rate, qty, side)
+
+
+# matches the start of the orders array in an order book response
+ordersPattern = re.compile(r'"orders"\s*:\s*\[')
+orderDecoder = json.JSONDecoder()
+
+
+def decodeOrders(text):
+    # decodes the complete orders at the start of text and returns them with the number of
+    # characters consumed. orders are flat objects, so everything up to the last closing brace
+    # normally decodes as one batch, otherwise they are decoded one at a time up to the first
+    # one that is cut off
+    try:
+        return decode('[' + text.lstrip(' \t\r\n,') + ']'), len(text)
+    except ValueError:
+        pass
+    orders = []
+    position = 0
+    while True:
+        while position < len(text) and text[position] in ' \t\r\n,':
+            position += 1
+        if position == len(text):
+            break
+        try:
+            order, position = orderDecoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            break
+        orders.append(order)
+    return orders, position
+
+
+@metrics.timed('dexdb_parse_seconds', function='parseOrderStream')
+def parseOrderStream(chunks, capacity=4096):
+    # parses the orders array of an order book response from an iterable of byte chunks. the
+    # orders in each chunk are decoded straight into arrays that grow as needed, so the response
+    # is never held as a whole nor turned into a full python object tree
+    rate = np.empty(capacity, dtype=np.int64)
+    qty = np.empty(capacity, dtype=np.int64)
+    side = np.empty(capacity, dtype=np.int64)
+    count = 0
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        if not started:
+            match = ordersPattern.search(buffer)
+            if match is not None:
+                started = True
+                buffer = buffer[match.end():]
+            elif eof:
+                raise Exception(f'orders key not found')
+            else:
+                # keep enough of the tail for a key split across chunks
+                buffer = buffer[-32:]
+        if started:
+            last = buffer.rfind('}')
+            if last >= 0:
+                orders, consumed = decodeOrders(buffer[:last + 1])
+                if count + len(orders) > len(rate):
+                    size = max(2 * len(rate), count + len(orders))
+                    rate, qty, side = [np.resize(array, size) for array in (rate, qty, side)]
+                try:
+                    for array, key in [(rate, 'rate'), (qty, 'qty'), (side, 'side')]:
+                        array[count:count + len(orders)] = np.fromiter((order[key] for order in orders),
+                                                                       dtype=np.int64, count=len(orders))
+                except KeyError as error:
+                    raise Exception(f'{error.args[0]} key not found')
+                count += len(orders)
+                buffer = buffer[consumed:]
+            buffer = buffer.lstrip(' \t\r\n,')
+            if buffer.startswith(']'):
+                break
+        if eof:
+            raise Exception(f'orders array is incomplete')
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer += text.decode(b'', final=True)
+        else:
+            buffer += text.decode(chunk)
+    return aggregateOrders(rate[:count], qty[:count], side[:count])
+
+
+def aggregateOrders(rate, qty, side):
+    # sums the qty per rate in a single pass over the rate sorted orders, the side of a level
+    # is the side of its first order
+    order = np.argsort(rate, kind='stable')
+    rate = rate[order]
+    levels, first = np.unique(rate, return_index=True)
+    return pd.DataFrame({'rate': levels,
+                         'qty': np.add.reduceat(qty[order], first) if len(first) else qty[:0],
+                         'side': np.where(side[order][first] == 1, 'buy', 'sell').astype(object)})
+
+
+@metrics.timed('dexdb_parse_seconds', function='parseCandles')
+def parseCandles(data):
+    checkKeys(['startStamps','endStamps'], data)
+    # extract candles list
+    candles = pd.DataFrame.from_dict(data)
+    # convert timestamps to something readable
+    candles['startStamps'] = pd.to_datetime(candles['startStamps'], unit='ms')
+    candles['endStamps'] = pd.to_datetime(candles['endStamps'], unit='ms')
+    return candles
+
+
 # this function gets a list of all markets for a server
 def getMarkets(exchange):
     try:
-        url = "https://" + exchange + "/api/config"
         # get response
-        data = getResponse(url)
-        # verify that the response has the desired keys
-        checkKeys(['assets','markets'], data)
-        checkKeys(['quote', 'base'], data['markets'])
-        checkKeys(['conversionFactor'], data['assets'][0]['unitinfo']['conventional'])
-        # extract asset list
-        assets = pd.json_normalize(data['assets']).set_index('id')
-        # extract markets list
-        markets = pd.DataFrame.from_dict(data['markets'])
-        # base conversion factory
-        markets['baseConversionFactor'] = markets['base'].apply(lambda x: assets.loc[x]['unitinfo.conventional.conversionFactor'])
-        # quote conversion factory
-        markets['quoteConversionFactor'] = markets['quote'].apply(lambda x: assets.loc[x]['unitinfo.conventional.conversionFactor'])
-        # replace base with strings
-        markets['base'] = markets['base'].apply(lambda x: assets.loc[x].symbol)
-        # replace quote with strings
-        markets['quote'] = markets['quote'].apply(lambda x: assets.loc[x].symbol)
+        data = getResponse(baseUrl(exchange) + "/api/config")
+        markets = parseMarkets(data)
         logger.info(f'data processed for {exchange}')
         return markets
     except Exception as error:
@@ -72,21 +393,37 @@ def getMarkets(exchange):
         return None
 
 
-# this function gets order book data for a market
-def getOrderBook(exchange,base,quote):
+# this function gets the markets with the validators of the config the caller's markets were
+# parsed from ({} for none), it returns (markets, validators) or (NOT_MODIFIED, validators)
+# without parsing when the config is unchanged, see getConditional
+def getMarketsConditional(exchange, validators):
     try:
-        url = "https://" + exchange + "/api/orderbook/" + base + '/' + quote
         # get response
-        data = getResponse(url)
-        # verify that the response has the desired keys
-        checkKeys(['orders'], data)
-        checkKeys(['rate','qty','side'], data['orders'])
-        # extract orders list
-        books = pd.DataFrame.from_dict(data['orders'])[['rate','qty','side']].copy().sort_values(by=['rate'])
-        # replace side with buy/sell
-        books['side'] = books['side'].apply(lambda x: 'buy' if x == 1 else 'sell')
-        books = books.groupby('rate').agg({'qty': 'sum',
-                                 'side': 'first'}).reset_index()
+        data, validators = getConditional(baseUrl(exchange) + "/api/config", validators)
+        if data is NOT_MODIFIED:
+            logger.info(f'config unchanged for {exchange}')
+            return NOT_MODIFIED, validators
+        markets = parseMarkets(data)
+        logger.info(f'data processed for {exchange}')
+        return markets, validators
+    except Exception as error:
+        logger.error(f' {str(error)} on exchange {exchange}')
+        return None
+
+
+# this function gets order book data for a market, stream parses the orders as the response
+# arrives and defaults to streamOrderBooks
+def getOrderBook(exchange,base,quote,stream=None):
+    try:
+        url = baseUrl(exchange) + "/api/orderbook/" + base + '/' + quote
+        if stream is None:
+            stream = streamOrderBooks
+        if stream:
+            books = parseOrderStream(getResponseStream(url))
+        else:
+            # get response
+            data = getResponse(url)
+            books = parseOrderBook(data)
         logger.debug(f'data processed for {exchange} {base}/{quote}')
         return books
     except Exception as error:
@@ -94,18 +431,15 @@ def getOrderBook(exchange,base,quote):
         return None
 
 
-# this function gets candle data for a market
-def getCandles(exchange, base,quote, period='24h'):
+# this function gets candle data for a market, count limits the response to the latest candles
+def getCandles(exchange, base,quote, period='24h', count=None):
     try:
-        url = "https://" + exchange + "/api/candles/" + base + '/' + quote + '/' + period
+        url = baseUrl(exchange) + "/api/candles/" + base + '/' + quote + '/' + period
+        if count is not None:
+            url += '/' + str(count)
         # get response
         data = getResponse(url)
-        checkKeys(['startStamps','endStamps'], data)
-        # extract candles list
-        candles = pd.DataFrame.from_dict(data)
-        # convert timestamps to something readable
-        candles['startStamps'] = pd.to_datetime(candles['startStamps'], unit='ms')
-        candles['endStamps'] = pd.to_datetime(candles['endStamps'], unit='ms')
+        candles = parseCandles(data)
         logger.debug(f'data processed for {exchange} {base}/{quote} {period}')
         return candles
     except Exception as error:
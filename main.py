@@ -1,23 +1,107 @@
 import dbmgr
 import dexapi
+import collector
+import bookstats
+import rollups
+import archive
+import daemon
+import shards
+import metrics
+import cm
 import logging
-import pandas as pd
 import datetime
 import time
 import configparser
 
 
-# read configuration
-config = configparser.ConfigParser()
-config.read('config.conf')
-# parse required configuration parameters
-dbPath = config['dataHandling']['dbPath']
-logPath = config['dataHandling']['logPath']
-sleepTimer = float(config['dataHandling']['sleepTimer'])
-exchangeList = config['dataHandling']['exchanges'].split(',')
-
 logger = logging.getLogger(__name__)
 
+# background writer of the sequential collection, writes run inline without one
+writer = None
+
+
+def loadConfig(path='config.conf'):
+    # reads the settings of the config file into the module globals. nothing is read at import,
+    # the entry points call this before initialize and collect
+    global dbPath, logPath, sleepTimer, exchangeList, collectorMode, processes, marketShards, \
+        maxConcurrent, requestRate, candlePeriods, bookStorage, keyframeInterval, bookStats, \
+        jsonDecoder, streamOrderBooks, storageConfig, storageProfile, storageOverrides, \
+        maintenanceInterval, writerSettings, rollupUSD, archiveEnabled, archivePath, archiveRetainDays, \
+        archivePrune, daemonConfig, daemonEnabled, daemonSettings, metricsEnabled, metricsPort, \
+        metricsDumpPath, metricsDumpInterval, profilePath, profiler, httpConfig, httpSettings
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise Exception(f'config file {path} not found')
+    # parse required configuration parameters
+    dbPath = config['dataHandling']['dbPath']
+    logPath = config['dataHandling']['logPath']
+    sleepTimer = float(config['dataHandling']['sleepTimer'])
+    exchangeList = config['dataHandling']['exchanges'].split(',')
+    # collection mode, async runs markets concurrently, process shards exchanges over worker
+    # processes and sequential polls them one by one
+    collectorMode = config['dataHandling'].get('collectorMode', 'async')
+    # worker processes and market shards per exchange in process mode
+    processes = int(config['dataHandling'].get('processes', '4'))
+    marketShards = int(config['dataHandling'].get('marketShards', '1'))
+    # per exchange host limits for the async collector
+    maxConcurrent = int(config['dataHandling'].get('maxConcurrent', '4'))
+    requestRate = float(config['dataHandling'].get('requestRate', '2'))
+    # candle series to collect, see dexapi.binSizes
+    candlePeriods = config['dataHandling'].get('candlePeriods', '24h').split(',')
+    # order book layout: levels, delta or both, and snapshots between delta keyframes
+    bookStorage = config['dataHandling'].get('bookStorage', 'levels')
+    keyframeInterval = int(config['dataHandling'].get('bookKeyframeInterval', '60'))
+    # liquidity statistics of every stored order book snapshot, see bookstats.py
+    bookStats = config['dataHandling'].getboolean('bookStats', True)
+    # json decoder (auto, orjson, ujson or json) and whether order books are parsed as they stream in
+    jsonDecoder = config['dataHandling'].get('jsonDecoder', 'auto')
+    streamOrderBooks = config['dataHandling'].getboolean('streamOrderBooks', False)
+    # storage profile and optional pragma overrides, see dbmgr.storageProfiles
+    storageConfig = config['storage'] if config.has_section('storage') else {}
+    storageProfile = storageConfig.get('profile', 'default')
+    storageOverrides = {name: storageConfig[name] for name in dbmgr.pragmaNames if name in storageConfig}
+    maintenanceInterval = float(storageConfig.get('maintenanceInterval', '0'))
+    # background writer, see dbmgr.GroupWriter. without group commit every write commits alone
+    groupCommit = config.getboolean('storage', 'groupCommit', fallback=True)
+    writerSettings = {'queueSize': int(storageConfig.get('writerQueueSize', '256')),
+                      'groupSize': int(storageConfig.get('writerGroupSize', '64')) if groupCommit else 1,
+                      'groupDelay': float(storageConfig.get('writerGroupDelay', '0')) if groupCommit else 0}
+    # price the volume rollups in USD, this requests prices from coinmetrics while collecting
+    rollupUSD = config.getboolean('rollups', 'usd', fallback=False)
+    # parquet archive of closed days, see archive.py
+    archiveEnabled = config.getboolean('archive', 'enabled', fallback=False)
+    archivePath = config.get('archive', 'path', fallback='./db/archive')
+    archiveRetainDays = config.getint('archive', 'retainDays', fallback=30)
+    archivePrune = config.getboolean('archive', 'prune', fallback=False)
+    # long running daemon with per job intervals in seconds, see daemon.py
+    daemonConfig = config['daemon'] if config.has_section('daemon') else {}
+    daemonEnabled = config.getboolean('daemon', 'enabled', fallback=False)
+    daemonSettings = {'marketInterval': float(daemonConfig.get('marketInterval', '3600')),
+                      'bookInterval': float(daemonConfig.get('bookInterval', '60')),
+                      'bookMaxInterval': float(daemonConfig.get('bookMaxInterval', '600')),
+                      'candleMaxInterval': float(daemonConfig.get('candleMaxInterval', '3600')),
+                      'backoffFactor': float(daemonConfig.get('backoffFactor', '2')),
+                      'jitter': float(daemonConfig.get('jitter', '0.1')),
+                      'shutdownTimeout': float(daemonConfig.get('shutdownTimeout', '30')),
+                      'bookFeed': config.getboolean('daemon', 'bookFeed', fallback=False),
+                      'feedPersistInterval': float(daemonConfig.get('feedPersistInterval', '60'))}
+    # request, parse and write metrics, served as prometheus text on port (0 disables the endpoint)
+    # and dumped as json to dumpPath, profilePath profiles every collection cycle
+    metricsEnabled = config.getboolean('metrics', 'enabled', fallback=False)
+    metricsPort = config.getint('metrics', 'port', fallback=0)
+    metricsDumpPath = config.get('metrics', 'dumpPath', fallback='')
+    metricsDumpInterval = config.getfloat('metrics', 'dumpInterval', fallback=60)
+    profilePath = config.get('metrics', 'profilePath', fallback='')
+    profiler = config.get('metrics', 'profiler', fallback='cprofile')
+    # http client settings, see dexapi.httpSettings
+    httpConfig = config['http'] if config.has_section('http') else {}
+    httpSettings = {'timeout': float(httpConfig.get('timeout', '4')),
+                    'poolSize': int(httpConfig.get('poolSize', '8')),
+                    'retries': int(httpConfig.get('retries', '3')),
+                    'backoff': float(httpConfig.get('backoff', '0.5')),
+                    'maxBackoff': float(httpConfig.get('maxBackoff', '30'))}
+
+
 def initialize():
     # initalize log
     logging.basicConfig(handlers=[logging.FileHandler(logPath), logging.StreamHandler()],
@@ -26,15 +110,29 @@ def initialize():
                         datefmt='%Y-%m-%d %H:%M:%S')
     # connect to database, this will create the db and tables if it doesn't exist
     dbmgr.pathCheck(logPath)
+    dbmgr.setStorageProfile(dbPath, storageProfile, storageOverrides, maintenanceInterval)
+    dexapi.setDecoder(jsonDecoder)
+    dexapi.configureHttp(**httpSettings)
+    dexapi.streamOrderBooks = streamOrderBooks
+    metrics.enabled = metricsEnabled
+    if metricsEnabled and metricsPort:
+        metrics.serve(metricsPort)
     dbmgr.initalizeDB(dbPath)
+    if rollupUSD:
+        rollups.priceSource = cm.defaultSource
+    # fill the rollups for candles stored before they existed
+    if dbmgr.freeQuery(dbPath, 'select count(*) as n from marketVolumes')['n'].iloc[0] == 0:
+        rollups.rebuildRollups(dbPath)
+    # and the statistics of the order books
+    bookstats.enabled = bookStats
+    if bookStats and dbmgr.freeQuery(dbPath, 'select count(*) as n from bookStats')['n'].iloc[0] == 0:
+        bookstats.backfill(dbPath)
     logger.info('Initialization Complete')
 
 
 def updateExchanges():
-    # insert/update records for exchange list
-    dbmgr.insertRecords(dbPath, 'exchanges', pd.DataFrame({'name':exchangeList}),{'name':'name'})
-    # read exchange data into a df
-    dfExchanges = dbmgr.readTable(dbPath,'exchanges')
+    # insert/update records for exchange list and read exchange data into a df
+    dfExchanges = collector.storeExchanges(dbPath, exchangeList)
     logger.info('process complete')
     return dfExchanges
 
@@ -44,35 +142,12 @@ def updateMarket(exchange):
     try:
         if exchange is None:
             raise Exception (f'exchange is None, exiting.')
-        # api call int o dataframe
-        markets = dexapi.getMarkets(exchange['name'])
-        if markets is None:
+        # api call int o dataframe, only parsed when the config changed since the last call
+        fetched = dexapi.getMarketsConditional(exchange['name'], collector.cachedValidators(dbPath, exchange['name']))
+        if fetched is None:
             raise Exception (f'markets is None, exiting.')
-        # add the exchange ID and the timestamp
-        markets['exchangeID'] = exchange['ID']
-        markets['exchangeName'] = exchange['name']
-        markets['LastUpdated'] = datetime.datetime.now()
-        # create the column dictionary
-        colDict = {'exchangeID':'exchangeID',
-                   'name':'name',
-                   'base':'base',
-                   'quote':'quote'}
-        # insert data into markets table, ignore if duplicate
-        dbmgr.insertRecords(dbPath, 'markets', markets, colDict)
-        # get the market IDs from the database
-        marketsTable = dbmgr.readTable(dbPath, 'markets').loc[lambda df: df['exchangeID']==exchange['ID'] ]
-        # get the IDs from the marketstable into the marketdata
-        markets = pd.merge(markets, marketsTable[['name','ID']], on='name',how='left').rename(columns={'ID':'marketID'})
-        colDict = {'marketID' : 'marketID',
-                   'epochlen':'epochlen',
-                   'lotsize':'lotsize',
-                   'parcelSize':'parcelSize',
-                   'ratestep':'ratestep',
-                   'baseConversionFactor': 'baseConversionFactor',
-                   'quoteConversionFactor': 'quoteConversionFactor',
-                   'LastUpdated': 'LastUpdated'}
-        # insert data into marketconfig, replace if necessary.
-        dbmgr.insertRecords(dbPath, 'marketConfig', markets, colDict,replace=True)
+        # store the markets and their config, this adds the market IDs
+        markets = collector.storeMarkets(dbPath, exchange, *fetched)
         output = markets
         logger.info(f'complete for {exchange["name"]}')
         return output
@@ -81,6 +156,13 @@ def updateMarket(exchange):
         return None
 
 
+def store(func, *args):
+    # runs a write through the writer when there is one, errors are logged by the writer
+    if writer is None:
+        return func(*args)
+    return writer.submit(func, *args)
+
+
 def updateBooks(markets):
     if markets is None:
         logger.error(f'markets is None, exiting.')
@@ -90,23 +172,13 @@ def updateBooks(markets):
         try:
             # api call int o dataframe
             books = dexapi.getOrderBook(market['exchangeName'],market['base'],market['quote'])
-            # add the market ID and the timestamp
-            books['marketID'] = market['marketID']
-            books['TimeStamp'] = datetime.datetime.now()
-            # create the column dictionary
-            colDict = {'marketID':'marketID',
-                       'TimeStamp':'TimeStamp',
-                       'side':'side',
-                       'rate':'rate',
-                       'qty':'qty'}
-            # insert data into order book table, ignore if duplicate
-            dbmgr.insertRecords(dbPath, 'books', books, colDict)
-            logger.info(f'complete for {market["exchangeName"]} {market["name"]}')
+            # store the snapshot
+            store(collector.storeBook, dbPath, market, books, datetime.datetime.now(), bookStorage, keyframeInterval)
             # pause to avoid too many request errors
             time.sleep(sleepTimer)
         except Exception as err:
+            # move on to the next market, transient http errors have already been retried
             logger.error(f' {err=}, {type(err)=}')
-            break
     logger.info(f'complete.')
     return True
 
@@ -118,38 +190,69 @@ def updateCandles(markets):
         return None
     for idx, market in markets.iterrows():
         try:
-            # api call int o dataframe
-            candleData = dexapi.getCandles(market['exchangeName'],market['base'],market['quote'])
-            # add the market ID and the timestamp
-            candleData['marketID'] = market['marketID']
-            # create the column dictionary
-            colDict = {'marketID':'marketID',
-                       'startStamps':'timeOpen',
-                       'endStamps': 'timeClose',
-                       'matchVolumes': 'baseVolume',
-                       'quoteVolumes': 'quoteVolume',
-                       'highRates':'high',
-                       'lowRates':'low',
-                       'startRates':'open',
-                       'endRates':'close'}
-            # insert data into order book table, ignore if duplicate
-            dbmgr.insertRecords(dbPath, 'candles', candleData, colDict, replace=True)
-            logger.info(f'complete for {market["exchangeName"]} {market["name"]}')
-            # pause to avoid too many request errors
-            time.sleep(sleepTimer)
+            for period in candlePeriods:
+                # api call int o dataframe, only reaching back to the candles already stored
+                count = collector.candleCount(dbPath, market['marketID'], period)
+                candleData = dexapi.getCandles(market['exchangeName'],market['base'],market['quote'],period,count)
+                # store the candles, the rollup prices are requested before the write
+                prices = rollups.candlePrices(dbPath, market, candleData) if period == rollups.sourcePeriod else None
+                store(collector.storeCandles, dbPath, market, candleData, period, prices)
+                # pause to avoid too many request errors
+                time.sleep(sleepTimer)
         except Exception as err:
+            # move on to the next market, transient http errors have already been retried
             logger.error(f' {err=}, {type(err)=}')
-            break
     return True
 
 
-if __name__ == '__main__':
+def collect():
+    # runs the collection in the configured mode, the daemon runs until SIGINT or SIGTERM
+    if daemonEnabled:
+        # archives once a day when enabled
+        archiveOptions = (archivePath, archiveRetainDays, archivePrune) if archiveEnabled else None
+        daemon.runDaemon(dbPath, exchangeList, archiveOptions=archiveOptions, maxConcurrent=maxConcurrent,
+                         requestRate=requestRate, candlePeriods=candlePeriods, bookStorage=bookStorage,
+                         keyframeInterval=keyframeInterval, metricsPath=metricsDumpPath if metricsEnabled else None,
+                         metricsInterval=metricsDumpInterval, **daemonSettings, **writerSettings)
+    elif collectorMode == 'process':
+        shards.runSharded(dbPath, exchangeList, processes=processes, marketShards=marketShards,
+                          maxConcurrent=maxConcurrent, requestRate=requestRate, candlePeriods=candlePeriods,
+                          bookStorage=bookStorage, keyframeInterval=keyframeInterval, **writerSettings)
+    elif collectorMode == 'async':
+        collector.runCycle(dbPath, exchangeList, maxConcurrent=maxConcurrent, requestRate=requestRate,
+                           candlePeriods=candlePeriods, bookStorage=bookStorage,
+                           keyframeInterval=keyframeInterval, **writerSettings)
+    else:
+        global writer
+        # the writer commits the books and candles of several markets at once while the next
+        # ones are fetched
+        writer = dbmgr.GroupWriter(dbPath, **writerSettings)
+        try:
+            exchanges = updateExchanges()
+            for index, row in exchanges.iterrows():
+                markets = updateMarket(row)
+                print(markets)
+                orderbooks = updateBooks(markets)
+                candles = updateCandles(markets)
+        finally:
+            writer.close()
+            writer = None
+
+
+def run():
+    # a collection run as configured, loadConfig has to be called first
     initialize()
     logger.info('Starting data collection...')
-    exchanges = updateExchanges()
-    for index, row in exchanges.iterrows():
-        markets = updateMarket(row)
-        print(markets)
-        orderbooks = updateBooks(markets)
-        candles = updateCandles(markets)
-    logger.info('Data collection completed.')
\ No newline at end of file
+    with metrics.profiled(profilePath, profiler):
+        collect()
+    if archiveEnabled and not daemonEnabled:
+        # export the days that closed since the last run
+        archive.archiveAll(dbPath, archivePath, archiveRetainDays, archivePrune)
+    if metricsEnabled and metricsDumpPath and not daemonEnabled:
+        metrics.dump(metricsDumpPath)
+    logger.info('Data collection completed.')
+
+
+if __name__ == '__main__':
+    loadConfig()
+    run()
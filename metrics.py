@@ -0,0 +1,251 @@
+# this module collects timing histograms and counters of the collector hot paths: http
+# requests, payload parsing and database writes. nothing is recorded unless enabled is set, the
+# instrumented code then only pays for a flag check. metrics are read as prometheus text from
+# render or the serve endpoint, or as json from snapshot and dump.
+import bisect
+import contextlib
+import cProfile
+import functools
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+# upper bounds in seconds of the timing histogram buckets
+buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# descriptions of the recorded metrics, shown in the prometheus output
+descriptions = {'dexdb_http_request_seconds': 'time to receive an api response, retries included',
+                'dexdb_http_responses_total': 'api responses by status',
+                'dexdb_http_bytes_total': 'decompressed api response bytes received',
+                'dexdb_http_retries_total': 'api requests retried after a timeout or status',
+                'dexdb_parse_seconds': 'time to parse an api payload into a frame',
+                'dexdb_insert_seconds': 'time to write a frame to the database',
+                'dexdb_rollup_seconds': 'time to update the volume rollups of new candles',
+                'dexdb_rows_written_total': 'rows written to the database',
+                'dexdb_commit_seconds': 'time to run and commit a group of writes',
+                'dexdb_commits_total': 'group commits of the background writer',
+                'dexdb_writer_wait_seconds': 'time a submitter waited for room in the full write queue',
+                'dexdb_query_cache_hits_total': 'query results served from the cache, by memory or file',
+                'dexdb_query_cache_misses_total': 'cacheable queries run against the database',
+                'dexdb_errors_total': 'errors raised by an instrumented call',
+                'dexdb_feed_notes_total': 'order book notes received from websocket feeds',
+                'dexdb_feed_resyncs_total': 'order books resynced from a snapshot after a sequence gap',
+                'dexdb_feed_reconnects_total': 'websocket feed reconnects'}
+# counter values and histograms ([bucket counts, count, sum]) per (name, labels)
+counters = {}
+histograms = {}
+lock = threading.Lock()
+
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+    key = (name, labelKey(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    key = (name, labelKey(labels))
+    index = bisect.bisect_left(buckets, seconds)
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(buckets) + 1), 0, 0.0]
+        histogram[0][index] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+
+
+class Timer:
+    # observes the time spent in a with block, an exception is counted as an error
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if excType is not None:
+            count('dexdb_errors_total', metric=self.name, **self.labels)
+        return False
+
+
+nullTimer = contextlib.nullcontext()
+
+
+def timer(name, **labels):
+    if not enabled:
+        return nullTimer
+    return Timer(name, labels)
+
+
+def timed(name, **labels):
+    # decorator timing every call of a function
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Timer(name, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def reset():
+    with lock:
+        counters.clear()
+        histograms.clear()
+
+
+def snapshot():
+    # the current metrics as a json serializable dict
+    with lock:
+        return {'time': time.time(),
+                'buckets': list(buckets),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in counters.items()],
+                'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(histogram[0]),
+                                'count': histogram[1], 'sum': histogram[2]}
+                               for (name, labels), histogram in histograms.items()]}
+
+
+def merge(data):
+    # adds a snapshot taken in another process, e.g. a collection worker
+    with lock:
+        for counter in data['counters']:
+            key = (counter['name'], labelKey(counter['labels']))
+            counters[key] = counters.get(key, 0) + counter['value']
+        for item in data['histograms']:
+            key = (item['name'], labelKey(item['labels']))
+            histogram = histograms.setdefault(key, [[0] * (len(buckets) + 1), 0, 0.0])
+            histogram[0] = [a + b for a, b in zip(histogram[0], item['buckets'])]
+            histogram[1] += item['count']
+            histogram[2] += item['sum']
+
+
+def formatLabels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+def render():
+    # the metrics in the prometheus text exposition format
+    with lock:
+        counterItems = sorted(counters.items())
+        histogramItems = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in histograms.items())
+    lines = []
+    described = set()
+    for (name, labels), value in counterItems:
+        if name not in described:
+            described.add(name)
+            lines += [f'# HELP {name} {descriptions.get(name, name)}', f'# TYPE {name} counter']
+        lines.append(f'{name}{formatLabels(labels)} {value}')
+    for (name, labels), (bucketCounts, total, seconds) in histogramItems:
+        if name not in described:
+            described.add(name)
+            lines += [f'# HELP {name} {descriptions.get(name, name)}', f'# TYPE {name} histogram']
+        cumulative = 0
+        for bound, bucketCount in zip(list(buckets) + ['+Inf'], bucketCounts):
+            cumulative += bucketCount
+            lines.append(f'{name}_bucket{formatLabels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{formatLabels(labels)} {seconds}')
+        lines.append(f'{name}_count{formatLabels(labels)} {total}')
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path):
+    # writes the snapshot as json, replacing the previous dump in one step
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(snapshot(), file)
+    os.replace(path + '.tmp', path)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, contentType = render().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, contentType = json.dumps(snapshot()).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    # serves /metrics (prometheus text) and /metrics.json from a background thread, port 0
+    # picks a free port. returns the server, shutdown() stops it
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'serving metrics on {host}:{server.server_address[1]}')
+    return server
+
+
+# this context manager profiles its block when path is set, the path is formatted with
+# time.strftime so every cycle gets its own file. cprofile writes pstats files, pyinstrument
+# an html report
+@contextlib.contextmanager
+def profiled(path=None, profiler='cprofile'):
+    if not path:
+        yield
+        return
+    path = time.strftime(path)
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if profiler == 'pyinstrument':
+        if pyinstrument is None:
+            raise Exception('pyinstrument is not installed')
+        session = pyinstrument.Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(path, 'w') as file:
+                file.write(session.output_html())
+    elif profiler == 'cprofile':
+        session = cProfile.Profile()
+        session.enable()
+        try:
+            yield
+        finally:
+            session.disable()
+            session.dump_stats(path)
+    else:
+        raise Exception(f'unknown profiler {profiler}')
+    logger.info(f'profile written to {path}')
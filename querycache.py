@@ -0,0 +1,203 @@
+# this module caches the results of dashboard queries. a result is keyed on the database, the
+# normalized query text and its parameters, and is stored with the write counters of the tables
+# the query reads (see dbmgr.tableWritten). it is served as long as none of those tables has been
+# written since, by this process or any other, so a repeated read costs a lookup of the counters
+# instead of the query and its timestamp parsing. results are evicted least recently used once
+# they take more than maxBytes, and are optionally persisted as feather files in persistPath so a
+# new process starts with the results of the last one.
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import pandas as pd
+import dbmgr
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# serve cached results, the memory the cached frames may take and the folder they are persisted
+# to, None keeps them in memory only
+enabled = True
+maxBytes = 256 * 1024 * 1024
+persistPath = None
+# rows of the object columns measured to estimate the memory of a frame
+sampleRows = 1000
+# pyarrow and pyarrow.feather, imported when a result is first persisted
+pa = None
+feather = None
+
+# string literals are kept as they are, the rest of a query is normalized
+literalPattern = re.compile(r"('(?:[^']|'')*')")
+tablePattern = re.compile(r'\b(?:from|join)\s+([a-z_][a-z0-9_]*)')
+
+# (stamp, frame, bytes) per key, least recently used first
+results = collections.OrderedDict()
+resultsBytes = 0
+lock = threading.Lock()
+
+
+def checkFeather():
+    global pa, feather
+    if feather is None:
+        try:
+            import pyarrow
+            import pyarrow.feather
+        except ImportError:
+            raise Exception('pyarrow is required to persist the query cache')
+        pa, feather = pyarrow, pyarrow.feather
+
+
+def normalize(queryStr):
+    # lower case with single spaces outside string literals, sqlite keywords and names are case
+    # insensitive
+    parts = literalPattern.split(queryStr.strip().rstrip(';'))
+    return ''.join(part if number % 2 else re.sub(r'\s+', ' ', part.lower())
+                   for number, part in enumerate(parts)).strip()
+
+
+def queryTables(normalized):
+    # the tables a normalized query reads from or joins
+    return sorted(set(tablePattern.findall(normalized)))
+
+
+def makeKey(path, normalized, params, parseDates):
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    return json.dumps([os.path.abspath(path), normalized, list(params or []), parseDates], default=str, sort_keys=True)
+
+
+def tableVersions(conn, tables):
+    # the database id and the write counters of tables, tables never written count as 0. None
+    # for a database migrated before the counters existed
+    try:
+        rows = conn.execute(f'SELECT lower(tableName), version FROM tableVersions '
+                            f'WHERE tableName = \'*\' OR lower(tableName) IN ( {", ".join("?" * len(tables))} )',
+                            tables).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    versions = dict(rows)
+    return [['*', versions.get('*')]] + [[table, versions.get(table, 0)] for table in tables]
+
+
+def fileName(key):
+    return os.path.join(persistPath, hashlib.sha1(key.encode()).hexdigest() + '.feather')
+
+
+def frameBytes(frame):
+    # the memory of a frame, the strings of object columns are measured on a sample of rows as
+    # measuring every one costs about as much as the query
+    size = frame.memory_usage().sum()
+    objects = frame.select_dtypes('object').head(sampleRows)
+    if len(objects):
+        strings = objects.memory_usage(index=False, deep=True).sum() - objects.memory_usage(index=False).sum()
+        size += strings * len(frame) / len(objects)
+    return int(size)
+
+
+def lookup(key, stamp):
+    # the cached frame of key if it was stored with stamp, from memory or the persisted file
+    with lock:
+        entry = results.get(key)
+        if entry is not None and entry[0] == stamp:
+            results.move_to_end(key)
+            metrics.count('dexdb_query_cache_hits_total', source='memory')
+            return entry[1]
+    if persistPath is None:
+        return None
+    frame = load(key, stamp)
+    if frame is not None:
+        store(key, stamp, frame, persist=False)
+        metrics.count('dexdb_query_cache_hits_total', source='file')
+    return frame
+
+
+def store(key, stamp, frame, persist=True):
+    global resultsBytes
+    size = frameBytes(frame)
+    if size > maxBytes:
+        return
+    with lock:
+        entry = results.pop(key, None)
+        if entry is not None:
+            resultsBytes -= entry[2]
+        results[key] = (stamp, frame, size)
+        resultsBytes += size
+        while resultsBytes > maxBytes:
+            resultsBytes -= results.popitem(last=False)[1][2]
+    if persist and persistPath is not None:
+        save(key, stamp, frame)
+
+
+def save(key, stamp, frame):
+    # a result that can't be written as feather is only kept in memory
+    try:
+        checkFeather()
+        os.makedirs(persistPath, exist_ok=True)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'querycache'] = json.dumps({'key': key, 'stamp': stamp}).encode()
+        name = fileName(key)
+        # readers never see a partly written file
+        feather.write_feather(table.replace_schema_metadata(metadata), name + '.tmp')
+        os.replace(name + '.tmp', name)
+    except Exception as err:
+        logger.warning(f'{err=}, {type(err)=}')
+
+
+def load(key, stamp):
+    name = fileName(key)
+    if not os.path.exists(name):
+        return None
+    try:
+        checkFeather()
+        table = feather.read_table(name)
+        saved = json.loads(table.schema.metadata[b'querycache'])
+        if saved['key'] != key or saved['stamp'] != stamp:
+            return None
+        return table.to_pandas()
+    except Exception as err:
+        logger.warning(f'{err=}, {type(err)=}')
+        return None
+
+
+# this function runs a read query as dbmgr.freeQuery does, through the cache. parseDates is the
+# parse_dates argument of pd.read_sql_query, so the cached frame holds parsed timestamps. the
+# frame returned is a copy the caller may change. queries whose tables can't be told from their
+# text, and reads inside a write whose rows aren't committed yet, bypass the cache
+def query(path, queryStr, params=None, parseDates=None):
+    session = dbmgr.getSession(path)
+    normalized = normalize(queryStr)
+    tables = queryTables(normalized)
+    try:
+        bypass = not enabled or not tables or session.writeOwner == threading.get_ident()
+        with session.read() as conn:
+            # the counters are read before the query, a write in between only costs a miss
+            stamp = None if bypass else tableVersions(conn, tables)
+            if stamp is None:
+                return pd.read_sql_query(queryStr, conn, params=params, parse_dates=parseDates)
+            key = makeKey(path, normalized, params, parseDates)
+            frame = lookup(key, stamp)
+            if frame is None:
+                metrics.count('dexdb_query_cache_misses_total')
+                frame = pd.read_sql_query(queryStr, conn, params=params, parse_dates=parseDates)
+                store(key, stamp, frame)
+        return frame.copy()
+    except Exception as err:
+        logger.error(f'{err=}, {type(err)=}')
+        raise
+
+
+# this function drops the cached results, and their files when they are persisted
+def clear():
+    global resultsBytes
+    with lock:
+        results.clear()
+        resultsBytes = 0
+    if persistPath is not None and os.path.isdir(persistPath):
+        for name in os.listdir(persistPath):
+            if name.endswith('.feather'):
+                os.remove(os.path.join(persistPath, name))
@@ -0,0 +1,252 @@
+# this module maintains volume rollups of the 24h candles: daily (1d), weekly (1w) and monthly
+# (1mo) totals per market in marketVolumes and per exchange and quote asset in exchangeVolumes.
+# storeCandles updates them as candles arrive, only the periods touched by the new candles are
+# recomputed, so reading volumes costs a few rows per period however long the history gets. the
+# exchange totals of the touched periods are recomputed once per commit, for every market written
+# in it, see dbmgr.beforeCommit.
+import logging
+import threading
+import pandas as pd
+import cm
+import dbmgr
+
+logger = logging.getLogger(__name__)
+
+# candle series the rollups are built from
+sourcePeriod = '24h'
+granularities = ['1d', '1w', '1mo']
+# price source for the USD columns (see cm.getMetric), None leaves them null
+priceSource = None
+
+marketVolumeCols = {'marketID': 'marketID',
+                    'granularity': 'granularity',
+                    'periodStart': 'periodStart',
+                    'baseVolume': 'baseVolume',
+                    'quoteVolume': 'quoteVolume',
+                    'baseVolumeUSD': 'baseVolumeUSD',
+                    'quoteVolumeUSD': 'quoteVolumeUSD',
+                    'candles': 'candles'}
+
+# (exchangeID, granularity, periodStart) of the exchange periods whose markets were updated per
+# path, totalled by updateExchanges when the write commits
+touchedPeriods = {}
+touchedLock = threading.Lock()
+
+
+# this function returns the start of the period each date falls in
+def periodStart(dates, granularity):
+    days = pd.to_datetime(dates, format='ISO8601').dt.normalize()
+    if granularity == '1w':
+        # weeks start on monday
+        return days - pd.to_timedelta(days.dt.weekday, unit='D')
+    if granularity == '1mo':
+        return days - pd.to_timedelta(days.dt.day - 1, unit='D')
+    if granularity == '1d':
+        return days
+    raise Exception(f'unknown granularity {granularity}')
+
+
+def periodStarts(since):
+    # the start of the period since falls in per granularity
+    since = pd.Series([pd.Timestamp(since)])
+    return {granularity: periodStart(since, granularity).iloc[0] for granularity in granularities}
+
+
+def readCandles(path, marketIDs, since):
+    # 24h candles of the markets from since onwards with volumes in conventional units
+    queryStr = f"""
+        select c.marketID,
+        m.exchangeID,
+        c.timeOpen,
+        cast(c.baseVolume as float) / mc.baseConversionFactor as baseVolume,
+        cast(c.quoteVolume as float) / mc.quoteConversionFactor as quoteVolume,
+        m.base,
+        m.quote
+        FROM candles c
+        join markets m on c.marketID = m.ID
+        join marketConfig mc on m.ID = mc.marketID
+        where c.period = ? and c.timeOpen >= ? and c.marketID in ({', '.join('?' * len(marketIDs))})
+        """
+    return dbmgr.freeQuery(path, queryStr, (sourcePeriod, since, *marketIDs))
+
+
+# this function requests the prices updateRollups needs for new candles of a market from the
+# price source, so callers can do it before the write instead of holding the writer while the
+# source answers. None without a source
+def candlePrices(path, market, candleData, source=None):
+    if source is None:
+        source = priceSource
+    if source is None or candleData is None or len(candleData) == 0:
+        return None
+    since = min(periodStarts(candleData['startStamps'].min()).values())
+    assets = sorted({market['base'].split('.')[0], market['quote'].split('.')[0]})
+    prices = cm.getMetric(assets, 'PriceUSD', since, candleData['startStamps'].max(), path, source)
+    # the rollups stay unpriced rather than requesting the prices again in the write
+    return pd.DataFrame() if prices is None else prices
+
+
+# this function prices the candle volumes in USD, they stay null without a source or a price.
+# prices are those of candlePrices, they are requested from the source when None
+def addUSD(path, candles, source, prices=None):
+    candles['baseVolumeUSD'] = float('nan')
+    candles['quoteVolumeUSD'] = float('nan')
+    if (source is None and prices is None) or len(candles) == 0:
+        return candles
+    # asset symbols without their network suffix (e.g. usdc.eth)
+    base = candles['base'].str.split('.').str[0]
+    quote = candles['quote'].str.split('.').str[0]
+    dates = pd.to_datetime(candles['timeOpen'], utc=True, format='ISO8601')
+    if prices is None:
+        prices = cm.getMetric(sorted(set(base).union(quote)), 'PriceUSD', dates.min(), dates.max(), path, source)
+    if prices is None or len(prices) == 0:
+        logger.warning(f'no prices for the USD volumes')
+        return candles
+    candles['baseVolumeUSD'] = candles['baseVolume'] * cm.lookupPrices(dates, base.to_numpy(), prices)
+    candles['quoteVolumeUSD'] = candles['quoteVolume'] * cm.lookupPrices(dates, quote.to_numpy(), prices)
+    return candles
+
+
+# this function recomputes the rollups of every period holding candles of the markets from
+# since onwards, since is a date or timestamp, source the price source for the USD columns and
+# prices those of candlePrices
+def updateRollups(path, marketIDs, since, source=None, prices=None):
+    if source is None:
+        source = priceSource
+    marketIDs = [int(marketID) for marketID in marketIDs]
+    starts = periodStarts(since)
+    candles = readCandles(path, marketIDs, min(starts.values()).strftime('%Y-%m-%d'))
+    if len(candles) == 0:
+        return 0
+    candles = addUSD(path, candles, source, prices)
+    candles['baseUnpriced'] = candles['baseVolumeUSD'].isna()
+    candles['quoteUnpriced'] = candles['quoteVolumeUSD'].isna()
+    rows = []
+    for granularity in granularities:
+        periods = periodStart(candles['timeOpen'], granularity)
+        touched = candles.loc[periods >= starts[granularity]].assign(periodStart=periods)
+        volumes = touched.groupby(['marketID', 'exchangeID', 'periodStart']).agg(
+            baseVolume=('baseVolume', 'sum'),
+            quoteVolume=('quoteVolume', 'sum'),
+            baseVolumeUSD=('baseVolumeUSD', 'sum'),
+            quoteVolumeUSD=('quoteVolumeUSD', 'sum'),
+            baseUnpriced=('baseUnpriced', 'sum'),
+            quoteUnpriced=('quoteUnpriced', 'sum'),
+            candles=('timeOpen', 'size')).reset_index()
+        # a period is only priced when all its candles are
+        volumes.loc[volumes['baseUnpriced'] > 0, 'baseVolumeUSD'] = float('nan')
+        volumes.loc[volumes['quoteUnpriced'] > 0, 'quoteVolumeUSD'] = float('nan')
+        volumes['granularity'] = granularity
+        volumes['periodStart'] = volumes['periodStart'].dt.strftime('%Y-%m-%d')
+        rows.append(volumes)
+    rows = pd.concat(rows, ignore_index=True)
+    with dbmgr.getSession(path).write():
+        dbmgr.insertRecords(path, 'marketVolumes', rows, marketVolumeCols, replace=True)
+        with touchedLock:
+            touchedPeriods.setdefault(path, set()).update(
+                zip(rows['exchangeID'].astype(int), rows['granularity'], rows['periodStart']))
+        dbmgr.beforeCommit(path, 'exchangeVolumes', lambda: updateExchanges(path))
+    logger.debug(f'{len(rows)} rollup rows updated for markets {marketIDs}')
+    return len(rows)
+
+
+def updateExchanges(path):
+    # totals the market rollups of the touched exchange periods per quote asset, an exchange
+    # period is only priced when all its markets are
+    with touchedLock:
+        touched = touchedPeriods.pop(path, set())
+    periods = {}
+    for exchangeID, granularity, start in touched:
+        periods.setdefault((exchangeID, granularity), []).append(start)
+    try:
+        with dbmgr.getSession(path).write() as conn:
+            for (exchangeID, granularity), starts in sorted(periods.items()):
+                conn.execute(f"""
+                    INSERT INTO exchangeVolumes ( exchangeID, quote, granularity, periodStart, quoteVolume,
+                    baseVolumeUSD, quoteVolumeUSD, markets )
+                    SELECT m.exchangeID, m.quote, v.granularity, v.periodStart, sum(v.quoteVolume),
+                    case when count(v.baseVolumeUSD) = count(*) then sum(v.baseVolumeUSD) end,
+                    case when count(v.quoteVolumeUSD) = count(*) then sum(v.quoteVolumeUSD) end,
+                    count(*)
+                    FROM marketVolumes v
+                    join markets m on v.marketID = m.ID
+                    where m.exchangeID = ? and v.granularity = ? and v.periodStart in ({', '.join('?' * len(starts))})
+                    group by m.exchangeID, m.quote, v.granularity, v.periodStart
+                    ON CONFLICT ( exchangeID, quote, granularity, periodStart ) DO UPDATE SET
+                    quoteVolume = excluded.quoteVolume, baseVolumeUSD = excluded.baseVolumeUSD,
+                    quoteVolumeUSD = excluded.quoteVolumeUSD, markets = excluded.markets
+                    """, (exchangeID, granularity, *sorted(starts)))
+            dbmgr.tableWritten(conn, 'exchangeVolumes')
+    except Exception:
+        # totalled again with the next commit
+        with touchedLock:
+            touchedPeriods.setdefault(path, set()).update(touched)
+        raise
+
+
+# this function rebuilds the rollups of every market from since (all history by default), e.g.
+# to fill them for candles stored before they existed or to price them once a source is set
+def rebuildRollups(path, since=None, source=None):
+    data = dbmgr.freeQuery(path, 'select marketID, min(timeOpen) as timeOpen from candles '
+                                 'where period = ? group by marketID', (sourcePeriod,))
+    if len(data) == 0:
+        return 0
+    if since is None:
+        since = pd.to_datetime(data['timeOpen'], format='ISO8601').min()
+    return updateRollups(path, data['marketID'].tolist(), since, source)
+
+
+# this function reads rollups, level is market or exchange and granularity 1d, 1w or 1mo.
+# start and end filter on the period start and exchange/market on their names
+def getVolumes(path, granularity='1d', level='market', start=None, end=None, exchange=None, market=None):
+    if level == 'market':
+        queryStr = """
+        select e.name as exchange,
+        m.name as market,
+        m.base as baseAsset,
+        m.quote as quoteAsset,
+        v.periodStart,
+        v.baseVolume,
+        v.quoteVolume,
+        v.baseVolumeUSD,
+        v.quoteVolumeUSD,
+        v.candles
+        FROM marketVolumes v
+        join markets m on v.marketID = m.ID
+        join exchanges e on m.exchangeID = e.ID
+        where v.granularity = ?
+        """
+    elif level == 'exchange':
+        queryStr = """
+        select e.name as exchange,
+        v.quote as quoteAsset,
+        v.periodStart,
+        v.quoteVolume,
+        v.baseVolumeUSD,
+        v.quoteVolumeUSD,
+        v.markets
+        FROM exchangeVolumes v
+        join exchanges e on v.exchangeID = e.ID
+        where v.granularity = ?
+        """
+    else:
+        raise Exception(f'unknown rollup level {level}')
+    params = [granularity]
+    if start is not None:
+        queryStr += ' and v.periodStart >= ?'
+        params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+    if end is not None:
+        queryStr += ' and v.periodStart <= ?'
+        params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+    if exchange is not None:
+        queryStr += ' and e.name = ?'
+        params.append(exchange)
+    if market is not None and level == 'market':
+        queryStr += ' and m.name = ?'
+        params.append(market)
+    queryStr += ' order by v.periodStart, exchange' + (', market' if level == 'market' else ', quoteAsset')
+    output = dbmgr.freeQuery(path, queryStr, params)
+    output['periodStart'] = pd.to_datetime(output['periodStart'], utc=True, format='%Y-%m-%d')
+    # unpriced volumes read back as None
+    for col in ['baseVolumeUSD', 'quoteVolumeUSD']:
+        output[col] = output[col].astype(float)
+    return output
@@ -0,0 +1,252 @@
+# this module runs a collection cycle across worker processes, exchanges (and optionally the
+# markets of an exchange) are split into shards and every shard is collected by its own
+# process, so a slow or failing host only holds up its own shard. workers never write to the
+# database, they send the parsed frames over a queue to the parent process which stores them
+# through a dbmgr.GroupWriter as the single sqlite writer.
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import queue as queueModule
+import threading
+import time
+import collector
+import dbmgr
+import dexapi
+import metrics
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# frames waiting in the queue before workers block, this bounds the memory of a slow writer
+queueSize = 64
+
+
+def makeShards(exchanges, processes, marketShards=1):
+    # splits the (exchange, market shard index, market shard count) tasks round robin over at
+    # most processes shards
+    tasks = [(exchange, index, marketShards) for exchange in exchanges for index in range(marketShards)]
+    shards = [[] for number in range(min(processes, len(tasks)))]
+    for number, task in enumerate(tasks):
+        shards[number % len(shards)].append(task)
+    return shards
+
+
+async def collectTask(worker, queue, exchange, index, count):
+    # collects one market shard of an exchange, the first shard also sends the markets
+    host = exchange['name']
+    try:
+        markets = await worker.fetch(host, dexapi.getMarkets, host)
+        if markets is None:
+            raise Exception(f'markets is None, exiting.')
+        if index == 0:
+            queue.put(('markets', exchange, markets))
+        selected = [market for idx, market in markets.iloc[index::count].iterrows()]
+        # IDs of the markets stored by earlier cycles, candle high water marks are read with them
+        stored = dbmgr.readTable(worker.dbPath, 'markets', ['ID', 'name'], filters={'exchangeID': exchange['ID']})
+        marketIDs = dict(zip(stored['name'], stored['ID']))
+
+        async def book(market):
+            books = await worker.fetch(host, dexapi.getOrderBook, host, market['base'], market['quote'])
+            if books is None:
+                raise Exception(f'no order book for {host} {market["name"]}')
+            queue.put(('book', host, market['name'], books, datetime.datetime.now()))
+
+        async def candles(market, period):
+            # workers only read from the database
+            marketID = marketIDs.get(market['name'])
+            count = None if marketID is None else collector.candleCount(worker.dbPath, marketID, period)
+            candleData = await worker.fetch(host, dexapi.getCandles, host, market['base'], market['quote'], period, count)
+            if candleData is None:
+                raise Exception(f'no {period} candles for {host} {market["name"]}')
+            queue.put(('candles', host, market['name'], candleData, period))
+
+        jobs = [book(market) for market in selected]
+        jobs += [candles(market, period) for market in selected for period in worker.candlePeriods]
+        for result in await asyncio.gather(*jobs, return_exceptions=True):
+            if isinstance(result, Exception):
+                queue.put(('error', host, f'{result=}'))
+    except Exception as err:
+        queue.put(('error', host, f'{err=}, {type(err)=}'))
+        if index == 0:
+            queue.put(('failed', host))
+
+
+async def collectShard(queue, dbPath, shard, options):
+    worker = collector.Collector(dbPath, **options)
+    # the writer of the collector stays idle, frames go to the queue instead
+    worker.start(len(shard))
+    try:
+        await asyncio.gather(*[collectTask(worker, queue, *task) for task in shard])
+    finally:
+        await worker.stop()
+
+
+def apiSettings():
+    # the dexapi settings of this process, handed to the workers
+    return {'http': dict(dexapi.httpSettings), 'decoder': dexapi.decoderName,
+            'streamOrderBooks': dexapi.streamOrderBooks, 'metrics': metrics.enabled}
+
+
+def runShard(queue, number, dbPath, shard, options, settings):
+    # worker process entry point, the dexapi settings of the parent are applied again as
+    # spawned processes start from a fresh interpreter
+    dexapi.configureHttp(**settings['http'])
+    dexapi.setDecoder(settings['decoder'])
+    dexapi.streamOrderBooks = settings['streamOrderBooks']
+    metrics.enabled = settings['metrics']
+    try:
+        asyncio.run(collectShard(queue, dbPath, shard, options))
+    finally:
+        dexapi.closeSessions()
+        # workers only read, their sessions are closed here without the optimize of the atexit
+        # close so the parent stays the only writer
+        dbmgr.closeSessions(optimize=False)
+        # the request and parse metrics of the worker are added to those of the parent
+        if metrics.enabled:
+            queue.put(('metrics', metrics.snapshot()))
+        queue.put(('done', number))
+
+
+class ShardWriter:
+    # stores the frames the workers send, books and candles of markets that arrive before the
+    # markets of their exchange are held back until those are stored. with a group writer the
+    # frames are committed in the background while the queue is drained
+    def __init__(self, dbPath, bookStorage='levels', keyframeInterval=60, groupWriter=None):
+        self.dbPath = dbPath
+        self.bookStorage = bookStorage
+        self.keyframeInterval = keyframeInterval
+        self.groupWriter = groupWriter
+        self.markets = {}
+        self.pending = {}
+        self.failed = set()
+        self.errors = {}
+        # errors of the group writer are counted from its thread
+        self.errorsLock = threading.Lock()
+        self.done = set()
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == 'done':
+            self.done.add(message[1])
+        elif kind == 'metrics':
+            metrics.merge(message[1])
+        elif kind == 'error':
+            self.countError(message[1])
+            logger.error(f'{message[2]} for {message[1]}')
+        elif kind == 'failed':
+            self.failed.add(message[1])
+            self.pending.pop(message[1], None)
+        elif kind == 'markets':
+            exchange = message[1]
+            # the frames of the exchange need the market IDs, these are stored right away
+            markets = self.write(collector.storeMarkets, self.dbPath, exchange, message[2]).result()
+            self.markets[exchange['name']] = markets.set_index('name', drop=False)
+            for pending in self.pending.pop(exchange['name'], []):
+                self.store(pending)
+        elif message[1] not in self.markets:
+            self.pending.setdefault(message[1], []).append(message)
+        else:
+            self.store(message)
+
+    def store(self, message):
+        kind, host, name, frame, extra = message
+        market = self.markets[host].loc[name]
+        if kind == 'book':
+            future = self.write(collector.storeBook, self.dbPath, market, frame, extra, self.bookStorage,
+                                self.keyframeInterval)
+        else:
+            # prices are requested before the job is queued, the writer never waits for the source
+            prices = rollups.candlePrices(self.dbPath, market, frame) if extra == rollups.sourcePeriod else None
+            future = self.write(collector.storeCandles, self.dbPath, market, frame, extra, prices)
+        # the writer has logged the error, it is counted for the host
+        future.add_done_callback(lambda future: future.exception() and self.countError(host))
+
+    def write(self, func, *args):
+        # a future of func(*args), run through the group writer or right away without one
+        if self.groupWriter is not None:
+            return self.groupWriter.submit(func, *args)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as err:
+            logger.error(f'{err=}, {type(err)=}')
+            future.set_exception(err)
+        return future
+
+    def countError(self, host):
+        with self.errorsLock:
+            self.errors[host] = self.errors.get(host, 0) + 1
+
+
+# this function runs one collection cycle over processes worker processes, marketShards splits
+# every exchange further so its markets are collected by several processes. options are passed
+# to the Collector of every worker, its writer settings also configure the group writer of the
+# parent. workers still running after timeout seconds are terminated.
+# returns the stored markets per exchange, None for exchanges whose config couldn't be collected
+def runSharded(dbPath, exchangeList, processes=4, marketShards=1, timeout=None, **options):
+    exchanges = collector.storeExchanges(dbPath, exchangeList)
+    exchanges = exchanges.loc[exchanges['name'].isin(exchangeList)]
+    exchanges = sorted(({'ID': int(exchange['ID']), 'name': exchange['name']} for idx, exchange in exchanges.iterrows()),
+                       key=lambda exchange: exchangeList.index(exchange['name']))
+    shards = makeShards(exchanges, processes, marketShards)
+    groupWriter = dbmgr.GroupWriter(dbPath, options.get('queueSize'), options.get('groupSize'), options.get('groupDelay'))
+    writer = ShardWriter(dbPath, options.get('bookStorage', 'levels'), options.get('keyframeInterval', 60), groupWriter)
+    # spawned workers don't inherit the database connections and http sessions of this process
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue(queueSize)
+    workers = [context.Process(target=runShard, name=f'shard-{number}',
+                               args=(queue, number, dbPath, shard, options, apiSettings()))
+               for number, shard in enumerate(shards)]
+    for worker in workers:
+        worker.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def handle(message):
+        try:
+            writer.handle(message)
+        except Exception as err:
+            # a frame that can't be stored doesn't stop the others
+            logger.error(f'{err=}, {type(err)=}')
+            writer.countError(message[1])
+
+    try:
+        while True:
+            try:
+                message = queue.get(timeout=0.2)
+            except queueModule.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    # frames are flushed to the queue before a worker exits, those sent just
+                    # before the last one exited are read before the shards are checked
+                    while True:
+                        try:
+                            message = queue.get_nowait()
+                        except queueModule.Empty:
+                            break
+                        handle(message)
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    for worker in workers:
+                        if worker.is_alive():
+                            logger.error(f'{worker.name} timed out, terminating')
+                            worker.terminate()
+                continue
+            handle(message)
+    finally:
+        for worker in workers:
+            worker.join()
+        queue.close()
+        # every frame is committed before the results are read
+        groupWriter.close()
+    # shards that ended without reporting crashed or were terminated
+    for number, shard in enumerate(shards):
+        if number not in writer.done:
+            logger.error(f'shard-{number} exited with code {workers[number].exitcode}')
+            for exchange, index, count in shard:
+                if index == 0 and exchange['name'] not in writer.markets:
+                    writer.failed.add(exchange['name'])
+    for host, messages in writer.pending.items():
+        logger.error(f'{len(messages)} frames for {host} dropped without its markets')
+    return [writer.markets[exchange['name']].reset_index(drop=True) if exchange['name'] in writer.markets else None
+            for exchange in exchanges]
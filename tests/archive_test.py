@@ -0,0 +1,71 @@
+import pytest
+import os
+import archive
+import collector
+import dbmgr
+import dexapi
+import mockdex
+import pandas as pd
+from helpers import countRows
+
+
+@pytest.fixture
+def dbPath(dbPath):
+    # two markets with 4 days of books every 6 hours and 40 days of candles
+    exchanges = collector.storeExchanges(dbPath, ['http://127.0.0.1:8080'])
+    markets = collector.storeMarkets(dbPath, exchanges.iloc[0], dexapi.parseMarkets(mockdex.makeConfig(2)))
+    for idx, market in markets.iterrows():
+        for stamp in pd.date_range('2024-01-01', periods=16, freq='6h'):
+            books = pd.DataFrame({'rate': [1, 2], 'qty': [10, 20], 'side': ['buy', 'sell']})
+            collector.storeBook(dbPath, market, books, stamp)
+        startStamps = pd.date_range('2023-12-01', periods=40, freq='D')
+        candles = pd.DataFrame({'startStamps': startStamps, 'endStamps': startStamps + pd.Timedelta(days=1),
+                                'matchVolumes': 1, 'quoteVolumes': 2, 'highRates': 3, 'lowRates': 1,
+                                'startRates': 1, 'endRates': 2})
+        collector.storeCandles(dbPath, market, candles)
+    yield dbPath
+
+
+# archived days read back the same from parquet as they did from sqlite, with or without pruning
+@pytest.mark.parametrize("prune", [False, True])
+def test_exportTable(dbPath, tmp_path, prune):
+    root = str(tmp_path / 'archive')
+    before = archive.readTable(dbPath, root, 'books')
+    assert archive.exportTable(dbPath, root, 'books', '2024-01-03', chunkSize=7) == 2 * 8 * 2
+    assert archive.archivedUntil(dbPath, 'books') == '2024-01-03'
+    days = sorted(os.listdir(os.path.join(root, 'books', os.listdir(os.path.join(root, 'books'))[0], 'market=asset0_btc')))
+    assert days == ['day=2024-01-01', 'day=2024-01-02']
+    if prune:
+        assert archive.pruneTable(dbPath, 'books') == 2 * 8 * 2
+        assert countRows(dbPath, 'books') == 2 * 8 * 2
+    pd.testing.assert_frame_equal(archive.readTable(dbPath, root, 'books'), before, check_dtype=False)
+    # a window across the hot/cold boundary with projection and a market filter
+    window = archive.readTable(dbPath, root, 'books', '2024-01-02 12:00:00', '2024-01-03 06:00:00',
+                               marketIDs=[2], columns=['TimeStamp', 'qty'])
+    assert list(window.columns) == ['TimeStamp', 'qty']
+    assert list(window['TimeStamp'].unique()) == list(pd.date_range('2024-01-02 12:00:00', periods=4, freq='6h'))
+    # nothing left to export up to the same day, the next days follow on
+    assert archive.exportTable(dbPath, root, 'books', '2024-01-03') == 0
+    assert archive.exportTable(dbPath, root, 'books', '2024-01-04') == 2 * 4 * 2
+    pd.testing.assert_frame_equal(archive.readTable(dbPath, root, 'books'), before, check_dtype=False)
+
+
+# an export interrupted before its day was recorded replaces the files it wrote
+def test_exportTable_rerun(dbPath, tmp_path):
+    root = str(tmp_path / 'archive')
+    archive.exportTable(dbPath, root, 'books', '2024-01-02')
+    dbmgr.getSession(dbPath).writer.execute('delete from archives')
+    dbmgr.getSession(dbPath).writer.commit()
+    archive.exportTable(dbPath, root, 'books', '2024-01-02')
+    assert len(archive.readTable(dbPath, root, 'books', end='2024-01-01 23:59:59')) == 2 * 4 * 2
+
+
+# candles are only pruned before the rollup periods of the archived day
+def test_pruneTable_candles(dbPath, tmp_path):
+    root = str(tmp_path / 'archive')
+    archive.exportTable(dbPath, root, 'candles', '2024-01-05')
+    archive.pruneTable(dbPath, 'candles')
+    # january 2024 starts on a monday
+    oldest = dbmgr.freeQuery(dbPath, 'select min(timeOpen) as t from candles')['t'].iloc[0]
+    assert oldest == '2024-01-01 00:00:00'
+    assert len(archive.readTable(dbPath, root, 'candles')) == 2 * 40
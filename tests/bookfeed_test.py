@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+import bookfeed
+import collector
+import daemon
+import dbmgr
+import dexapi
+import mockdex
+from benchmarks import record
+from mockdex import MockDex
+
+
+def addFeeds(dex, notes, seed=2):
+    rng = random.Random(seed)
+    for key in sorted(dex.books):
+        dex.feeds[key] = mockdex.makeFeed(rng, dex.books[key], notes, interval=0.01)
+
+
+def waitFor(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def storedBook(path, marketID):
+    # the levels of the latest stored snapshot of a market
+    data = dbmgr.freeQuery(path, f'select rate, qty, side from books where marketID = {marketID} '
+                                 f'and TimeStamp = (select max(TimeStamp) from books where marketID = {marketID}) '
+                                 f'order by rate')
+    return data.astype({'rate': 'int64', 'qty': 'int64'})
+
+
+def assertStored(path, dex):
+    markets = dbmgr.freeQuery(path, 'select ID, name from markets')
+    for row in markets.itertuples():
+        expected = dexapi.parseOrderBook(dex.books[tuple(row.name.split('_'))])
+        assert storedBook(path, row.ID).reset_index(drop=True).equals(expected.reset_index(drop=True))
+
+
+# notes are applied in sequence, notes already in the snapshot are skipped and a missing one
+# is reported
+def test_orderBook():
+    book = bookfeed.OrderBook()
+    book.load({'seq': 5, 'orders': [{'oid': 'a', 'side': 1, 'rate': 100, 'qty': 10},
+                                    {'oid': 'b', 'side': 2, 'rate': 110, 'qty': 5}]})
+    assert book.apply('book_order', {'seq': 4, 'oid': 'c', 'side': 1, 'rate': 90, 'qty': 1})
+    assert 'c' not in book.orders
+    assert book.apply('book_order', {'seq': 6, 'oid': 'c', 'side': 1, 'rate': 100, 'qty': 3})
+    assert book.apply('update_remaining', {'seq': 7, 'oid': 'b', 'remaining': 2})
+    assert book.apply('epoch_order', {'seq': 8, 'oid': 'd'})
+    assert book.apply('unbook_order', {'seq': 9, 'oid': 'a'})
+    assert book.seq == 9
+    levels = book.levels()
+    assert levels['rate'].tolist() == [100, 110]
+    assert levels['qty'].tolist() == [3, 2]
+    assert levels['side'].tolist() == ['buy', 'sell']
+    assert not book.apply('unbook_order', {'seq': 11, 'oid': 'c'})
+    assert book.seq == 9
+
+
+# the books follow the replayed feeds and the stored books match the served ones, a note lost
+# on the way resyncs its market from the rest snapshot
+def test_runFeed_resync(dbPath):
+    with MockDex(markets=3, orders=20) as dex:
+        addFeeds(dex, 200)
+        dex.feedSpeed = 10
+        dex.dropSeqs = {50, 120}
+        feed = bookfeed.runFeed(dbPath, dex.exchange, duration=1.5, persistInterval=0.5)
+    assert feed.resyncs == 3 * 2
+    assert dex.hits['api/orderbook'] == 3 * 2
+    assert all(book.seq == 201 for book in feed.books.values())
+    assertStored(dbPath, dex)
+
+
+# a dropped connection is reestablished and the books are reloaded from the subscriptions, the
+# asset ids are not read again
+def test_reconnect(dbPath):
+    with MockDex(markets=2, orders=20) as dex:
+        addFeeds(dex, 100)
+        dex.feedSpeed = 5
+        exchange = collector.storeExchanges(dbPath, [dex.exchange]).iloc[0]
+        markets = collector.storeMarkets(dbPath, exchange, dexapi.getMarkets(dex.exchange))
+        feed = bookfeed.BookFeed(dex.exchange, markets, reconnectDelay=0.1).start()
+        waitFor(lambda: len(feed.books) == 2)
+        dex.dropConnections()
+        dex.waitFeeds(10)
+        # the resubscribed books are up to date once the replay is done
+        waitFor(lambda: len(feed.books) == 2 and all(book.seq == 101 for book in feed.books.values()))
+        feed.stop()
+    assert feed.reconnects == 1
+    assert dex.hits['ws'] == 2
+    assert dex.hits['api/config'] == 2
+
+
+# recorded feeds are replayed by a mock loaded from the fixtures
+def test_recordFeed(tmp_path, dbPath):
+    folder = str(tmp_path / 'fixtures')
+    with MockDex(markets=2, orders=20, candles=5) as dex:
+        addFeeds(dex, 50)
+        dex.feedSpeed = 10
+        record.record(dex.exchange, folder, periods=['24h'])
+        assert record.recordFeed(dex.exchange, folder, duration=1) == 2 * 50
+    with MockDex.load(folder) as replay:
+        replay.feedSpeed = 100
+        assert len(replay.feeds[('asset0', 'btc')]) == 50
+        feed = bookfeed.runFeed(dbPath, replay.exchange, duration=0.5, persistInterval=0.5)
+    assert feed.resyncs == 0
+    assert {tuple(name.split('_')): book.seq for name, book in feed.books.items()} == \
+           {key: book['seq'] for key, book in dex.books.items()}
+    assertStored(dbPath, dex)
+
+
+# the daemon follows the feeds instead of polling the books
+def test_runDaemon_bookFeed(dbPath):
+    with MockDex(markets=2, orders=20, candles=5) as dex:
+        addFeeds(dex, 100)
+        dex.feedSpeed = 10
+        result = daemon.runDaemon(dbPath, [dex.exchange], duration=1.5, bookFeed=True, feedPersistInterval=0.3,
+                                  candleMaxInterval=0.5, requestRate=0, seed=1)
+    assert 'api/orderbook' not in dex.hits
+    assert not any(name.startswith('books') for name in result.jobs)
+    assert all(job.errors == 0 for job in result.jobs.values())
+    assertStored(dbPath, dex)
+
+
+# the daemon subscribes the markets of a feed off the event loop, reading the asset ids of a
+# new market doesn't hold up the other jobs
+def test_runDaemon_bookFeedUpdateThread(dbPath, monkeypatch):
+    threads = []
+
+    def traced(feed, markets, func=bookfeed.BookFeed.update):
+        threads.append(threading.current_thread())
+        return func(feed, markets)
+    monkeypatch.setattr(bookfeed.BookFeed, 'update', traced)
+    with MockDex(markets=2, orders=20, candles=5) as dex:
+        addFeeds(dex, 10)
+        daemon.runDaemon(dbPath, [dex.exchange], duration=0.5, bookFeed=True, requestRate=0, seed=1)
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,85 @@
+import math
+import pandas as pd
+import pytest
+import bookstats
+import collector
+import dashData
+import dbmgr
+import dexapi
+import mockdex
+
+
+@pytest.fixture
+def markets(dbPath):
+    exchanges = collector.storeExchanges(dbPath, ['http://127.0.0.1:8080'])
+    markets = collector.storeMarkets(dbPath, exchanges.iloc[0], dexapi.parseMarkets(mockdex.makeConfig(2)))
+    yield dbPath, markets
+
+
+def makeBook():
+    # mid 1.0 with levels inside the 1%, 5% and 10% bands
+    return pd.DataFrame({'rate': [97000000, 99500000, 100500000, 108000000],
+                         'qty': [100000000, 200000000, 300000000, 100000000],
+                         'side': ['buy', 'buy', 'sell', 'sell']})
+
+
+def test_snapshotStats():
+    stats = bookstats.snapshotStats(makeBook(), 100000000, 100000000)
+    expected = {'bestBid': 0.995, 'bestAsk': 1.005, 'mid': 1.0, 'spread': 0.01,
+                'bidBase1': 2, 'askBase1': 3, 'bidQuote1': 1.99, 'askQuote1': 3.015, 'imbalance1': -0.2,
+                'bidBase2': 2, 'askBase2': 3, 'imbalance2': -0.2,
+                'bidBase5': 3, 'askBase5': 3, 'bidQuote5': 2.96, 'imbalance5': 0,
+                'bidBase10': 3, 'askBase10': 4, 'askQuote10': 4.095, 'imbalance10': -1 / 7}
+    for col, value in expected.items():
+        assert stats[col] == pytest.approx(value), col
+    assert list(stats) == bookstats.statCols
+    # rates are scaled by the conversion factors, amounts by their own asset
+    scaled = bookstats.snapshotStats(makeBook(), 100000000, 1000000)
+    assert scaled['mid'] == pytest.approx(100)
+    assert scaled['bidBase1'] == pytest.approx(2)
+    assert scaled['bidQuote1'] == pytest.approx(199)
+
+
+# a book without asks has no mid, its bands are left empty
+def test_snapshotStats_oneSided():
+    stats = bookstats.snapshotStats(makeBook().iloc[:2], 100000000, 100000000)
+    assert stats['bestBid'] == pytest.approx(0.995)
+    assert math.isnan(stats['bestAsk']) and math.isnan(stats['mid'])
+    assert math.isnan(stats['bidBase1']) and math.isnan(stats['imbalance10'])
+
+
+# storeBook writes a statistics row per snapshot, in both layouts, that reads back through dashData
+@pytest.mark.parametrize('bookStorage', ['levels', 'delta'])
+def test_storeBook_stats(markets, bookStorage):
+    path, frame = markets
+    stamps = pd.date_range('2024-01-01', periods=3, freq='h')
+    for idx, market in frame.iterrows():
+        for stamp in stamps:
+            collector.storeBook(path, market, makeBook(), stamp, bookStorage)
+    data = dashData.getLiquidityData(path, markets=[frame['marketID'].iloc[0]])
+    assert len(data) == 3
+    assert data['market'].unique().tolist() == [frame['name'].iloc[0]]
+    assert data['TimeStamp'].tolist() == list(stamps.tz_localize('UTC'))
+    assert data['imbalance1'].tolist() == pytest.approx([-0.2] * 3)
+    window = dashData.getLiquidityData(path, start=stamps[1])
+    assert len(window) == 2 * 2
+
+
+# snapshots stored without statistics are filled from the books table, across chunks
+def test_backfill(markets, monkeypatch):
+    path, frame = markets
+    monkeypatch.setattr(bookstats, 'enabled', False)
+    stamps = pd.date_range('2024-01-01', periods=5, freq='h')
+    for idx, market in frame.iterrows():
+        for stamp in stamps:
+            collector.storeBook(path, market, makeBook(), stamp)
+    assert len(dashData.getLiquidityData(path)) == 0
+    assert bookstats.backfill(path, chunkSize=3) == 2 * 5
+    data = dashData.getLiquidityData(path)
+    assert len(data) == 2 * 5
+    assert data['bidQuote5'].tolist() == pytest.approx([2.96] * 10)
+    # the same timestamps as the levels
+    levels = dbmgr.freeQuery(path, 'select distinct marketID, TimeStamp from books order by marketID, TimeStamp')
+    stored = dbmgr.freeQuery(path, 'select marketID, TimeStamp from bookStats order by marketID, TimeStamp')
+    pd.testing.assert_frame_equal(levels, stored)
+    assert bookstats.backfill(path) == 0
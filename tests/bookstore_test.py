@@ -0,0 +1,76 @@
+import pytest
+import bookstore
+import dbmgr
+import pandas as pd
+
+
+@pytest.fixture
+def dbPath(dbPath):
+    yield dbPath
+    bookstore.states.clear()
+
+
+def makeBook(levels):
+    # levels is a list of (side, rate, qty)
+    return pd.DataFrame(levels, columns=['side', 'rate', 'qty'])
+
+
+# a sequence of snapshots with changed, added and removed levels
+snapshots = [
+    ('2024-01-01 00:00:00', [('buy', 90, 5), ('buy', 95, 1), ('sell', 105, 2), ('sell', 110, 3)]),
+    ('2024-01-01 00:01:00', [('buy', 90, 5), ('buy', 95, 2), ('sell', 105, 2), ('sell', 110, 3)]),
+    ('2024-01-01 00:02:00', [('buy', 90, 5), ('sell', 105, 2), ('sell', 110, 3), ('sell', 120, 7)]),
+    ('2024-01-01 00:03:00', [('buy', 90, 5), ('buy', 95, 4), ('sell', 120, 7)]),
+    ('2024-01-01 00:04:00', [('buy', 91, 1), ('sell', 120, 7)]),
+    ]
+
+
+@pytest.mark.parametrize("keyframeInterval,expRows", [
+    (1, [4, 4, 4, 3, 2]),
+    (3, [4, 1, 2, 3, 3]),
+    (4, [4, 1, 2, 3, 2]),
+    (60, [4, 1, 2, 3, 3]),
+    ])
+def test_writeSnapshot(dbPath, keyframeInterval, expRows):
+    rows = [bookstore.writeSnapshot(dbPath, 1, timeStamp, makeBook(levels), keyframeInterval)
+            for timeStamp, levels in snapshots]
+    assert rows == expRows
+
+
+# every snapshot reads back exactly, also between snapshots and across keyframes
+@pytest.mark.parametrize("keyframeInterval", [1, 2, 60])
+def test_readBook(dbPath, keyframeInterval):
+    for timeStamp, levels in snapshots:
+        bookstore.writeSnapshot(dbPath, 1, timeStamp, makeBook(levels), keyframeInterval)
+    for timeStamp, levels in snapshots:
+        for readAt in [pd.Timestamp(timeStamp), pd.Timestamp(timeStamp) + pd.Timedelta(seconds=30)]:
+            expected = makeBook(levels).sort_values(by=['rate'])[['rate', 'qty', 'side']].reset_index(drop=True)
+            pd.testing.assert_frame_equal(bookstore.readBook(dbPath, 1, readAt), expected)
+
+
+# a snapshot rolled back with its enclosing write isn't the base of the next delta
+def test_writeSnapshot_rolledBack(dbPath):
+    session = dbmgr.getSession(dbPath)
+    bookstore.writeSnapshot(dbPath, 1, snapshots[0][0], makeBook(snapshots[0][1]))
+    with pytest.raises(Exception, match='failed'):
+        with session.write():
+            bookstore.writeSnapshot(dbPath, 1, snapshots[1][0], makeBook(snapshots[1][1]))
+            raise Exception('failed')
+    assert bookstore.writeSnapshot(dbPath, 1, snapshots[2][0], makeBook(snapshots[2][1])) == 4
+    for timeStamp, levels in [snapshots[0], snapshots[2]]:
+        expected = makeBook(levels).sort_values(by=['rate'])[['rate', 'qty', 'side']].reset_index(drop=True)
+        pd.testing.assert_frame_equal(bookstore.readBook(dbPath, 1, timeStamp), expected)
+    pd.testing.assert_frame_equal(bookstore.readBook(dbPath, 1, snapshots[1][0]), bookstore.readBook(dbPath, 1, snapshots[0][0]))
+
+
+def test_readBook_beforeFirstSnapshot(dbPath):
+    bookstore.writeSnapshot(dbPath, 1, snapshots[0][0], makeBook(snapshots[0][1]))
+    assert len(bookstore.readBook(dbPath, 1, '2023-12-31')) == 0
+    assert len(bookstore.readBook(dbPath, 2, snapshots[0][0])) == 0
+
+
+def test_snapshotTimes(dbPath):
+    for timeStamp, levels in snapshots:
+        bookstore.writeSnapshot(dbPath, 1, timeStamp, makeBook(levels))
+    times = bookstore.snapshotTimes(dbPath, 1, '2024-01-01 00:01:00', '2024-01-01 00:03:00')
+    assert list(times) == [pd.Timestamp(timeStamp) for timeStamp, levels in snapshots[1:4]]
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import pandas as pd
+import pytest
+import cli
+import collector
+import dexapi
+import mockdex
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def runPython(code, cwd):
+    env = dict(os.environ, PYTHONPATH=root)
+    return subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, capture_output=True, text=True)
+
+
+# importing the modules reads no config and loads neither the coinmetrics client nor pyarrow.dataset,
+# the cli parses its arguments before importing pandas
+def test_imports(tmp_path):
+    result = runPython('import sys, main, dashData\n'
+                       'assert main.__dict__.get("dbPath") is None and dashData.dbPath is None\n'
+                       'assert "coinmetrics.api_client" not in sys.modules\n'
+                       'assert "pyarrow.dataset" not in sys.modules', str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    result = runPython('import sys, cli\n'
+                       'try:\n'
+                       '    cli.main(["dashboard", "--help"])\n'
+                       'except SystemExit:\n'
+                       '    pass\n'
+                       'assert "pandas" not in sys.modules', str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    assert 'liquidity' in result.stdout
+
+
+# the config is read when the command runs, a missing file is reported
+def test_loadConfig(tmp_path):
+    import main
+    with pytest.raises(Exception, match='not found'):
+        main.loadConfig(str(tmp_path / 'missing.conf'))
+    main.loadConfig(os.path.join(root, 'config.conf'))
+    assert main.collectorMode in ('async', 'sequential', 'process')
+    assert main.daemonSettings['bookFeed'] is False
+
+
+def test_dashboard(dbPath, capsys):
+    exchanges = collector.storeExchanges(dbPath, ['http://127.0.0.1:8080'])
+    markets = collector.storeMarkets(dbPath, exchanges.iloc[0], dexapi.parseMarkets(mockdex.makeConfig(1)))
+    books = pd.DataFrame({'rate': [99500000, 100500000], 'qty': [100000000, 200000000], 'side': ['buy', 'sell']})
+    collector.storeBook(dbPath, markets.iloc[0], books)
+    cli.main(['dashboard', 'liquidity', '--db', dbPath, '--days', '1'])
+    output = capsys.readouterr().out
+    assert 'asset0_btc' in output
+    assert 'imbalance1' in output
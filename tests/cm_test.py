@@ -2,6 +2,7 @@ import pytest
 import cm
 import datetime
 import pandas as pd
+import dbmgr
 
 
 @pytest.fixture
@@ -23,4 +24,72 @@ def test_getMetric(comparisonData):
     # get results
     results = cm.getMetric(['dcr', 'btc', 'eth'], 'PriceUSD', startDate, endDate)
     # compare data frame against retrieved data
-    pd.testing.assert_frame_equal(results,comparisonData)
\ No newline at end of file
+    pd.testing.assert_frame_equal(results,comparisonData)
+
+class FixtureSource:
+    # serves the comparison prices extended by a day per day from a local frame and records the
+    # requested ranges, eth only has prices from 2018-01-02
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, assets, metric, dateStart, dateEnd):
+        self.requests.append((sorted(assets), dateStart, dateEnd))
+        rows = []
+        for date in pd.date_range(dateStart, dateEnd, freq='D'):
+            for asset in assets:
+                if asset == 'eth' and date < pd.Timestamp('2018-01-02'):
+                    continue
+                rows.append((asset, date.strftime('%Y-%m-%d'), float(date.day)))
+        return pd.DataFrame(rows, columns=['asset', 'date', 'value'])
+
+
+@pytest.fixture
+def dbPath(dbPath):
+    yield dbPath
+    cm.recentMisses.clear()
+
+
+def utc(date):
+    return pd.Timestamp(date, tz='UTC')
+
+
+# only the dates missing from the cache are requested, a warm cache needs no requests at all
+def test_metricCache(dbPath):
+    source = FixtureSource()
+    first = cm.getMetric(['dcr', 'btc'], 'PriceUSD', utc('2018-01-05'), utc('2018-01-10'), dbPath, source)
+    assert source.requests == [(['btc', 'dcr'], '2018-01-05', '2018-01-10')]
+    assert list(first.columns) == ['date', 'btc', 'dcr']
+    assert list(first['btc']) == [5.0, 6.0, 7.0, 8.0, 9.0, 10.0]
+    again = cm.getMetric(['dcr', 'btc'], 'PriceUSD', utc('2018-01-05'), utc('2018-01-10'), dbPath, source)
+    assert len(source.requests) == 1
+    pd.testing.assert_frame_equal(again, first)
+    wider = cm.getMetric(['dcr', 'btc', 'eth'], 'PriceUSD', utc('2018-01-03'), utc('2018-01-12'), dbPath, source)
+    assert sorted(source.requests[1:]) == [(['btc', 'dcr'], '2018-01-03', '2018-01-04'),
+                                           (['btc', 'dcr'], '2018-01-11', '2018-01-12'),
+                                           (['eth'], '2018-01-03', '2018-01-12')]
+    assert len(wider) == 10
+    pd.testing.assert_frame_equal(wider.iloc[2:8][['date', 'btc', 'dcr']].reset_index(drop=True), first)
+
+
+# days the source has no value for are cached as missing and not requested again
+def test_metricCache_missingDays(dbPath):
+    source = FixtureSource()
+    data = cm.getMetric(['eth'], 'PriceUSD', utc('2018-01-01'), utc('2018-01-03'), dbPath, source)
+    assert list(data['date']) == [utc('2018-01-02'), utc('2018-01-03')]
+    assert dbmgr.freeQuery(dbPath, 'select count(*) as n from metrics where value is null')['n'].iloc[0] == 1
+    cm.getMetric(['eth'], 'PriceUSD', utc('2018-01-01'), utc('2018-01-03'), dbPath, source)
+    assert len(source.requests) == 1
+
+
+# recent days without a value are only requested again after refreshInterval
+def test_metricCache_recentDays(dbPath):
+    calls = []
+
+    def source(assets, metric, dateStart, dateEnd):
+        calls.append((dateStart, dateEnd))
+        return pd.DataFrame(columns=['asset', 'date', 'value'])
+    today = pd.Timestamp.now(tz='UTC').normalize()
+    cm.getMetric(['dcr'], 'PriceUSD', today - pd.Timedelta(days=5), today, dbPath, source)
+    cm.getMetric(['dcr'], 'PriceUSD', today - pd.Timedelta(days=5), today, dbPath, source)
+    assert len(calls) == 1
+    assert dbmgr.freeQuery(dbPath, 'select count(*) as n from metrics')['n'].iloc[0] == 6 - cm.settleDays
@@ -0,0 +1,149 @@
+import random
+import pytest
+import collector
+import dbmgr
+import dexapi
+import rollups
+import pandas as pd
+import mockdex
+from helpers import countRows
+from mockdex import MockDex
+
+
+# a full cycle against the mock server stores every market, book and candle series
+def test_runCycle(dbPath):
+    with MockDex(markets=3, orders=20, candles=10) as dex:
+        results = collector.runCycle(dbPath, [dex.exchange], maxConcurrent=4, requestRate=0)
+    assert len(results) == 1
+    assert len(results[0]) == 3
+    assert countRows(dbPath, 'markets') == 3
+    assert countRows(dbPath, 'marketConfig') == 3
+    assert countRows(dbPath, 'candles') == 3 * 10
+    assert countRows(dbPath, 'books') > 0
+
+
+# the per host limit caps the number of requests in flight
+@pytest.mark.parametrize("maxConcurrent", [1, 2])
+def test_runCycle_concurrencyLimit(dbPath, maxConcurrent):
+    with MockDex(markets=6, orders=5, candles=5, latency=0.02) as dex:
+        collector.runCycle(dbPath, [dex.exchange], maxConcurrent=maxConcurrent, requestRate=0)
+    assert dex.maxInFlight <= maxConcurrent
+    assert dex.hits['api/orderbook'] == 6
+
+
+# an unreachable exchange doesn't stop the others from being collected
+def test_runCycle_failingExchange(dbPath):
+    with MockDex(markets=2, orders=5, candles=5) as dex:
+        results = collector.runCycle(dbPath, ['http://127.0.0.1:1', dex.exchange], requestRate=0)
+    assert sum(result is None for result in results) == 1
+    assert countRows(dbPath, 'candles') == 2 * 5
+
+
+# a second cycle only requests and rewrites candles from the high water mark onwards
+def test_runCycle_incrementalCandles(dbPath):
+    with MockDex(markets=2, orders=5, candles=30) as dex:
+        collector.runCycle(dbPath, [dex.exchange], requestRate=0, candlePeriods=['24h', '1h'])
+        assert countRows(dbPath, 'candles') == 2 * 2 * 30
+        # move the last stored candle to an older state, it must be written again
+        dbmgr.getSession(dbPath).writer.execute('update candles set close = -1')
+        dbmgr.getSession(dbPath).writer.commit()
+        dex.paths.clear()
+        collector.runCycle(dbPath, [dex.exchange], requestRate=0, candlePeriods=['24h', '1h'])
+    candlePaths = [path for path in dex.paths if path.startswith('/api/candles')]
+    assert len(candlePaths) == 4
+    assert all(int(path.split('/')[-1]) <= 3 for path in candlePaths)
+    assert countRows(dbPath, 'candles') == 2 * 2 * 30
+    assert countRows(dbPath, 'candles where close = -1') == 2 * 2 * 29
+
+
+# an unchanged config is neither parsed nor written again and injected failures are retried
+def test_runCycle_unchangedConfig(dbPath):
+    dexapi.configureHttp(backoff=0.01)
+    try:
+        with MockDex(markets=2, orders=5, candles=5) as dex:
+            collector.runCycle(dbPath, [dex.exchange], requestRate=0)
+            updated = dbmgr.freeQuery(dbPath, 'select LastUpdated from marketConfig')
+            dex.fail('api/orderbook', 503, count=2)
+            results = collector.runCycle(dbPath, [dex.exchange], requestRate=0)
+    finally:
+        dexapi.configureHttp(backoff=0.5)
+    assert len(results[0]) == 2
+    assert dex.statuses.count(304) == 1
+    assert dex.hits['api/orderbook'] == 2 * 2 + 2
+    pd.testing.assert_frame_equal(dbmgr.freeQuery(dbPath, 'select LastUpdated from marketConfig'), updated)
+
+
+# the validators kept with the stored markets decide, plain requests for the config and a failed
+# store of a changed one don't make it look unchanged
+def test_runCycle_changedConfig(dbPath, mocker):
+    with MockDex(markets=2, orders=5, candles=5) as dex:
+        collector.runCycle(dbPath, [dex.exchange], requestRate=0)
+        dex.setConfig(mockdex.makeConfig(3))
+        assert len(dexapi.getMarkets(dex.exchange)) == 3
+        insert = mocker.patch('dbmgr.insertReturning', side_effect=Exception('disk full'))
+        assert collector.runCycle(dbPath, [dex.exchange], requestRate=0) == [None]
+        insert.side_effect = None
+        mocker.stopall()
+        results = collector.runCycle(dbPath, [dex.exchange], requestRate=0)
+    assert len(results[0]) == 3
+    assert countRows(dbPath, 'markets') == 3
+    assert dex.statuses.count(304) == 0
+
+
+# exchanges and markets are cached, a changed config only writes the markets that changed and
+# new markets get their IDs from the insert
+def test_storeMarkets_cache(dbPath, mocker):
+    config = mockdex.makeConfig(3)
+    exchange = collector.storeExchanges(dbPath, ['dex']).iloc[0]
+    first = collector.storeMarkets(dbPath, exchange, dexapi.parseMarkets(config))
+    reads = mocker.spy(dbmgr, 'readTable')
+    writes = mocker.spy(dbmgr, 'insertRecords')
+    assert collector.storeExchanges(dbPath, ['dex'])['name'].tolist() == ['dex']
+    # the same config parsed again is not written
+    same = collector.storeMarkets(dbPath, exchange, dexapi.parseMarkets(config))
+    pd.testing.assert_frame_equal(same[['name', 'marketID', 'LastUpdated']], first[['name', 'marketID', 'LastUpdated']])
+    assert writes.call_count == 0
+    config['markets'][1]['lotsize'] *= 10
+    config = dict(config, markets=config['markets'] + mockdex.makeConfig(4)['markets'][3:],
+                  assets=mockdex.makeConfig(4)['assets'])
+    changed = collector.storeMarkets(dbPath, exchange, dexapi.parseMarkets(config))
+    assert reads.call_count == 0
+    assert writes.call_count == 1
+    assert len(writes.call_args.args[2]) == 2
+    assert changed['marketID'].tolist()[:3] == first['marketID'].tolist()
+    assert changed['marketID'].nunique() == 4
+    stored = dbmgr.freeQuery(dbPath, 'select m.name, mc.lotsize from markets m join marketConfig mc on mc.marketID = m.ID order by m.ID')
+    assert stored['name'].tolist() == [f'asset{i}_btc' for i in range(4)]
+    assert stored['lotsize'].tolist() == [100000000, 1000000000, 100000000, 100000000]
+    # a new process reads the stored markets once and finds nothing to write
+    collector.storedMarkets.clear()
+    collector.exchangeIDs.clear()
+    restarted = collector.storeMarkets(dbPath, collector.storeExchanges(dbPath, ['dex']).iloc[0],
+                                       dexapi.parseMarkets(config))
+    assert writes.call_count == 1
+    assert restarted['marketID'].tolist() == changed['marketID'].tolist()
+
+
+# a candle write the group writer rolls back leaves the high water mark where it was, so the next
+# cycle writes the lost candle again
+def test_storeCandles_rolledBack(dbPath, monkeypatch):
+    exchange = collector.storeExchanges(dbPath, ['dex']).iloc[0]
+    market = collector.storeMarkets(dbPath, exchange, dexapi.parseMarkets(mockdex.makeConfig(1))).iloc[0]
+    payload = mockdex.makeCandles(random.Random(1), 3, endMs=int(pd.Timestamp('2024-01-04').value // 1000000))
+
+    def candles(count):
+        return dexapi.parseCandles({key: value if key == 'binSize' else value[:count] for key, value in payload.items()})
+
+    def failingRollups(*args, **kwargs):
+        raise Exception('rollups failed')
+
+    with dbmgr.GroupWriter(dbPath, groupSize=1) as writer:
+        writer.submit(collector.storeCandles, dbPath, market, candles(1)).result()
+        monkeypatch.setattr(rollups, 'updateRollups', failingRollups)
+        with pytest.raises(Exception, match='rollups failed'):
+            writer.submit(collector.storeCandles, dbPath, market, candles(2)).result()
+        monkeypatch.undo()
+        assert collector.getHighWaterMark(dbPath, market['marketID'], '24h') == pd.Timestamp('2024-01-01')
+        writer.submit(collector.storeCandles, dbPath, market, candles(3)).result()
+    stored = dbmgr.freeQuery(dbPath, "select timeOpen from candles where period = '24h' order by timeOpen")
+    assert stored['timeOpen'].tolist() == ['2024-01-01 00:00:00', '2024-01-02 00:00:00', '2024-01-03 00:00:00']
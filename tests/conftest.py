@@ -0,0 +1,11 @@
+import pytest
+import dbmgr
+
+
+@pytest.fixture
+def dbPath(tmp_path):
+    # a new database with every migration applied, its sessions are closed afterwards
+    path = str(tmp_path / 'test.db')
+    dbmgr.initalizeDB(path)
+    yield path
+    dbmgr.closeSessions()
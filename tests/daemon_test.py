@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import archive
+import daemon
+import dexapi
+from helpers import countRows
+from mockdex import MockDex
+
+
+# the daemon keeps polling books at their interval while the config is only requested once
+def test_runDaemon(dbPath):
+    with MockDex(markets=3, orders=10, candles=5) as dex:
+        result = daemon.runDaemon(dbPath, [dex.exchange], duration=1.5, bookInterval=0.2,
+                                  bookMaxInterval=0.2, candleMaxInterval=0.5, requestRate=0, seed=1)
+    assert dex.hits['api/config'] == 1
+    assert dex.hits['api/orderbook'] >= 3 * 4
+    assert countRows(dbPath, 'candles') == 3 * 5
+    assert countRows(dbPath, 'books') > 0
+    # every queued write was committed and no job is left running
+    assert result.collector.writer.queue.empty()
+    assert not result.collector.writer.thread.is_alive()
+    assert not result.tasks
+    assert all(job.errors == 0 for job in result.jobs.values())
+
+
+# the archive export reads outside the writer, only recording the archived days and pruning
+# run on it
+def test_runDaemon_archive(dbPath, tmp_path, monkeypatch):
+    threads = {}
+    for name in ['exportTable', 'recordArchived', 'pruneTable']:
+        def traced(*args, func=getattr(archive, name), name=name):
+            threads.setdefault(name, set()).add(threading.current_thread().name)
+            return func(*args)
+        monkeypatch.setattr(archive, name, traced)
+    root = str(tmp_path / 'archive')
+    with MockDex(markets=2, orders=10, candles=5) as dex:
+        result = daemon.runDaemon(dbPath, [dex.exchange], duration=1.0, archiveOptions=(root, 0, True),
+                                  archiveInterval=0.5, candleMaxInterval=0.5, requestRate=0, seed=1)
+    assert all(job.errors == 0 for job in result.jobs.values())
+    assert threads['recordArchived'] == threads['pruneTable'] == {f'writer {dbPath}'}
+    assert f'writer {dbPath}' not in threads['exportTable']
+    assert countRows(dbPath, 'archives') == 2
+
+
+# unchanged books back off up to the maximum interval, a changed book is polled at the base
+# interval again
+def test_runDaemon_adaptiveBooks(dbPath):
+    with MockDex(markets=2, orders=10, candles=5) as dex:
+        active = min(dex.books)
+        exchange = dex.exchange
+
+        async def run(daemonObj):
+            async def churn():
+                # the active market gets a new book every 50ms
+                while True:
+                    dex.books[active]['orders'][0]['qty'] += 1
+                    await asyncio.sleep(0.05)
+            task = asyncio.create_task(churn())
+            try:
+                await daemonObj.run(2.0)
+            finally:
+                task.cancel()
+        daemonObj = daemon.Daemon(dbPath, [dex.exchange], bookInterval=0.1, bookMaxInterval=0.8,
+                                  jitter=0, requestRate=0, seed=1)
+        asyncio.run(run(daemonObj))
+    books = {job.name: job for job in daemonObj.jobs.values() if job.name.startswith('books')}
+    activeJob = books[f'books {exchange} {active[0]}_{active[1]}']
+    idleJob = [job for job in books.values() if job is not activeJob][0]
+    assert activeJob.interval == 0.1
+    assert idleJob.interval == 0.8
+    assert activeJob.runs > 2 * idleJob.runs
+
+
+# first runs are spread over the interval and later ones jittered
+def test_jitter(dbPath):
+    async def run():
+        daemonObj = daemon.Daemon(dbPath, [], jitter=0.1, seed=1)
+        daemonObj.wakeup = asyncio.Event()
+        now = asyncio.get_running_loop().time()
+        jobs = [daemonObj.addJob(daemon.Job(f'job {n}', None, 60)) for n in range(200)]
+        starts = [job.nextRun - now for job in jobs]
+        intervals = [daemonObj.jittered(60) for n in range(200)]
+        return starts, intervals
+    starts, intervals = asyncio.run(run())
+    assert 0 <= min(starts) < 5 and 55 < max(starts) <= 60
+    assert all(54 <= interval <= 66 for interval in intervals)
+    assert len(set(intervals)) == 200
+
+
+# markets missing from a new config lose their jobs, a failing job backs off and the others go on
+def test_runDaemon_delistedMarket(dbPath):
+    with MockDex(markets=3, orders=10, candles=5) as dex:
+        async def run(daemonObj):
+            loop = asyncio.get_running_loop()
+            config = dict(dex.config, markets=dex.config['markets'][:2])
+            loop.call_later(0.5, dex.setConfig, config)
+            await daemonObj.run(1.5)
+        daemonObj = daemon.Daemon(dbPath, [dex.exchange], marketInterval=0.6, bookInterval=0.2,
+                                  jitter=0, requestRate=0, seed=1)
+        asyncio.run(run(daemonObj))
+    assert len(daemonObj.markets) == 2
+    assert len([name for name in daemonObj.jobs if name.startswith('books')]) == 2
+    assert len([name for name in daemonObj.jobs if name.startswith('candles')]) == 2
+
+
+# a config that fails at startup is retried soon after instead of a market interval later, the
+# books are collected once it is served again
+def test_runDaemon_configRetry(dbPath):
+    settings = dict(dexapi.httpSettings)
+    dexapi.configureHttp(retries=0)
+    try:
+        with MockDex(markets=2, orders=10, candles=5) as dex:
+            exchange = dex.exchange
+            dex.fail('api/config', 503, count=2)
+            daemonObj = daemon.Daemon(dbPath, [exchange], bookInterval=0.1, bookMaxInterval=0.1,
+                                      jitter=0, requestRate=0, seed=1)
+            asyncio.run(daemonObj.run(2.0))
+    finally:
+        dexapi.configureHttp(**settings)
+    job = daemonObj.jobs[f'markets {exchange}']
+    assert job.errors == 2 and job.failures == 0
+    assert job.interval == daemonObj.marketInterval
+    assert dex.hits['api/config'] == 3
+    assert dex.hits['api/orderbook'] >= 2 * 5
+    assert countRows(dbPath, 'books') > 0
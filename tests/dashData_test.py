@@ -0,0 +1,104 @@
+import pytest
+import dashData
+import dbmgr
+import numpy as np
+import pandas as pd
+
+
+def priceSource(assets, metric, dateStart, dateEnd):
+    # daily prices of 1000 * (asset number + 1) + day of month, dcr has no price on the 2nd and
+    # other assets are priced 0
+    rows = []
+    for date in pd.date_range(dateStart, dateEnd, freq='D'):
+        for asset in assets:
+            if asset == 'dcr' and date.day == 2:
+                continue
+            known = ['btc', 'dcr', 'eth']
+            price = 1000.0 * (known.index(asset) + 1) + date.day if asset in known else 0.0
+            rows.append((asset, date.strftime('%Y-%m-%d'), price))
+    return pd.DataFrame(rows, columns=['asset', 'date', 'value'])
+
+
+# markets sharing a timestamp keep one row each and every row gets the price of its own asset
+def test_convertValueUSD(monkeypatch):
+    monkeypatch.setattr(dashData, 'dbPath', None)
+    data = pd.DataFrame({'timeOpen': pd.to_datetime(['2018-01-01 12:00:00', '2018-01-01 12:00:00',
+                                                     '2018-01-02 00:00:00', '2018-01-03 06:00:00',
+                                                     '2018-01-02 00:00:00'], utc=True),
+                         'market': ['dcr_btc', 'eth_btc', 'dcr_btc', 'eth.eth_btc', 'btc_usdt'],
+                         'baseAsset': ['dcr', 'eth', 'dcr', 'eth.eth', 'btc'],
+                         'quoteAsset': ['btc', 'btc', 'btc', 'btc', 'usdt'],
+                         'baseVol': [1.0, 2.0, 3.0, 4.0, 5.0],
+                         'quoteVol': [10, 20, 30, 40, 50]})
+    output = dashData.convertValueUSD(data, 'timeOpen', {'baseVol': 'baseAsset', 'quoteVol': 'quoteAsset'},
+                                      source=priceSource)
+    assert len(output) == len(data)
+    pd.testing.assert_frame_equal(output[data.columns], data)
+    # dcr on the 2nd falls back to the price of the 1st
+    price = np.array([2001.0, 3001.0, 2001.0, 3003.0, 1002.0])
+    np.testing.assert_array_equal(output['baseVolUSD'], data['baseVol'] * price)
+    # quote volumes are priced in their own asset
+    quotePrice = np.array([1001.0, 1001.0, 1002.0, 1003.0, 0.0])
+    np.testing.assert_array_equal(output['quoteVolUSD'], data['quoteVol'] * quotePrice)
+
+
+def test_convertValueUSD_singleColumn(monkeypatch):
+    monkeypatch.setattr(dashData, 'dbPath', None)
+    data = pd.DataFrame({'timeOpen': pd.to_datetime(['2018-01-03', '2018-01-01'], utc=True),
+                         'baseAsset': ['btc', 'btc'],
+                         'baseVol': [1.0, 2.0]})
+    output = dashData.convertValueUSD(data, 'timeOpen', 'baseAsset', 'baseVol', source=priceSource)
+    assert list(output['baseVolUSD']) == [1003.0, 2002.0]
+
+
+# prices are cached in the configured database, a refresh doesn't request them again
+def test_convertValueUSD_cached(dbPath, monkeypatch):
+    monkeypatch.setattr(dashData, 'dbPath', dbPath)
+    calls = []
+
+    def countedSource(*args):
+        calls.append(args)
+        return priceSource(*args)
+
+    data = pd.DataFrame({'timeOpen': pd.to_datetime(['2018-01-01', '2018-01-03'], utc=True),
+                         'baseAsset': ['btc', 'eth'],
+                         'baseVol': [1.0, 2.0]})
+    first = dashData.convertValueUSD(data, 'timeOpen', 'baseAsset', 'baseVol', source=countedSource)
+    second = dashData.convertValueUSD(data, 'timeOpen', 'baseAsset', 'baseVol', source=countedSource)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(second, first)
+
+
+@pytest.fixture
+def bookPath(dbPath):
+    # two exchanges with a market each, 6 hourly snapshots of 2 levels per side
+    dbmgr.insertRecords(dbPath, 'exchanges', pd.DataFrame({'name': ['a', 'b']}), {'name': 'name'})
+    markets = pd.DataFrame({'exchangeID': [1, 2], 'name': ['dcr_btc', 'eth_btc'], 'base': ['dcr', 'eth'], 'quote': 'btc'})
+    dbmgr.insertRecords(dbPath, 'markets', markets, {col: col for col in markets.columns})
+    rows = [(marketID, pd.Timestamp('2024-01-01') + pd.Timedelta(minutes=30 * snapshot), side, rate, marketID * (snapshot + 1))
+            for marketID in [1, 2] for snapshot in range(6) for side in [0, 1] for rate in [1, 2]]
+    books = pd.DataFrame(rows, columns=['marketID', 'TimeStamp', 'side', 'rate', 'qty'])
+    dbmgr.insertRecords(dbPath, 'books', books, {col: col for col in books.columns})
+    yield dbPath
+
+
+# every level is read once with its own exchange
+def test_getBookData(bookPath):
+    data = dashData.getBookData(bookPath)
+    assert len(data) == 2 * 6 * 2 * 2
+    assert set(zip(data['exchange'], data['market'])) == {('a', 'dcr_btc'), ('b', 'eth_btc')}
+    window = dashData.getBookData(bookPath, start='2024-01-01 01:00:00', markets=[2])
+    assert len(window) == 4 * 2 * 2
+    assert (window['TimeStamp'] >= pd.Timestamp('2024-01-01 01:00:00', tz='UTC')).all()
+
+
+# the chunked aggregation matches aggregating the full read whatever the chunk size
+@pytest.mark.parametrize("chunkSize", [3, 8, 1000])
+def test_getBookDepth(bookPath, chunkSize):
+    depth = dashData.getBookDepth(bookPath, '1h', chunkSize=chunkSize)
+    data = dashData.getBookData(bookPath)
+    data['period'] = data['TimeStamp'].dt.floor('1h')
+    groups = data.groupby(['period', 'market', 'side'])
+    expected = groups['qty'].sum() / groups['TimeStamp'].nunique()
+    assert list(depth['qty']) == list(expected)
+    assert list(depth['snapshots']) == [2] * len(depth)
@@ -0,0 +1,322 @@
+import pytest
+import dbmgr
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+# the database shipped with the repository, created before the schema migrations existed
+mainDB = os.path.join(os.path.dirname(__file__), '..', 'db', 'main.db')
+
+
+# the module functions share one session per path and keep its connections open
+def test_getSession_reused(dbPath):
+    session = dbmgr.getSession(dbPath)
+    writer = session.writer
+    dbmgr.insertRecords(dbPath, 'exchanges', pd.DataFrame({'name': ['a', 'b']}), {'name': 'name'})
+    dbmgr.readTable(dbPath, 'exchanges')
+    assert dbmgr.getSession(dbPath) is session
+    assert session.writer is writer
+    assert session.readerCount == 1
+
+
+def test_session_contextManager(dbPath):
+    with dbmgr.DBSession(dbPath) as session:
+        session.insertRecords('exchanges', pd.DataFrame({'name': ['a']}), {'name': 'name'})
+        data = session.readTable('exchanges', ['name'], "name = 'a'")
+        assert list(data['name']) == ['a']
+    with pytest.raises(Exception):
+        session.writer.execute('select 1')
+
+
+# closing refreshes the planner statistics through the writer unless optimize is False
+@pytest.mark.parametrize("optimize, expStatements", [(True, ['PRAGMA optimize']), (False, [])])
+def test_session_closeOptimize(dbPath, optimize, expStatements):
+    session = dbmgr.DBSession(dbPath)
+    statements = []
+    session.writer.set_trace_callback(statements.append)
+    session.close(optimize)
+    assert statements == expStatements
+
+
+# a failed write is rolled back and leaves the writer usable
+def test_session_writeRollback(dbPath):
+    session = dbmgr.getSession(dbPath)
+    with pytest.raises(Exception):
+        with session.write() as conn:
+            conn.execute("insert into exchanges (name) values ('a')")
+            conn.execute('insert into missingTable values (1)')
+    assert len(session.readTable('exchanges')) == 0
+    session.insertRecords('exchanges', pd.DataFrame({'name': ['a']}), {'name': 'name'})
+    assert len(session.readTable('exchanges')) == 1
+
+
+@pytest.mark.parametrize("tableName,listCols,replace,expected", [
+    ('exchanges', ['name'], False, 'INSERT OR IGNORE INTO exchanges ( name ) VALUES ( ? )'),
+    ('exchanges', ['name'], True, 'INSERT OR REPLACE INTO exchanges ( name ) VALUES ( ? )'),
+    ('marketConfig', ['marketID', 'epochlen'], True,
+     'INSERT INTO marketConfig ( marketID, epochlen ) VALUES ( ?, ? ) '
+     'ON CONFLICT ( marketID ) DO UPDATE SET epochlen = excluded.epochlen'),
+    ])
+def test_insertStatement(tableName, listCols, replace, expected):
+    assert dbmgr.insertStatement(tableName, listCols, replace) == expected
+
+
+# timestamps are stored as text the same way to_sql stored them
+def test_insertRecords_timestampFormat(dbPath):
+    data = pd.DataFrame({'marketID': [1, 1],
+                         'TimeStamp': pd.to_datetime(['2024-09-11 16:46:51.359452', '2024-09-11 16:46:52'], format='ISO8601'),
+                         'side': ['buy', 'sell'],
+                         'rate': [1, 2],
+                         'qty': [3, 4]})
+    dbmgr.insertRecords(dbPath, 'books', data, {col: col for col in data.columns})
+    stored = dbmgr.freeQuery(dbPath, 'select TimeStamp, typeof(rate) as rateType from books order by rate')
+    assert list(stored['TimeStamp']) == ['2024-09-11 16:46:51.359452', '2024-09-11 16:46:52']
+    assert list(stored['rateType']) == ['integer', 'integer']
+
+
+# replace upserts candles in place and rows are written across several batches
+def test_insertRecords_upsertBatches(dbPath):
+    candles = pd.DataFrame({'marketID': 1,
+                            'period': '24h',
+                            'timeOpen': pd.date_range('2024-01-01', periods=5, freq='D'),
+                            'timeClose': pd.date_range('2024-01-02', periods=5, freq='D'),
+                            'baseVolume': 1, 'quoteVolume': 1, 'high': 1, 'low': 1, 'open': 1, 'close': 1})
+    colDict = {col: col for col in candles.columns}
+    dbmgr.insertRecords(dbPath, 'candles', candles, colDict, replace=True, batchSize=2)
+    rowIDs = dbmgr.freeQuery(dbPath, 'select rowid from candles order by timeOpen')['rowid']
+    dbmgr.insertRecords(dbPath, 'candles', candles.assign(close=2), colDict, replace=True, batchSize=2)
+    stored = dbmgr.freeQuery(dbPath, 'select rowid, close from candles order by timeOpen')
+    assert len(stored) == 5
+    assert list(stored['close']) == [2] * 5
+    assert list(stored['rowid']) == list(rowIDs)
+
+
+# the storage profile pragmas are applied to every connection the session opens
+@pytest.mark.parametrize("profile,overrides,expJournal,expSynchronous", [
+    ('default', None, 'delete', 2),
+    ('wal', None, 'wal', 1),
+    ('wal', {'synchronous': 'FULL'}, 'wal', 2),
+    ])
+def test_setStorageProfile(tmp_path, profile, overrides, expJournal, expSynchronous):
+    path = str(tmp_path / 'profile.db')
+    dbmgr.setStorageProfile(path, profile, overrides, maintenanceInterval=0)
+    dbmgr.initalizeDB(path)
+    session = dbmgr.getSession(path)
+    with session.read() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == expJournal
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == expSynchronous
+    assert session.writer.execute('PRAGMA synchronous').fetchone()[0] == expSynchronous
+    dbmgr.closeSessions()
+    del dbmgr.storageSettings[path]
+
+
+def test_setStorageProfile_unknown(tmp_path):
+    with pytest.raises(Exception):
+        dbmgr.setStorageProfile(str(tmp_path / 'profile.db'), 'fast')
+
+
+# maintenance only runs once the interval has passed unless forced
+def test_maintain(tmp_path):
+    path = str(tmp_path / 'maintain.db')
+    dbmgr.setStorageProfile(path, 'wal', maintenanceInterval=3600)
+    dbmgr.initalizeDB(path)
+    assert dbmgr.maintain(path) is False
+    assert dbmgr.maintain(path, force=True) is True
+    dbmgr.closeSessions()
+    del dbmgr.storageSettings[path]
+
+
+# an existing database is upgraded in place and keeps its data
+def test_initalizeDB_migratesExisting(tmp_path):
+    path = str(tmp_path / 'main.db')
+    shutil.copy(mainDB, path)
+    conn = sqlite3.connect(path)
+    expRows = conn.execute('select count(*) from (select distinct marketID, TimeStamp, side, rate from books)').fetchone()[0]
+    conn.close()
+    dbmgr.initalizeDB(path)
+    dbmgr.initalizeDB(path)
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(dbmgr.migrations)
+    assert conn.execute('select count(*) from books').fetchone()[0] == expRows
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
+
+
+# duplicate snapshots are ignored once the books key exists
+def test_books_duplicateSnapshot(dbPath):
+    data = pd.DataFrame({'marketID': 1, 'TimeStamp': pd.Timestamp('2024-01-01 00:00:00.5'),
+                         'side': ['buy', 'sell'], 'rate': [1, 2], 'qty': [3, 4]})
+    colDict = {col: col for col in data.columns}
+    dbmgr.insertRecords(dbPath, 'books', data, colDict)
+    dbmgr.insertRecords(dbPath, 'books', data, colDict)
+    assert len(dbmgr.readTable(dbPath, 'books')) == 2
+
+
+# per market and time window reads are served by an index
+@pytest.mark.parametrize("queryStr,expPlan", [
+    ("select * from books where marketID = 1 and TimeStamp between '2024-01-01' and '2024-02-01'",
+     'SEARCH books USING PRIMARY KEY (marketID=? AND TimeStamp>? AND TimeStamp<?)'),
+    ("select * from candles where marketID = 1 and period = '24h' and timeOpen >= '2024-01-01'",
+     'SEARCH candles USING INDEX sqlite_autoindex_candles_1 (marketID=? AND period=? AND timeOpen>?)'),
+    ("select ID from markets where exchangeID = 1",
+     'SEARCH markets USING COVERING INDEX sqlite_autoindex_markets_1 (exchangeID=?)'),
+    ])
+def test_queryPlan(dbPath, queryStr, expPlan):
+    plan = dbmgr.freeQuery(dbPath, f'EXPLAIN QUERY PLAN {queryStr}')
+    assert list(plan['detail']) == [expPlan]
+
+
+def fillBooks(path, markets=3, snapshots=10, levels=4):
+    rows = [(marketID, pd.Timestamp('2024-01-01') + pd.Timedelta(minutes=snapshot), side, rate, rate * 10)
+            for marketID in range(1, markets + 1) for snapshot in range(snapshots)
+            for side in [0, 1] for rate in range(levels)]
+    data = pd.DataFrame(rows, columns=['marketID', 'TimeStamp', 'side', 'rate', 'qty'])
+    dbmgr.insertRecords(path, 'books', data, {col: col for col in data.columns})
+    return data
+
+
+@pytest.mark.parametrize("filters,expClause,expParams", [
+    (None, '', []),
+    ({'marketID': 3}, 'WHERE marketID = ?', [3]),
+    ({'marketID': [1, 2]}, 'WHERE marketID IN ( ?, ? )', [1, 2]),
+    ({'TimeStamp': (pd.Timestamp('2024-01-01'), None), 'side': 'buy'},
+     'WHERE TimeStamp >= ? AND side = ?', ['2024-01-01 00:00:00', 'buy']),
+    ({'TimeStamp': ('2024-01-01', '2024-01-02 00:00:00.5')},
+     'WHERE TimeStamp >= ? AND TimeStamp <= ?', ['2024-01-01', '2024-01-02 00:00:00.5']),
+    ])
+def test_filterClause(filters, expClause, expParams):
+    assert dbmgr.filterClause(filters) == (expClause, expParams)
+
+
+# streamed chunks add up to the full result and never exceed the chunk size
+@pytest.mark.parametrize("chunkSize", [1, 7, 1000])
+def test_iterTable(dbPath, chunkSize):
+    fillBooks(dbPath)
+    filters = {'marketID': [1, 3], 'TimeStamp': (pd.Timestamp('2024-01-01 00:02:00'), pd.Timestamp('2024-01-01 00:05:00'))}
+    chunks = list(dbmgr.iterTable(dbPath, 'books', filters=filters, chunkSize=chunkSize))
+    assert all(len(chunk) <= chunkSize for chunk in chunks)
+    expected = dbmgr.readTable(dbPath, 'books', filters=filters)
+    assert len(expected) == 2 * 4 * 2 * 4
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+
+def test_iterQuery_arrow(dbPath):
+    fillBooks(dbPath)
+    batches = list(dbmgr.iterQuery(dbPath, 'select marketID, sum(qty) as qty from books group by marketID',
+                                   chunkSize=2, arrow=True))
+    assert [batch.num_rows for batch in batches] == [2, 1]
+    assert batches[0].schema.names == ['marketID', 'qty']
+    assert sum(sum(batch.column(1).to_pylist()) for batch in batches) == 3 * 10 * 2 * (0 + 10 + 20 + 30)
+
+
+# the reader connection goes back to the pool when a stream is abandoned
+def test_iterQuery_closed(dbPath):
+    fillBooks(dbPath)
+    session = dbmgr.getSession(dbPath)
+    chunks = dbmgr.iterQuery(dbPath, 'select * from books', chunkSize=5)
+    next(chunks)
+    assert session.readers.qsize() == session.readerCount - 1
+    chunks.close()
+    assert session.readers.qsize() == session.readerCount
+
+
+def insertExchange(path, name):
+    dbmgr.insertRecords(path, 'exchanges', pd.DataFrame({'name': [name]}), {'name': 'name'})
+    # reads inside the group see the rows written before them
+    return len(dbmgr.readTable(path, 'exchanges'))
+
+
+def failingInsert(path, name):
+    insertExchange(path, name)
+    raise Exception('failed')
+
+
+# the queued jobs share a commit, a failing job is rolled back alone
+def test_groupWriter(dbPath):
+    session = dbmgr.getSession(dbPath)
+    writer = dbmgr.GroupWriter(dbPath, groupSize=10, groupDelay=1)
+    with session.write():
+        # the writer waits for the open write, so every job is queued before its group starts
+        futures = [writer.submit(insertExchange, dbPath, 'a'), writer.submit(failingInsert, dbPath, 'b'),
+                   writer.submit(insertExchange, dbPath, 'c')]
+    writer.close()
+    assert writer.groups == 1 and writer.jobs == 3
+    assert futures[0].result() == 1 and futures[2].result() == 2
+    with pytest.raises(Exception, match='failed'):
+        futures[1].result()
+    assert sorted(dbmgr.readTable(dbPath, 'exchanges')['name']) == ['a', 'c']
+    assert not writer.thread.is_alive()
+
+
+# a full queue blocks submit until the writer catches up, close commits what is still queued
+def test_groupWriter_backpressure(dbPath):
+    session = dbmgr.getSession(dbPath)
+    writer = dbmgr.GroupWriter(dbPath, queueSize=2, groupSize=1, groupDelay=0)
+    with session.write():
+        futures = [writer.submit(insertExchange, dbPath, 'a')]
+        # the first job is taken by the writer, which waits for the open write
+        while not writer.queue.empty():
+            time.sleep(0.01)
+        futures += [writer.submit(insertExchange, dbPath, name) for name in ('b', 'c')]
+        assert writer.submit(insertExchange, dbPath, 'd', block=False) is None
+        blocked = threading.Thread(target=lambda: futures.append(writer.submit(insertExchange, dbPath, 'd')))
+        blocked.start()
+        blocked.join(0.2)
+        assert blocked.is_alive()
+    blocked.join()
+    writer.close()
+    assert writer.groups == 4
+    assert [future.result() for future in futures] == [1, 2, 3, 4]
+
+
+# undos run when their savepoint or an enclosing write rolls back, never after a commit
+def test_session_onRollback(dbPath):
+    session = dbmgr.getSession(dbPath)
+    undone = []
+    session.onRollback(lambda: undone.append('outside'))
+    with session.write():
+        session.onRollback(lambda: undone.append('kept'))
+    with pytest.raises(Exception):
+        with session.write():
+            with session.write():
+                session.onRollback(lambda: undone.append('released'))
+            with pytest.raises(Exception):
+                with session.write():
+                    session.onRollback(lambda: undone.append('savepoint'))
+                    raise Exception('savepoint')
+            assert undone == ['savepoint']
+            raise Exception('transaction')
+    assert undone == ['savepoint', 'released']
+    assert session.undos == []
+
+
+# deferred functions run once per key before the outermost write commits, a failing one is
+# rolled back alone and outside a write they run right away
+def test_session_beforeCommit(dbPath):
+    session = dbmgr.getSession(dbPath)
+    ran = []
+
+    def failing():
+        session.writer.execute("insert into exchanges (name) values ('failed')")
+        raise Exception('deferred')
+
+    session.beforeCommit('outside', lambda: ran.append('outside'))
+    with session.write() as conn:
+        for name in ['a', 'b']:
+            with session.write():
+                conn.execute('insert into exchanges (name) values (?)', (name,))
+                session.beforeCommit('count', lambda name=name: ran.append(name))
+                session.beforeCommit('failing', failing)
+        assert ran == ['outside']
+    assert ran == ['outside', 'a']
+    assert dbmgr.freeQuery(dbPath, 'select name from exchanges')['name'].tolist() == ['a', 'b']
+    with pytest.raises(Exception):
+        with session.write():
+            session.beforeCommit('count', lambda: ran.append('rolledBack'))
+            raise Exception('transaction')
+    with session.write():
+        pass
+    assert ran == ['outside', 'a']
@@ -1,7 +1,12 @@
 import pytest
 import dexapi
+import json
 import logging
 import pytest_mock
+import time
+import pandas as pd
+import mockdex
+from mockdex import MockDex
 
 LOGGER = logging.getLogger(__name__)
 
@@ -106,4 +111,166 @@ def test_getCandles(exchangeUrl,base,quote,expLogMessage,expException,returnNone
                 assert actual is None
             else:
                 assert actual is not None
-    checkLog(expLogMessage,caplog)
\ No newline at end of file
+    checkLog(expLogMessage,caplog)
+
+def test_parseMarkets():
+    data = {'assets': [{'id': 42, 'symbol': 'dcr', 'unitinfo': {'conventional': {'conversionFactor': 100000000}}},
+                       {'id': 0, 'symbol': 'btc', 'unitinfo': {'conventional': {'conversionFactor': 1000}}}],
+            'markets': [{'name': 'dcr_btc', 'base': 42, 'quote': 0, 'lotsize': 1},
+                        {'name': 'btc_dcr', 'base': 0, 'quote': 42, 'lotsize': 2}]}
+    markets = dexapi.parseMarkets(data)
+    assert list(markets['base']) == ['dcr', 'btc']
+    assert list(markets['quote']) == ['btc', 'dcr']
+    assert list(markets['baseConversionFactor']) == [100000000, 1000]
+    assert list(markets['quoteConversionFactor']) == [1000, 100000000]
+    data['markets'][0]['quote'] = 7
+    with pytest.raises(Exception, match='not found'):
+        dexapi.parseMarkets(data)
+
+
+# orders are summed per rate and sorted, a level takes the side of its first order
+def test_parseOrderBook():
+    data = {'orders': [{'rate': 30, 'qty': 1, 'side': 2},
+                       {'rate': 10, 'qty': 2, 'side': 1},
+                       {'rate': 30, 'qty': 4, 'side': 2},
+                       {'rate': 20, 'qty': 8, 'side': 1},
+                       {'rate': 10, 'qty': 16, 'side': 1}]}
+    books = dexapi.parseOrderBook(data)
+    assert list(books.columns) == ['rate', 'qty', 'side']
+    assert list(books['rate']) == [10, 20, 30]
+    assert list(books['qty']) == [18, 8, 5]
+    assert list(books['side']) == ['buy', 'buy', 'sell']
+
+
+# the streamed orders match the decoded ones however the body is split
+@pytest.mark.parametrize("chunkSize", [1, 7, 64, 1 << 20])
+def test_parseOrderStream(chunkSize):
+    body = json.dumps({'marketid': 'dcr_btc', 'note': 'ünïcode', 'orders': [
+        {'id': 'a', 'rate': 30, 'qty': 1, 'side': 2},
+        {'id': 'b', 'rate': 10, 'qty': 2, 'side': 1},
+        {'id': 'c', 'rate': 30, 'qty': 4, 'side': 2}], 'seq': 5}, indent=1).encode()
+    chunks = [body[i:i + chunkSize] for i in range(0, len(body), chunkSize)]
+    books = dexapi.parseOrderStream(chunks, capacity=2)
+    pd.testing.assert_frame_equal(books, dexapi.parseOrderBook(json.loads(body)))
+
+
+@pytest.mark.parametrize("body,expMessage", [
+    (b'{"seq": 1}', 'orders key not found'),
+    (b'{"orders": [{"rate": 1, "qty": 1}]}', 'side key not found'),
+    (b'{"orders": [{"rate": 1, "qty": 1, "side": 1}, {"rate"', 'orders array is incomplete'),
+    ])
+def test_parseOrderStream_invalid(body, expMessage):
+    with pytest.raises(Exception, match=expMessage):
+        dexapi.parseOrderStream([body])
+
+
+def test_setDecoder():
+    dexapi.setDecoder('json')
+    assert dexapi.decode is json.loads
+    dexapi.setDecoder('auto')
+    with pytest.raises(Exception):
+        dexapi.setDecoder('simdjson')
+
+
+# streamed and decoded order books from the mock server are the same
+def test_getOrderBook_stream():
+    with MockDex(markets=1, orders=500) as dex:
+        streamed = dexapi.getOrderBook(dex.exchange, 'asset0', 'btc', stream=True)
+        decoded = dexapi.getOrderBook(dex.exchange, 'asset0', 'btc', stream=False)
+    pd.testing.assert_frame_equal(streamed, decoded)
+
+
+@pytest.fixture
+def fastRetries():
+    # short backoff so retry tests don't wait, the defaults are restored afterwards
+    settings = dict(dexapi.httpSettings)
+    dexapi.configureHttp(timeout=1, retries=3, backoff=0.01, maxBackoff=1)
+    yield
+    dexapi.configureHttp(**settings)
+
+
+# failed requests are retried until the server answers
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_getResponse_retry(fastRetries, status):
+    with MockDex(markets=1) as dex:
+        dex.fail('api/config', status, count=2)
+        data = dexapi.getResponse(dex.exchange + '/api/config')
+    assert len(data['markets']) == 1
+    assert dex.statuses == [status, status, 200]
+
+
+# after the last retry the error is raised, client errors are not retried
+@pytest.mark.parametrize("status,expHits", [(503, 4), (404, 1)])
+def test_getResponse_giveUp(fastRetries, status, expHits):
+    with MockDex(markets=1) as dex:
+        dex.fail('api/config', status, count=5)
+        with pytest.raises(Exception):
+            dexapi.getResponse(dex.exchange + '/api/config')
+    assert dex.hits['api/config'] == expHits
+
+
+def test_getResponse_retryAfter(fastRetries):
+    with MockDex(markets=1) as dex:
+        dex.fail('api/config', 429, retryAfter=0.3)
+        start = time.perf_counter()
+        dexapi.getResponse(dex.exchange + '/api/config')
+    assert time.perf_counter() - start >= 0.3
+
+
+# a hung request times out and is sent again
+def test_getResponse_timeout(fastRetries):
+    with MockDex(markets=1) as dex:
+        dex.fail('api/config', 200, delay=1.5)
+        data = dexapi.getResponse(dex.exchange + '/api/config')
+    assert len(data['markets']) == 1
+    assert dex.hits['api/config'] == 2
+
+
+def test_backoffDelay(fastRetries):
+    assert all(0 <= dexapi.backoffDelay(attempt) <= min(1, 0.01 * 2 ** attempt) for attempt in range(10))
+    assert dexapi.backoffDelay(0, '0.5') == 0.5
+    assert dexapi.backoffDelay(0, '120') == 1
+    assert dexapi.backoffDelay(0, 'Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert dexapi.backoffDelay(0, 'soon') <= 0.01
+
+
+# requests to a host reuse one kept alive connection and accept gzip
+def test_getResponse_keepAlive():
+    with MockDex(markets=2, orders=50) as dex:
+        for i in range(10):
+            books = dexapi.getOrderBook(dex.exchange, 'asset0', 'btc')
+        assert books is not None
+    assert len(dex.connections) == 1
+
+
+# markets are only parsed again once the config changed, with random failures on the way
+def test_getMarketsConditional(fastRetries):
+    with MockDex(markets=2, failRate=0.3) as dex:
+        markets, validators = dexapi.getMarketsConditional(dex.exchange, {})
+        assert len(markets) == 2
+        assert dexapi.getMarketsConditional(dex.exchange, validators) == (dexapi.NOT_MODIFIED, validators)
+        # plain requests leave the validators to the caller
+        assert len(dexapi.getMarkets(dex.exchange)) == 2
+        dex.setConfig(mockdex.makeConfig(3))
+        markets, changed = dexapi.getMarketsConditional(dex.exchange, validators)
+        assert len(markets) == 3
+        assert dexapi.getMarketsConditional(dex.exchange, changed)[0] is dexapi.NOT_MODIFIED
+        # validators of a config that wasn't stored don't hide the change
+        assert len(dexapi.getMarketsConditional(dex.exchange, validators)[0]) == 3
+    assert 304 in dex.statuses and 503 in dex.statuses
+
+
+# without validators an identical config body is still reported as unchanged, a body that
+# can't be decoded is not
+def test_getMarketsConditional_contentHash(mocker):
+    with MockDex(markets=2) as dex:
+        markets, validators = dexapi.getMarketsConditional(dex.exchange, {})
+        assert len(markets) == 2
+        validators = {'digest': validators['digest']}
+        assert dexapi.getMarketsConditional(dex.exchange, validators)[0] is dexapi.NOT_MODIFIED
+        mocker.patch('dexapi.decode', side_effect=ValueError('bad body'))
+        dex.setConfig(mockdex.makeConfig(3))
+        assert dexapi.getMarketsConditional(dex.exchange, validators) is None
+        mocker.stopall()
+        assert len(dexapi.getMarketsConditional(dex.exchange, validators)[0]) == 3
+    assert dex.statuses == [200, 200, 200, 200]
@@ -0,0 +1,6 @@
+# small helpers shared by the test modules
+import dbmgr
+
+
+def countRows(path, tableName):
+    return int(dbmgr.freeQuery(path, f'select count(*) as n from {tableName}')['n'].iloc[0])
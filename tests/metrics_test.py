@@ -0,0 +1,101 @@
+import json
+import pstats
+import pytest
+import requests
+import collector
+import dbmgr
+import dexapi
+import metrics
+from mockdex import MockDex
+
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.enabled = True
+    yield
+    metrics.enabled = False
+    metrics.reset()
+
+
+def counter(name, **labels):
+    return metrics.counters.get((name, metrics.labelKey(labels)), 0)
+
+
+def histogramCount(name, **labels):
+    histogram = metrics.histograms.get((name, metrics.labelKey(labels)))
+    return 0 if histogram is None else histogram[1]
+
+
+# nothing is recorded while disabled
+def test_disabled(dbPath):
+    metrics.reset()
+    with MockDex(markets=2, orders=10, candles=5) as dex:
+        collector.runCycle(dbPath, [dex.exchange], requestRate=0)
+    assert metrics.counters == {}
+    assert metrics.histograms == {}
+
+
+# a cycle records the requests, bytes, parse calls, retries and rows written
+def test_cycle(dbPath, enabled):
+    dexapi.configureHttp(backoff=0.01)
+    try:
+        with MockDex(markets=2, orders=10, candles=5) as dex:
+            dex.fail('api/orderbook', 503, count=1)
+            collector.runCycle(dbPath, [dex.exchange], requestRate=0)
+    finally:
+        dexapi.configureHttp(backoff=0.5)
+    assert histogramCount('dexdb_http_request_seconds', endpoint='config') == 1
+    assert histogramCount('dexdb_http_request_seconds', endpoint='orderbook') == 2
+    assert histogramCount('dexdb_http_request_seconds', endpoint='candles') == 2
+    assert counter('dexdb_http_responses_total', endpoint='orderbook', status='503') == 1
+    assert counter('dexdb_http_retries_total', endpoint='orderbook', reason='503') == 1
+    assert counter('dexdb_http_bytes_total', endpoint='config') > 0
+    assert histogramCount('dexdb_parse_seconds', function='parseMarkets') == 1
+    assert histogramCount('dexdb_parse_seconds', function='parseOrderBook') == 2
+    assert histogramCount('dexdb_parse_seconds', function='parseCandles') == 2
+    books = int(dbmgr.freeQuery(dbPath, 'select count(*) as n from books')['n'].iloc[0])
+    assert counter('dexdb_rows_written_total', table='books') == books
+    assert counter('dexdb_rows_written_total', table='candles') == 2 * 5
+    assert histogramCount('dexdb_insert_seconds', table='books') == 2
+
+
+# errors are counted per instrumented call
+def test_errors(enabled):
+    with pytest.raises(Exception):
+        dexapi.parseCandles({})
+    assert counter('dexdb_errors_total', metric='dexdb_parse_seconds', function='parseCandles') == 1
+
+
+# prometheus text with cumulative buckets from the endpoint, json from the dump
+def test_render(tmp_path, enabled):
+    metrics.observe('dexdb_parse_seconds', 0.002, function='parseCandles')
+    metrics.observe('dexdb_parse_seconds', 20, function='parseCandles')
+    metrics.count('dexdb_rows_written_total', 5, table='books')
+    server = metrics.serve(0)
+    try:
+        text = requests.get(f'http://127.0.0.1:{server.server_address[1]}/metrics').text
+    finally:
+        server.shutdown()
+    assert '# TYPE dexdb_parse_seconds histogram' in text
+    assert 'dexdb_parse_seconds_bucket{function="parseCandles",le="0.001"} 0' in text
+    assert 'dexdb_parse_seconds_bucket{function="parseCandles",le="0.0025"} 1' in text
+    assert 'dexdb_parse_seconds_bucket{function="parseCandles",le="+Inf"} 2' in text
+    assert 'dexdb_parse_seconds_count{function="parseCandles"} 2' in text
+    assert 'dexdb_rows_written_total{table="books"} 5' in text
+    path = str(tmp_path / 'metrics.json')
+    metrics.dump(path)
+    with open(path) as file:
+        data = json.load(file)
+    # a snapshot merged into an empty registry gives the same metrics
+    metrics.reset()
+    metrics.merge(data)
+    assert metrics.render() == text
+
+
+# the profile hook writes a pstats file named after the time
+def test_profiled(tmp_path):
+    with metrics.profiled(str(tmp_path / 'cycle-%Y.prof')):
+        sum(range(1000))
+    [path] = list(tmp_path.glob('cycle-*.prof'))
+    assert pstats.Stats(str(path)).total_calls > 0
@@ -0,0 +1,497 @@
+# local stand-in for a dcrdex server, it serves synthetic /api/config, /api/orderbook
+# and /api/candles payloads over plain http so tests and benchmarks don't depend on
+# the live exchange. failures and latency can be injected to exercise the client retries.
+# /ws replays order book feeds to websocket subscribers
+import base64
+import copy
+import gzip
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# dcrdex order sides
+BUY = 1
+SELL = 2
+# candle bin sizes in milliseconds
+binSizes = {'24h': 86400000, '1h': 3600000, '5m': 300000}
+
+
+def makeConfig(nMarkets):
+    # builds an /api/config payload with nMarkets markets quoted in btc
+    assets = [{'id': 0, 'symbol': 'btc', 'unitinfo': {'conventional': {'conversionFactor': 100000000}}}]
+    markets = []
+    for i in range(nMarkets):
+        assetID = 1000 + i
+        assets.append({'id': assetID,
+                       'symbol': f'asset{i}',
+                       'unitinfo': {'conventional': {'conversionFactor': 100000000}}})
+        markets.append({'name': f'asset{i}_btc',
+                        'base': assetID,
+                        'quote': 0,
+                        'epochlen': 15000,
+                        'lotsize': 100000000,
+                        'parcelSize': 100,
+                        'ratestep': 100})
+    return {'assets': assets, 'markets': markets}
+
+
+def makeOrderBook(rng, nOrders, midRate=1000000, rateStep=100, lotSize=100000000):
+    # builds an /api/orderbook payload with nOrders orders spread around midRate
+    orders = []
+    for i in range(nOrders):
+        side = BUY if i % 2 == 0 else SELL
+        offset = rng.randint(1, 500) * rateStep
+        rate = midRate - offset if side == BUY else midRate + offset
+        orders.append({'id': f'{i:064x}',
+                       'side': side,
+                       'qty': rng.randint(1, 20) * lotSize,
+                       'rate': rate,
+                       'time': 0})
+    return {'marketid': '', 'seq': 1, 'epoch': 0, 'orders': orders}
+
+
+def makeCandles(rng, nCandles, period='24h', endMs=None):
+    # builds an /api/candles payload with nCandles bins ending at endMs
+    binMs = binSizes[period]
+    if endMs is None:
+        endMs = int(time.time() * 1000)
+    endMs = endMs - endMs % binMs
+    candles = {'binSize': period, 'startStamps': [], 'endStamps': [], 'matchVolumes': [],
+               'quoteVolumes': [], 'highRates': [], 'lowRates': [], 'startRates': [], 'endRates': []}
+    for i in range(nCandles):
+        start = endMs - (nCandles - i) * binMs
+        low = rng.randint(900000, 1000000)
+        high = low + rng.randint(0, 100000)
+        candles['startStamps'].append(start)
+        candles['endStamps'].append(start + binMs)
+        candles['matchVolumes'].append(rng.randint(0, 50) * 100000000)
+        candles['quoteVolumes'].append(rng.randint(0, 50) * 1000000)
+        candles['highRates'].append(high)
+        candles['lowRates'].append(low)
+        candles['startRates'].append(rng.randint(low, high))
+        candles['endRates'].append(rng.randint(low, high))
+    return candles
+
+
+def makeFeed(rng, book, nNotes, interval=0.01):
+    # builds an order feed following book as [delay seconds, route, payload] notes: orders are
+    # booked, unbooked and partially filled and epoch orders only advance the sequence. the
+    # market id is added when the notes are sent
+    orders = {order['id']: dict(order) for order in book['orders']}
+    seq = book.get('seq', 1)
+    notes = []
+    for i in range(nNotes):
+        seq += 1
+        kind = rng.random()
+        if kind < 0.4 or not orders:
+            side = rng.choice([BUY, SELL])
+            offset = rng.randint(1, 500) * 100
+            order = {'oid': f'{rng.getrandbits(256):064x}', 'side': side, 'qty': rng.randint(1, 20) * 100000000,
+                     'rate': 1000000 - offset if side == BUY else 1000000 + offset, 'tif': 1, 'time': 0}
+            orders[order['oid']] = dict(order, id=order['oid'])
+            route, payload = 'book_order', order
+        elif kind < 0.65:
+            oid = rng.choice(list(orders))
+            del orders[oid]
+            route, payload = 'unbook_order', {'oid': oid}
+        elif kind < 0.9:
+            oid = rng.choice(list(orders))
+            orders[oid]['qty'] = max(1, orders[oid]['qty'] // 2)
+            route, payload = 'update_remaining', {'oid': oid, 'remaining': orders[oid]['qty']}
+        else:
+            route, payload = 'epoch_order', {'oid': f'{rng.getrandbits(256):064x}', 'side': BUY, 'qty': 100000000,
+                                             'rate': 1000000, 'tif': 1, 'time': 0, 'epoch': 1}
+        notes.append([interval, route, dict(payload, seq=seq)])
+    return notes
+
+
+def applyNote(book, route, payload):
+    # applies a feed note to a served order book payload
+    if 'seq' not in payload:
+        return
+    book['seq'] = payload['seq']
+    if route == 'book_order':
+        book['orders'].append({'id': payload['oid'], 'side': payload['side'], 'qty': payload['qty'],
+                               'rate': payload['rate'], 'time': payload.get('time', 0)})
+    elif route == 'unbook_order':
+        book['orders'] = [order for order in book['orders'] if order['id'] != payload['oid']]
+    elif route == 'update_remaining':
+        for order in book['orders']:
+            if order['id'] == payload['oid']:
+                order['qty'] = payload['remaining']
+
+
+# websocket framing for the /ws stand-in, see RFC 6455
+websocketGuid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class WebSocketConnection:
+    def __init__(self, handler):
+        self.rfile = handler.rfile
+        self.wfile = handler.wfile
+        self.sendLock = threading.Lock()
+
+    def sendFrame(self, opcode, data):
+        length = len(data)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 2 ** 16:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        with self.sendLock:
+            self.wfile.write(header + data)
+            self.wfile.flush()
+
+    def send(self, text):
+        self.sendFrame(0x1, text.encode())
+
+    def read(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionResetError('connection closed')
+        return data
+
+    def recv(self):
+        # returns the next text message, None once the client closes the connection
+        while True:
+            first, second = self.read(2)
+            opcode = first & 0x0f
+            length = second & 0x7f
+            if length == 126:
+                length = struct.unpack('>H', self.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self.read(8))[0]
+            mask = self.read(4) if second & 0x80 else b'\0\0\0\0'
+            data = bytes(byte ^ mask[index % 4] for index, byte in enumerate(self.read(length)))
+            if opcode == 0x8:
+                self.sendFrame(0x8, data[:2])
+                return None
+            if opcode == 0x9:
+                self.sendFrame(0xA, data)
+            elif opcode == 0x1:
+                return data.decode()
+
+
+class MockDex:
+    # serves nMarkets synthetic markets, every response is delayed by latency seconds to
+    # emulate a remote host. failRate of the requests are answered with a 503, fail() queues
+    # specific failures for a route. /api/config carries an ETag and Last-Modified and answers
+    # conditional requests with a 304, bodies are gzipped when the client accepts it. hits per
+    # route, the client connections and the peak number of in flight requests are recorded for
+    # assertions.
+    # payloads are built up front, lazy builds them per request from a per market seed instead
+    # so thousands of markets with deep books fit in memory. feeds holds the notes replayed per
+    # (base, quote) to /ws subscribers, feedSpeed accelerates their delays and notes whose seq is
+    # in dropSeqs are applied to the served book without being sent
+    def __init__(self, markets=4, orders=50, candles=30, latency=0.0, seed=1, failRate=0.0, lazy=False):
+        self.latency = latency
+        self.failRate = failRate
+        self.failRng = random.Random(seed)
+        self.failures = {}
+        self.statuses = []
+        self.connections = set()
+        self.lastModified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+        self.config = makeConfig(markets)
+        self.seed = seed
+        self.orders = orders
+        self.nCandles = candles
+        self.lazy = lazy
+        self.books = {}
+        self.candles = {}
+        if not lazy:
+            rng = random.Random(seed)
+            for market in self.config['markets']:
+                base, quote = market['name'].split('_')
+                self.books[(base, quote)] = makeOrderBook(rng, orders)
+                self.candles[(base, quote)] = {period: makeCandles(rng, candles, period) for period in binSizes}
+        self.hits = {}
+        self.paths = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.feeds = {}
+        self.feedSpeed = 1.0
+        self.dropSeqs = set()
+        self.feedLock = threading.Lock()
+        self.subscribers = {}
+        self.replays = {}
+        self.sockets = set()
+
+    def fail(self, route, status, count=1, retryAfter=None, delay=0.0):
+        # the next count requests to route (e.g. 'api/config') are answered with status after
+        # sleeping delay seconds, a delay beyond the client timeout emulates a hung request
+        with self.lock:
+            self.failures.setdefault(route, []).extend([(status, retryAfter, delay)] * count)
+
+    def setConfig(self, config):
+        # replaces the served config, its ETag and Last-Modified change with it
+        self.config = config
+        self.lastModified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+
+    @property
+    def etag(self):
+        return '"' + hashlib.sha1(json.dumps(self.config, sort_keys=True).encode()).hexdigest() + '"'
+
+    @property
+    def exchange(self):
+        # the exchange string to hand to dexapi
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    @classmethod
+    def load(cls, folder, **options):
+        # serves the payloads saved in folder, e.g. recorded from a live exchange by
+        # benchmarks/record.py: config.json, orderbook/<base>_<quote>.json and
+        # candles/<base>_<quote>_<period>.json
+        dex = cls(markets=0, **options)
+        with open(os.path.join(folder, 'config.json')) as file:
+            dex.config = json.load(file)
+        for name in sorted(os.listdir(os.path.join(folder, 'orderbook'))):
+            with open(os.path.join(folder, 'orderbook', name)) as file:
+                dex.books[tuple(name[:-len('.json')].split('_'))] = json.load(file)
+        for name in sorted(os.listdir(os.path.join(folder, 'candles'))):
+            base, quote, period = name[:-len('.json')].split('_')
+            with open(os.path.join(folder, 'candles', name)) as file:
+                dex.candles.setdefault((base, quote), {})[period] = json.load(file)
+        # feeds recorded after the order book snapshot
+        if os.path.isdir(os.path.join(folder, 'feed')):
+            for name in sorted(os.listdir(os.path.join(folder, 'feed'))):
+                with open(os.path.join(folder, 'feed', name)) as file:
+                    dex.feeds[tuple(name[:-len('.json')].split('_'))] = json.load(file)
+        return dex
+
+    def save(self, folder, periods=None):
+        # writes the served payloads in the layout load reads
+        os.makedirs(os.path.join(folder, 'orderbook'), exist_ok=True)
+        os.makedirs(os.path.join(folder, 'candles'), exist_ok=True)
+        with open(os.path.join(folder, 'config.json'), 'w') as file:
+            json.dump(self.config, file)
+        for market in self.config['markets']:
+            base, quote = market['name'].split('_')
+            with open(os.path.join(folder, 'orderbook', f'{base}_{quote}.json'), 'w') as file:
+                json.dump(self.book(base, quote), file)
+            for period in periods or binSizes:
+                series = self.series(base, quote, period)
+                if series is not None:
+                    with open(os.path.join(folder, 'candles', f'{base}_{quote}_{period}.json'), 'w') as file:
+                        json.dump(series, file)
+
+    def marketRng(self, base, quote, kind):
+        # random generator of a lazily built payload, the same market gets the same payload
+        return random.Random(f'{self.seed}-{base}_{quote}-{kind}')
+
+    def listed(self, base, quote):
+        return any(market['name'] == f'{base}_{quote}' for market in self.config['markets'])
+
+    def book(self, base, quote):
+        book = self.books.get((base, quote))
+        if book is None and self.lazy and self.listed(base, quote):
+            book = makeOrderBook(self.marketRng(base, quote, 'orderbook'), self.orders)
+        return book
+
+    def series(self, base, quote, period):
+        series = self.candles.get((base, quote), {}).get(period)
+        if series is None and self.lazy and period in binSizes and self.listed(base, quote):
+            series = makeCandles(self.marketRng(base, quote, period), self.nCandles, period)
+        return series
+
+    def route(self, path):
+        # returns the http status and payload for a request path
+        parts = path.strip('/').split('/')
+        if parts[:2] == ['api', 'config']:
+            return 200, self.config
+        if parts[:2] == ['api', 'orderbook'] and len(parts) == 4:
+            # feeds change the served books while they replay
+            with self.feedLock:
+                book = copy.deepcopy(self.book(parts[2], parts[3]))
+            if book is not None:
+                return 200, book
+        if parts[:2] == ['api', 'candles'] and len(parts) in (5, 6):
+            series = self.series(parts[2], parts[3], parts[4])
+            if series is not None and len(parts) == 6:
+                # only the latest count candles
+                count = int(parts[5])
+                series = {key: value[-count:] if isinstance(value, list) else value for key, value in series.items()}
+            if series is not None:
+                return 200, series
+        return 404, {'error': 'not found'}
+
+    def subscribe(self, socket, message):
+        # answers an orderbook subscription with the current book, the notes that follow are
+        # sent to every subscriber of the market
+        symbols = {asset['id']: asset['symbol'] for asset in self.config['assets']}
+        payload = message.get('payload') or {}
+        key = (symbols.get(payload.get('base')), symbols.get(payload.get('quote')))
+        with self.feedLock:
+            book = self.book(*key)
+            if book is None:
+                socket.send(json.dumps({'type': 2, 'id': message.get('id'),
+                                        'payload': {'result': None, 'error': {'code': 1, 'message': 'unknown market'}}}))
+                return
+            self.books[key] = book
+            result = dict(book, marketid='_'.join(key), orders=[dict(order, oid=order['id']) for order in book['orders']])
+            socket.send(json.dumps({'type': 2, 'id': message.get('id'), 'payload': {'result': result, 'error': None}}))
+            self.subscribers.setdefault(key, set()).add(socket)
+            if key in self.feeds and key not in self.replays:
+                self.replays[key] = threading.Thread(target=self.replay, args=(key,), daemon=True)
+                self.replays[key].start()
+
+    def replay(self, key):
+        for delay, route, payload in self.feeds[key]:
+            time.sleep(delay / self.feedSpeed)
+            if self.server is None:
+                return
+            with self.feedLock:
+                applyNote(self.books[key], route, payload)
+                if payload.get('seq') in self.dropSeqs:
+                    continue
+                text = json.dumps({'type': 3, 'route': route, 'payload': dict(payload, marketid='_'.join(key))})
+                for socket in list(self.subscribers.get(key, ())):
+                    try:
+                        socket.send(text)
+                    except (OSError, ValueError):
+                        self.subscribers[key].discard(socket)
+
+    def waitFeeds(self, timeout=None):
+        # waits for the started replays to send their last note
+        for thread in list(self.replays.values()):
+            thread.join(timeout)
+
+    def dropConnections(self):
+        # closes every websocket connection, e.g. to exercise reconnects
+        for socket in list(self.sockets):
+            try:
+                socket.sendFrame(0x8, struct.pack('>H', 1001))
+            except (OSError, ValueError):
+                pass
+
+    def serveWebSocket(self, handler):
+        key = handler.headers['Sec-WebSocket-Key']
+        accept = base64.b64encode(hashlib.sha1((key + websocketGuid).encode()).digest()).decode()
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+        socket = WebSocketConnection(handler)
+        with self.lock:
+            self.sockets.add(socket)
+        try:
+            while True:
+                text = socket.recv()
+                if text is None:
+                    break
+                message = json.loads(text)
+                if message.get('type') == 1 and message.get('route') == 'orderbook':
+                    self.subscribe(socket, message)
+                elif message.get('type') == 1 and message.get('route') == 'unsub_orderbook':
+                    key = tuple((message.get('payload') or {}).get('marketid', '').split('_'))
+                    with self.feedLock:
+                        self.subscribers.get(key, set()).discard(socket)
+                    socket.send(json.dumps({'type': 2, 'id': message.get('id'), 'payload': {'result': True, 'error': None}}))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.feedLock:
+                for subscribers in self.subscribers.values():
+                    subscribers.discard(socket)
+            with self.lock:
+                self.sockets.discard(socket)
+
+    def handle(self, handler):
+        route = '/'.join(handler.path.strip('/').split('/')[:2])
+        if handler.headers.get('Upgrade', '').lower() == 'websocket':
+            with self.lock:
+                self.hits[route] = self.hits.get(route, 0) + 1
+            self.serveWebSocket(handler)
+            return
+        with self.lock:
+            self.hits[route] = self.hits.get(route, 0) + 1
+            self.paths.append(handler.path)
+            self.connections.add(handler.client_address)
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            failure = None
+            if self.failures.get(route):
+                failure = self.failures[route].pop(0)
+            elif self.failRate and self.failRng.random() < self.failRate:
+                failure = (503, None, 0.0)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            headers = {}
+            if failure is not None:
+                status, retryAfter, delay = failure
+                time.sleep(delay)
+                payload = {'error': 'injected failure'}
+                if retryAfter is not None:
+                    headers['Retry-After'] = str(retryAfter)
+            else:
+                status, payload = self.route(handler.path)
+                if route == 'api/config':
+                    headers = {'ETag': self.etag, 'Last-Modified': self.lastModified}
+                    # the ETag takes precedence over the modification time when both are sent
+                    if 'If-None-Match' in handler.headers:
+                        unchanged = handler.headers['If-None-Match'] == self.etag
+                    else:
+                        unchanged = handler.headers.get('If-Modified-Since') == self.lastModified
+                    if unchanged:
+                        status, payload = 304, None
+            with self.lock:
+                self.statuses.append(status)
+            body = json.dumps(payload).encode() if payload is not None else b''
+            if body and 'gzip' in handler.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+            handler.send_response(status)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(body)))
+            for key, value in headers.items():
+                handler.send_header(key, value)
+            handler.end_headers()
+            handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on a delayed response
+            pass
+        finally:
+            with self.lock:
+                self.inFlight -= 1
+
+    def start(self):
+        dex = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                dex.handle(self)
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
@@ -0,0 +1,98 @@
+import sqlite3
+import pandas as pd
+import pytest
+import dashData
+import dbmgr
+import querycache
+
+exchangesQry = 'select name from exchanges order by name'
+
+
+@pytest.fixture
+def dbPath(dbPath, monkeypatch):
+    dbmgr.insertRecords(dbPath, 'exchanges', pd.DataFrame({'name': ['a']}), {'name': 'name'})
+    monkeypatch.setattr(querycache, 'persistPath', None)
+    querycache.clear()
+    yield dbPath
+    querycache.clear()
+
+
+def rawInsert(path, name, bump=False):
+    # a write from another connection, only seen by the cache when its counter is bumped
+    conn = sqlite3.connect(path)
+    conn.execute('insert into exchanges (name) values (?)', (name,))
+    if bump:
+        dbmgr.tableWritten(conn, 'exchanges')
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("queryStr,expected,tables", [
+    ('SELECT *\n  FROM   Candles c\tJOIN markets m on c.marketID = m.ID;',
+     'select * from candles c join markets m on c.marketid = m.id', ['candles', 'markets']),
+    ("select * from candles where period = '24H  x' ", "select * from candles where period = '24H  x'", ['candles']),
+    ])
+def test_normalize(queryStr, expected, tables):
+    assert querycache.normalize(queryStr) == expected
+    assert querycache.queryTables(expected) == tables
+
+
+# a result is served until a table it reads is written, by this or another connection
+def test_query_invalidation(dbPath):
+    assert list(querycache.query(dbPath, exchangesQry)['name']) == ['a']
+    rawInsert(dbPath, 'b')
+    assert list(querycache.query(dbPath, '  SELECT name FROM exchanges ORDER BY name')['name']) == ['a']
+    dbmgr.insertRecords(dbPath, 'exchanges', pd.DataFrame({'name': ['c']}), {'name': 'name'})
+    assert list(querycache.query(dbPath, exchangesQry)['name']) == ['a', 'b', 'c']
+    rawInsert(dbPath, 'd', bump=True)
+    assert list(querycache.query(dbPath, exchangesQry)['name']) == ['a', 'b', 'c', 'd']
+    # writes to other tables keep the result, parameters are part of the key
+    dbmgr.insertRecords(dbPath, 'markets', pd.DataFrame({'exchangeID': [1], 'name': ['dcr_btc']}),
+                        {'exchangeID': 'exchangeID', 'name': 'name'})
+    rawInsert(dbPath, 'e')
+    assert len(querycache.query(dbPath, exchangesQry)) == 4
+    assert list(querycache.query(dbPath, 'select name from exchanges where name > ?', ('c',))['name']) == ['d', 'e']
+
+
+# callers get a copy, the least recently used results are evicted over maxBytes
+def test_query_lru(dbPath, monkeypatch):
+    frame = querycache.query(dbPath, exchangesQry)
+    frame['name'] = 'changed'
+    assert list(querycache.query(dbPath, exchangesQry)['name']) == ['a']
+    size = querycache.resultsBytes
+    monkeypatch.setattr(querycache, 'maxBytes', 2 * size)
+    for number in range(3):
+        querycache.query(dbPath, f'select name from exchanges where ID > {number}')
+    assert len(querycache.results) == 2
+    assert querycache.resultsBytes <= 2 * size
+    assert [key for key in querycache.results if exchangesQry in key] == []
+
+
+# persisted results are served to a new process while the tables are unchanged
+def test_query_persist(dbPath, tmp_path, monkeypatch):
+    monkeypatch.setattr(querycache, 'persistPath', str(tmp_path / 'cache'))
+    data = dashData.getBookData(dbPath)
+    querycache.query(dbPath, exchangesQry)
+    assert len(list((tmp_path / 'cache').glob('*.feather'))) == 2
+    # a new process starts with an empty memory
+    querycache.results.clear()
+    rawInsert(dbPath, 'b')
+    assert list(querycache.query(dbPath, exchangesQry)['name']) == ['a']
+    pd.testing.assert_frame_equal(dashData.getBookData(dbPath), data)
+    querycache.results.clear()
+    rawInsert(dbPath, 'c', bump=True)
+    assert list(querycache.query(dbPath, exchangesQry)['name']) == ['a', 'b', 'c']
+
+
+# timestamps are parsed as before, cached or not
+def test_getCandleData(dbPath, monkeypatch):
+    candles = pd.DataFrame({'marketID': [1, 1], 'period': '24h',
+                            'timeOpen': pd.to_datetime(['2024-01-01', '2024-01-02']),
+                            'timeClose': pd.to_datetime(['2024-01-02', '2024-01-03']),
+                            'baseVolume': 1, 'quoteVolume': 2, 'high': 3, 'low': 4, 'open': 5, 'close': 6})
+    dbmgr.insertRecords(dbPath, 'candles', candles, {col: col for col in candles.columns})
+    cached = dashData.getCandleData(dbPath)
+    assert str(cached['timeOpen'].dtype) == 'datetime64[ns, UTC]'
+    assert list(cached['timeClose']) == list(pd.to_datetime(['2024-01-02', '2024-01-03'], utc=True))
+    monkeypatch.setattr(querycache, 'enabled', False)
+    pd.testing.assert_frame_equal(dashData.getCandleData(dbPath), cached)
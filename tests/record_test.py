@@ -0,0 +1,36 @@
+import collector
+from benchmarks import record
+from helpers import countRows
+from mockdex import MockDex
+
+
+# payloads recorded from a server are replayed unchanged by a mock loaded from the fixtures
+def test_recordAndLoad(tmp_path, dbPath):
+    folder = str(tmp_path / 'fixtures')
+    with MockDex(markets=4, orders=20, candles=10) as dex:
+        names = record.record(dex.exchange, folder, markets=3, periods=['24h', '1h'])
+        books = {key: dex.books[key] for key in dex.books}
+    assert names == ['asset0_btc', 'asset1_btc', 'asset2_btc']
+    with MockDex.load(folder) as replay:
+        assert len(replay.config['markets']) == 3
+        assert replay.books[('asset1', 'btc')] == books[('asset1', 'btc')]
+        results = collector.runCycle(dbPath, [replay.exchange], requestRate=0, candlePeriods=['24h', '1h'])
+    assert len(results[0]) == 3
+    assert countRows(dbPath, 'candles') == 3 * 2 * 10
+
+
+# lazy payloads are built per request, the same market always gets the same payload
+def test_lazy(tmp_path, dbPath):
+    with MockDex(markets=500, orders=20, candles=5, lazy=True) as dex:
+        assert dex.books == {}
+        assert dex.book('asset7', 'btc') == dex.book('asset7', 'btc')
+        assert dex.book('asset7', 'btc') != dex.book('asset8', 'btc')
+        assert dex.book('asset7', 'eth') is None
+        dex.save(str(tmp_path / 'saved'), periods=['24h'])
+        # hourly candles skip the daily rollups, which dominate the cycle time
+        results = collector.runCycle(dbPath, [dex.exchange], requestRate=0, candlePeriods=['1h'])
+    assert len(results[0]) == 500
+    assert dex.hits['api/orderbook'] == 500
+    assert countRows(dbPath, 'candles') == 500 * 5
+    loaded = MockDex.load(str(tmp_path / 'saved'))
+    assert loaded.books[('asset7', 'btc')] == dex.book('asset7', 'btc')
@@ -0,0 +1,105 @@
+import threading
+import pytest
+import collector
+import dbmgr
+import dexapi
+import mockdex
+import rollups
+import pandas as pd
+
+
+@pytest.fixture
+def markets(dbPath):
+    # two markets quoted in btc on one exchange
+    exchanges = collector.storeExchanges(dbPath, ['dex'])
+    markets = collector.storeMarkets(dbPath, exchanges.iloc[0], dexapi.parseMarkets(mockdex.makeConfig(2)))
+    yield dbPath, markets
+
+
+def makeCandles(start, days, volume=1):
+    # daily candles with a base volume of volume conventional units and a quote volume of 2x
+    startStamps = pd.date_range(start, periods=days, freq='D')
+    return pd.DataFrame({'startStamps': startStamps, 'endStamps': startStamps + pd.Timedelta(days=1),
+                         'matchVolumes': volume * 100000000, 'quoteVolumes': 2 * volume * 100000000,
+                         'highRates': 2, 'lowRates': 1, 'startRates': 1, 'endRates': 2})
+
+
+def priceSource(assets, metric, dateStart, dateEnd):
+    # asset0 is worth 10 USD and btc 1000 USD, asset1 has no price
+    dates = pd.date_range(dateStart, dateEnd, freq='D').strftime('%Y-%m-%d')
+    values = {'asset0': 10.0, 'btc': 1000.0}
+    rows = [(asset, date, values[asset]) for asset in assets if asset in values for date in dates]
+    return pd.DataFrame(rows, columns=['asset', 'date', 'value'])
+
+
+# storing candles keeps the daily, weekly and monthly rollups equal to a full aggregation
+def test_storeCandles_rollups(markets):
+    path, markets = markets
+    # 2024-01-29 is a monday, the candles span two months and several weeks
+    collector.storeCandles(path, markets.iloc[0], makeCandles('2024-01-29', 10))
+    collector.storeCandles(path, markets.iloc[1], makeCandles('2024-01-30', 3, volume=5))
+    # a later batch overlapping the last stored candle
+    collector.storeCandles(path, markets.iloc[0], makeCandles('2024-02-07', 5, volume=3))
+    daily = rollups.getVolumes(path, '1d')
+    assert len(daily) == 14 + 3
+    weekly = rollups.getVolumes(path, '1w', market='asset0_btc')
+    assert list(weekly['periodStart'].dt.strftime('%Y-%m-%d')) == ['2024-01-29', '2024-02-05']
+    assert list(weekly['baseVolume']) == [7.0, 2 + 5 * 3]
+    assert list(weekly['candles']) == [7, 7]
+    monthly = rollups.getVolumes(path, '1mo')
+    expected = daily.assign(month=daily['periodStart'].dt.strftime('%Y-%m')).groupby(['month', 'market'])['baseVolume'].sum()
+    assert list(monthly['baseVolume']) == list(expected)
+    exchange = rollups.getVolumes(path, '1mo', level='exchange')
+    assert list(exchange['quoteAsset']) == ['btc', 'btc']
+    assert list(exchange['quoteVolume']) == list(2 * monthly.groupby('periodStart')['baseVolume'].sum())
+    assert list(exchange['markets']) == [2, 2]
+    assert exchange['baseVolumeUSD'].isna().all()
+
+
+# USD volumes are priced per candle, periods with an unpriced candle or market stay null
+def test_updateRollups_usd(markets):
+    path, markets = markets
+    collector.storeCandles(path, markets.iloc[0], makeCandles('2024-01-01', 3))
+    collector.storeCandles(path, markets.iloc[1], makeCandles('2024-01-01', 3))
+    rollups.rebuildRollups(path, source=priceSource)
+    daily = rollups.getVolumes(path, '1d', start='2024-01-02', end='2024-01-02')
+    assert list(daily['market']) == ['asset0_btc', 'asset1_btc']
+    assert daily['baseVolumeUSD'].iloc[0] == 10.0
+    assert pd.isna(daily['baseVolumeUSD'].iloc[1])
+    assert list(daily['quoteVolumeUSD']) == [2000.0, 2000.0]
+    exchange = rollups.getVolumes(path, '1w', level='exchange', exchange='dex')
+    assert exchange['quoteVolumeUSD'].iloc[0] == 2 * 3 * 2000.0
+    assert pd.isna(exchange['baseVolumeUSD'].iloc[0])
+
+
+# a group of candle writes totals the exchange periods once, with the prices requested before
+# the writes
+def test_storeCandles_group(markets, mocker):
+    path, markets = markets
+    calls = []
+
+    def countedSource(*args):
+        calls.append(threading.current_thread().name)
+        return priceSource(*args)
+
+    updateExchanges = mocker.spy(rollups, 'updateExchanges')
+    with dbmgr.GroupWriter(path, groupSize=4, groupDelay=1) as writer:
+        futures = []
+        for idx, market in markets.iterrows():
+            candles = makeCandles('2024-01-01', 3)
+            prices = rollups.candlePrices(path, market, candles, countedSource)
+            futures.append(writer.submit(collector.storeCandles, path, market, candles, '24h', prices))
+        for future in futures:
+            future.result()
+    assert updateExchanges.call_count == 1
+    assert calls and f'writer {path}' not in calls
+    exchange = rollups.getVolumes(path, '1d', level='exchange', exchange='dex')
+    assert list(exchange['quoteVolume']) == [4.0, 4.0, 4.0]
+    assert list(exchange['markets']) == [2, 2, 2]
+    assert list(exchange['quoteVolumeUSD']) == [4000.0, 4000.0, 4000.0]
+
+
+def test_getVolumes_invalid(markets):
+    path, markets = markets
+    with pytest.raises(Exception):
+        rollups.getVolumes(path, level='asset')
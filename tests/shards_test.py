@@ -0,0 +1,44 @@
+import pytest
+import shards
+from helpers import countRows
+from mockdex import MockDex
+
+
+# exchanges and their market shards are spread round robin over the processes
+def test_makeShards():
+    exchanges = [{'ID': n, 'name': f'dex{n}'} for n in range(3)]
+    result = shards.makeShards(exchanges, 4, marketShards=2)
+    assert len(result) == 4
+    assert sorted(len(shard) for shard in result) == [1, 1, 2, 2]
+    assert sorted((exchange['name'], index) for shard in result for exchange, index, count in shard) == \
+        [(f'dex{n}', index) for n in range(3) for index in range(2)]
+    assert len(shards.makeShards(exchanges, 8)) == 3
+
+
+# every exchange is collected by a worker process and stored by the parent, a second cycle only
+# requests the candles from the high water mark onwards
+@pytest.mark.parametrize("marketShards", [1, 2])
+def test_runSharded(dbPath, marketShards):
+    with MockDex(markets=3, orders=10, candles=10) as first, MockDex(markets=2, orders=10, candles=10, seed=2) as second:
+        results = shards.runSharded(dbPath, [first.exchange, second.exchange], processes=2,
+                                    marketShards=marketShards, requestRate=0)
+        assert [len(result) for result in results] == [3, 2]
+        assert countRows(dbPath, 'markets') == 5
+        assert countRows(dbPath, 'candles') == 5 * 10
+        assert countRows(dbPath, 'books') > 0
+        first.paths.clear()
+        shards.runSharded(dbPath, [first.exchange, second.exchange], processes=2,
+                          marketShards=marketShards, requestRate=0)
+    candlePaths = [path for path in first.paths if path.startswith('/api/candles')]
+    assert len(candlePaths) == 3
+    assert all(int(path.split('/')[-1]) <= 3 for path in candlePaths)
+    assert countRows(dbPath, 'candles') == 5 * 10
+
+
+# an unreachable exchange only fails its own shard
+def test_runSharded_failingExchange(dbPath):
+    with MockDex(markets=2, orders=5, candles=5) as dex:
+        results = shards.runSharded(dbPath, ['http://127.0.0.1:1', dex.exchange], processes=2, requestRate=0)
+    assert results[0] is None
+    assert len(results[1]) == 2
+    assert countRows(dbPath, 'candles') == 2 * 5